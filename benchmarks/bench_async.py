@@ -0,0 +1,129 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlencode
+
+from bench_search import make_queries, percentiles
+from corpus import load_corpus_settings
+
+# Bursty load on the async search API (processor/asgi.py), with and without
+# coalescing of identical searches in flight. Each burst is a query nobody
+# asked before (so no cache has it) sent by many clients at once, mixed with a
+# few other new queries, all within a short window; this is how a trending
+# query arrives. The ASGI application is called in-process, without an HTTP
+# server, so only the processor's own work is measured. Run with INDEX_DIR
+# pointing at an index built from the corpus; run.py does not run this one.
+# Prints one JSON object.
+#
+#   $ INDEX_DIR=work/indexer-1000-stages/index python bench_async.py work/corpus-1000
+
+
+async def request(app, path, params):
+    scope = {
+        "type": "http",
+        "method": "GET",
+        "path": path,
+        "query_string": urlencode(params).encode("latin-1"),
+        "headers": [],
+    }
+    response = {}
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+
+    await app(scope, receive, send)
+    return response["status"]
+
+
+async def client(app, query, k, delay):
+    await asyncio.sleep(delay)
+    start = time.perf_counter()
+    status = await request(app, "/api/search", {"query": query, "k": k})
+    return time.perf_counter() - start, status
+
+
+async def run_bursts(app, bursts, k, window, rng):
+    # bursts: [(trending query, burst size, [other queries])]
+    latencies, statuses = [], []
+    for trending, size, others in bursts:
+        queries = [trending] * size + others
+        results = await asyncio.gather(
+            *(client(app, query, k, rng.uniform(0, window)) for query in queries)
+        )
+        latencies += [latency for latency, _ in results]
+        statuses += [status for _, status in results]
+    return latencies, statuses
+
+
+def benchmark(corpus, bursts, burst_size, others, window, k, seed=7):
+    import asgi  # loads the index from INDEX_DIR
+    import app
+
+    settings = load_corpus_settings(corpus)
+    queries = [query for _, query in make_queries(settings, bursts * (1 + others))]
+    plan = [
+        (
+            queries[i * (1 + others)],
+            burst_size,
+            queries[i * (1 + others) + 1 : (i + 1) * (1 + others)],
+        )
+        for i in range(bursts)
+    ]
+
+    results = {}
+    for coalesce in (False, True):
+        app.result_cache.clear()
+        app.correction_cache.clear()
+        asgi.searcher.coalesce = coalesce
+        before_coalesced = asgi.coalesced_total.value()
+        before_rejected = asgi.rejected_total.value()
+        start = time.perf_counter()
+        latencies, statuses = asyncio.run(
+            run_bursts(asgi.app, plan, k, window, random.Random(seed))
+        )
+        elapsed = time.perf_counter() - start
+        results["coalesced" if coalesce else "uncoalesced"] = {
+            "requests": len(latencies),
+            "seconds": round(elapsed, 4),
+            "queries_per_second": round(len(latencies) / elapsed, 2),
+            "latency_ms": percentiles(latencies),
+            "coalesced": asgi.coalesced_total.value() - before_coalesced,
+            "rejected": asgi.rejected_total.value() - before_rejected,
+            "errors": sum(1 for status in statuses if status not in (200, 503)),
+        }
+    asgi.searcher.close()
+    app.scatter_gather.close()
+    return {
+        "bursts": bursts,
+        "burst_size": burst_size,
+        "other_queries_per_burst": others,
+        "window_ms": window * 1000,
+        "threads": asgi.SEARCH_THREADS,
+        "queue": asgi.SEARCH_QUEUE,
+        **results,
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Bursty load on the async API")
+    parser.add_argument("corpus", help="corpus the index was built from")
+    parser.add_argument("--bursts", type=int, default=50)
+    parser.add_argument("--burst-size", type=int, default=32, help="clients per burst")
+    parser.add_argument("--others", type=int, default=4, help="other queries per burst")
+    parser.add_argument("--window", type=float, default=0.02, help="seconds per burst")
+    parser.add_argument("--k", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = benchmark(
+        args.corpus, args.bursts, args.burst_size, args.others, args.window, args.k
+    )
+    print(json.dumps(result))
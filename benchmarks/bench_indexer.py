@@ -0,0 +1,131 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+
+INDEXER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer")
+sys.path.insert(0, INDEXER_DIR)
+from indexer import (
+    build_tfidf_index,
+    extract_text_from_html,
+    save_inverted_index_json,
+)
+from binary_index import write_binary_index
+from generations import new_generation, publish_generation, writer_lock
+from incremental_index import build_archive_manifest, build_manifest
+from near_duplicates import NearDuplicateDetector
+from page_archive import has_archive, live_pages
+from spelling_index import write_spelling_index
+from startup_bundle import write_startup_bundle
+
+# Times the stages of a full build of indexer.py one after another, in a
+# fresh process started by run.py, in the current directory. Unlike
+# indexer.py, the extracted texts are kept in memory between stages so every
+# stage can be timed on its own. Prints one JSON object.
+
+
+def peak_rss_mb():
+    # High-water mark of this process and of its finished worker processes
+    # (ru_maxrss is in KB on Linux)
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return round(max(own, children) / 1024, 1)
+
+
+class Stages:
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, function, *args, **kwargs):
+        start = time.perf_counter()
+        value = function(*args, **kwargs)
+        self.results[name] = {
+            "seconds": round(time.perf_counter() - start, 4),
+            "peak_rss_mb": peak_rss_mb(),
+        }
+        return value
+
+
+def find_near_duplicates(filenames, texts):
+    detector = NearDuplicateDetector()
+    for filename, text in zip(filenames, texts):
+        detector.add(filename, text)
+    return detector
+
+
+def benchmark(corpus, workers=None, num_shards=1):
+    stages = Stages()
+    generation_dir = new_generation()
+    archive_dir = corpus if has_archive(corpus) else None
+    pages = live_pages(archive_dir) if archive_dir is not None else None
+
+    documents, filenames = extract_text_from_html(
+        corpus, generation_dir, workers, num_shards, archive_dir, pages
+    )
+    texts = stages.run("extraction", list, documents)
+    stages.run("near_duplicates", find_near_duplicates, filenames, texts)
+    vectorizer, tfidf_matrix = stages.run("vectorization", build_tfidf_index, texts)
+    stages.run(
+        "inverted_index_json",
+        save_inverted_index_json,
+        vectorizer,
+        tfidf_matrix,
+        filenames,
+    )
+    stages.run(
+        "binary_index",
+        write_binary_index,
+        vectorizer,
+        tfidf_matrix,
+        filenames,
+        generation_dir,
+        num_shards=num_shards,
+    )
+
+    def finish():
+        if archive_dir is not None:
+            build_archive_manifest(pages, filenames, generation_dir)
+        else:
+            build_manifest(corpus, filenames, generation_dir)
+        write_spelling_index(generation_dir)
+        write_startup_bundle(generation_dir)
+        publish_generation(generation_dir)
+
+    stages.run("manifest_and_spelling", finish)
+    return {
+        "documents": tfidf_matrix.shape[0],
+        "terms": tfidf_matrix.shape[1],
+        "postings": int(tfidf_matrix.nnz),
+        "index_bytes": directory_size("index"),
+        "stages": stages.results,
+        "total_seconds": round(sum(s["seconds"] for s in stages.results.values()), 4),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Time the stages of a full build")
+    parser.add_argument("corpus", help="crawl archive or directory of .html files")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--shards", type=int, default=1)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    shutil.rmtree("index", ignore_errors=True)
+    os.makedirs("index")
+    with writer_lock():
+        result = benchmark(os.path.abspath(args.corpus), args.workers, args.shards)
+    print(json.dumps(result))
@@ -0,0 +1,149 @@
+import os
+import sys
+import json
+import time
+import argparse
+
+from bench_search import make_queries, percentiles
+from corpus import load_corpus_settings
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "processor"))
+
+# Latency against accuracy of score-at-a-time ranking with a budget
+# (evaluator.py, QUERY_STRATEGY=saat). Takes two full builds of the same
+# corpus: one with float32 weights, whose exact daat ranking is the reference,
+# and one with --weights impact. Every query of the mix is ranked on the
+# impact index with each postings budget and time budget, and compared with
+# the reference: recall@k (the share of the exact top k that was found), how
+# often the whole top k came out in the exact order, and the largest score
+# difference. The ranking is called in-process, without the app, so spelling
+# correction and stopwords are left out. Prints one JSON object.
+#
+#   $ python ../indexer/indexer.py ...                     # in work/exact
+#   $ python ../indexer/indexer.py --weights impact ...    # in work/impact
+#   $ python bench_saat.py work/corpus-10000 work/exact/index work/impact/index
+
+
+def open_index(index_dir):
+    from index_reader import SegmentedIndex
+
+    with open(os.path.join(index_dir, "CURRENT"), "r") as f:
+        return SegmentedIndex(os.path.join(index_dir, f.read().strip()))
+
+
+def timed_runs(index, queries, k, strategy, **budget):
+    from evaluator import top_k
+
+    results, latencies = [], []
+    for terms in queries:
+        start = time.perf_counter()
+        results.append(top_k(index, terms, k=k, strategy=strategy, **budget))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+
+def compare(results, reference, k):
+    found = exact = 0
+    expected = 0
+    max_error = 0.0
+    for ranked, best in zip(results, reference):
+        best_ids = [doc_id for doc_id, _ in best]
+        found += len(set(best_ids) & {doc_id for doc_id, _ in ranked})
+        expected += len(best_ids)
+        exact += [doc_id for doc_id, _ in ranked] == best_ids
+        scores = dict(best)
+        for doc_id, score in ranked:
+            if doc_id in scores:
+                max_error = max(max_error, abs(score - scores[doc_id]))
+    return {
+        "recall_at_k": round(found / max(expected, 1), 4),
+        "exact_top_k": round(exact / max(len(reference), 1), 4),
+        "max_score_error": round(max_error, 6),
+    }
+
+
+def run(label, index, queries, k, reference, strategy, **budget):
+    results, latencies = timed_runs(index, queries, k, strategy, **budget)
+    print(f"{label}: p95 {percentiles(latencies)['p95']} ms", file=sys.stderr)
+    return {
+        "strategy": strategy,
+        **budget,
+        "latency_ms": percentiles(latencies),
+        **compare(results, reference, k),
+    }
+
+
+def benchmark(corpus, exact_dir, impact_dir, queries, k, max_postings, max_ms):
+    mix = make_queries(load_corpus_settings(corpus), queries)
+    queries = [query.lower().split() for _, query in mix]
+    exact_index = open_index(exact_dir)
+    impact_index = open_index(impact_dir)
+
+    reference, latencies = timed_runs(exact_index, queries, k, "daat")
+    runs = [
+        {
+            "index": "float32",
+            "strategy": "daat",
+            "latency_ms": percentiles(latencies),
+            **compare(reference, reference, k),
+        },
+        dict(run("daat", impact_index, queries, k, reference, "daat"), index="impact"),
+    ]
+    for budget in max_postings:
+        result = run(
+            f"saat {budget} postings",
+            impact_index,
+            queries,
+            k,
+            reference,
+            "saat",
+            max_postings=budget,
+        )
+        runs.append(dict(result, index="impact"))
+    for budget in max_ms:
+        result = run(
+            f"saat {budget} ms",
+            impact_index,
+            queries,
+            k,
+            reference,
+            "saat",
+            max_seconds=budget / 1000,
+        )
+        runs.append(dict(result, index="impact"))
+    return {"queries": len(queries), "k": k, "runs": runs}
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Anytime ranking trade-off")
+    parser.add_argument("corpus", help="corpus the indexes were built from")
+    parser.add_argument("exact", help="index directory of a float32 build")
+    parser.add_argument("impact", help="index directory of a --weights impact build")
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument(
+        "--max-postings",
+        type=int,
+        nargs="+",
+        default=[0, 20000, 5000, 1000],
+        help="postings budgets to try (0 = no limit)",
+    )
+    parser.add_argument(
+        "--max-ms", type=float, nargs="*", default=[5, 1], help="time budgets to try"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = benchmark(
+        args.corpus,
+        args.exact,
+        args.impact,
+        args.queries,
+        args.k,
+        args.max_postings,
+        args.max_ms,
+    )
+    print(json.dumps(result))
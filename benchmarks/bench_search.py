@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from corpus import ZipfSampler, load_corpus_settings, make_vocabulary
+
+# After corpus, which puts indexer/ on the path: the processor's own doc_store
+# must come first
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, "..", "processor"))
+
+# Drives the processor's search path (/api/search through Flask's test client,
+# so request parsing, spelling correction, ranking and JSON encoding are all
+# included) with a query mix drawn from the corpus vocabulary. Runs in a fresh
+# process started by run.py with INDEX_DIR pointing at the benchmark index.
+# Prints one JSON object.
+
+QUERY_MIX = {
+    "zipf": 0.7,  # terms drawn with the corpus' own Zipf distribution
+    "rare": 0.2,  # terms from the long tail
+    "misspelled": 0.1,  # one term with a typo, so spelling correction runs
+}
+QUERY_LENGTHS = [1, 2, 3, 4]
+QUERY_LENGTH_WEIGHTS = [0.35, 0.35, 0.2, 0.1]
+
+
+def misspell(word, rng):
+    position = rng.integers(0, len(word))
+    letter = "abcdefghijklmnopqrstuvwxyz"[rng.integers(0, 26)]
+    return word[:position] + letter + word[position + 1 :]
+
+
+def make_queries(settings, count, seed=1):
+    # Returns [(kind, query)]
+    rng = np.random.default_rng(seed)
+    vocabulary = make_vocabulary(settings["vocabulary_size"], settings["seed"])
+    sampler = ZipfSampler(vocabulary, settings["zipf_exponent"], rng)
+    tail_start = min(1000, len(vocabulary) // 2)
+    kinds = rng.choice(list(QUERY_MIX), size=count, p=list(QUERY_MIX.values()))
+    lengths = rng.choice(QUERY_LENGTHS, size=count, p=QUERY_LENGTH_WEIGHTS)
+    queries = []
+    for kind, length in zip(kinds, lengths):
+        if kind == "rare":
+            words = [
+                vocabulary[i] for i in rng.integers(tail_start, len(vocabulary), length)
+            ]
+        else:
+            words = sampler.words(length)
+        if kind == "misspelled":
+            words[0] = misspell(words[0], rng)
+        queries.append((str(kind), " ".join(words)))
+    return queries
+
+
+def percentiles(latencies):
+    values = np.array(latencies) * 1000
+    if not len(values):
+        return {}
+    return {
+        "mean": round(float(values.mean()), 3),
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def benchmark(corpus, queries, warmup, threads, k):
+    import app  # loads the index from INDEX_DIR
+
+    client = app.app.test_client()
+    settings = load_corpus_settings(corpus)
+    mix = make_queries(settings, warmup + queries)
+
+    def run(item):
+        kind, query = item
+        start = time.perf_counter()
+        response = client.get("/api/search", query_string={"query": query, "k": k})
+        return kind, time.perf_counter() - start, response.status_code
+
+    for item in mix[:warmup]:
+        run(item)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(run, mix[warmup:]))
+    elapsed = time.perf_counter() - start
+
+    by_kind = {}
+    for kind, latency, _ in results:
+        by_kind.setdefault(kind, []).append(latency)
+    app.scatter_gather.close()
+    return {
+        "queries": len(results),
+        "threads": threads,
+        "k": k,
+        "seconds": round(elapsed, 4),
+        "queries_per_second": round(len(results) / elapsed, 2),
+        "errors": sum(1 for _, _, status in results if status != 200),
+        "latency_ms": percentiles([latency for _, latency, _ in results]),
+        "latency_ms_by_kind": {
+            kind: percentiles(v) for kind, v in sorted(by_kind.items())
+        },
+        "result_cache": app.result_cache.stats(),
+        "startup": {"seconds": round(app.startup.finished, 4)},
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the search path")
+    parser.add_argument(
+        "corpus", help="corpus the index was built from (for its vocabulary)"
+    )
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--k", type=int, default=10)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    result = benchmark(args.corpus, args.queries, args.warmup, args.threads, args.k)
+    print(json.dumps(result))
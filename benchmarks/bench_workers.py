@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from bench_search import make_queries
+from corpus import load_corpus_settings
+
+# Memory of the processor served by gunicorn (processor/gunicorn.conf.py) with
+# a growing number of workers. For every worker count: start the server on
+# the given index, send a query mix so every worker touches the index, then
+# add up the memory of the master and its workers from /proc. RSS counts
+# shared pages once per process; PSS splits them between the processes that
+# share them, so total PSS is the physical memory actually used. Linux only.
+# Prints one JSON object.
+#
+#   $ python bench_workers.py work/corpus-1000 work/indexer-1000-stages/index --workers 1 2 4
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROCESSOR_DIR = os.path.join(BENCHMARKS_DIR, "..", "processor")
+
+
+def process_memory_kb(pid):
+    # {"rss": ..., "pss": ..., "private": ...} from smaps_rollup
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup", "r") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                values[parts[0].rstrip(":")] = int(parts[1])
+    return {
+        "rss": values.get("Rss", 0),
+        "pss": values.get("Pss", 0),
+        "private": values.get("Private_Clean", 0) + values.get("Private_Dirty", 0),
+    }
+
+
+def children(pid):
+    with open(f"/proc/{pid}/task/{pid}/children", "r") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def wait_until_ready(url, process, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit("gunicorn exited during startup")
+        try:
+            with urllib.request.urlopen(url + "/readyz", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError):
+            pass
+        time.sleep(0.1)
+    raise SystemExit("gunicorn did not become ready")
+
+
+def measure(corpus, index_dir, workers, queries, port):
+    url = f"http://127.0.0.1:{port}"
+    env = dict(
+        os.environ,
+        INDEX_DIR=os.path.abspath(index_dir),
+        INDEX_POLL_INTERVAL="0",
+        WEB_CONCURRENCY=str(workers),
+        BIND=f"127.0.0.1:{port}",
+    )
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py"],
+        cwd=PROCESSOR_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_ready(url, process)
+
+        def search(item):
+            query = urllib.parse.urlencode({"query": item[1], "k": 10})
+            with urllib.request.urlopen(f"{url}/api/search?{query}") as response:
+                response.read()
+
+        mix = make_queries(load_corpus_settings(corpus), queries)
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            list(pool.map(search, mix))
+
+        master = process_memory_kb(process.pid)
+        worker_memory = [process_memory_kb(pid) for pid in children(process.pid)]
+    finally:
+        process.terminate()
+        process.wait()
+
+    every = [master] + worker_memory
+    return {
+        "workers": len(worker_memory),
+        "total_rss_mb": round(sum(m["rss"] for m in every) / 1024, 1),
+        "total_pss_mb": round(sum(m["pss"] for m in every) / 1024, 1),
+        "master_rss_mb": round(master["rss"] / 1024, 1),
+        "worker_private_mb": [round(m["private"] / 1024, 1) for m in worker_memory],
+    }
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Memory per gunicorn worker count")
+    parser.add_argument("corpus", help="corpus the index was built from")
+    parser.add_argument("index", help="index directory (with CURRENT)")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--port", type=int, default=5077)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = [
+        measure(args.corpus, args.index, workers, args.queries, args.port)
+        for workers in args.workers
+    ]
+    for result in results:
+        print(
+            f"{result['workers']} workers: {result['total_pss_mb']} MB PSS, "
+            f"{result['total_rss_mb']} MB RSS",
+            file=sys.stderr,
+        )
+    print(json.dumps({"runs": results}))
@@ -0,0 +1,172 @@
+import os
+import sys
+import json
+import argparse
+import numpy as np
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer")
+)
+from page_archive import PageArchiveWriter
+
+# Synthetic Wikipedia-like corpora for the benchmarks. Words are drawn from a
+# Zipfian distribution over a made-up vocabulary, so term frequencies, posting
+# list lengths and the long tail look like natural text. Every page has the
+# markup indexer.py expects (text in <p>, boilerplate outside of it) and links
+# to other pages. The same seed always gives the same corpus.
+
+CORPUS_FILE = "corpus.json"
+SYLLABLES = [
+    c + v
+    for c in "bcdfghjklmnprstvwz"
+    for v in ["a", "e", "i", "o", "u", "ai", "ea", "io", "ou"]
+]
+
+PAGE = """<!DOCTYPE html>
+<html lang="en"><head><meta charset="utf-8"><title>{title} - Wikipedia</title></head>
+<body><div id="mw-navigation"><ul><li><a href="/wiki/Main_Page">Main page</a></li>
+<li><a href="/wiki/Special:Random">Random article</a></li></ul></div>
+<div id="content"><h1 id="firstHeading">{title}</h1>
+<div id="bodyContent">{paragraphs}
+<h2>See also</h2><ul>{links}</ul></div></div>
+<div id="footer">Text is available under the Creative Commons Attribution-ShareAlike License.</div>
+</body></html>
+"""
+
+
+def make_vocabulary(size, seed):
+    # size distinct pseudo-words of 2-4 syllables; rank 0 is the most frequent
+    rng = np.random.default_rng(seed)
+    words, seen = [], set()
+    while len(words) < size:
+        length = rng.integers(2, 5)
+        word = "".join(SYLLABLES[i] for i in rng.integers(0, len(SYLLABLES), length))
+        if word not in seen:
+            seen.add(word)
+            words.append(word)
+    return words
+
+
+def zipf_probabilities(size, exponent):
+    weights = 1.0 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+class ZipfSampler:
+    def __init__(self, vocabulary, exponent, rng):
+        self.vocabulary = vocabulary
+        self.cumulative = np.cumsum(zipf_probabilities(len(vocabulary), exponent))
+        self.rng = rng
+
+    def ranks(self, count):
+        ranks = np.searchsorted(self.cumulative, self.rng.random(count), side="right")
+        return np.minimum(ranks, len(self.vocabulary) - 1)
+
+    def words(self, count):
+        return [self.vocabulary[rank] for rank in self.ranks(count)]
+
+
+def page_title(number, sampler):
+    return "_".join(word.capitalize() for word in sampler.words(2)) + f"_{number}"
+
+
+def generate_pages(
+    pages, vocabulary_size=50000, exponent=1.07, words_per_page=400, seed=0
+):
+    # Yields (title, html bytes)
+    rng = np.random.default_rng(seed)
+    sampler = ZipfSampler(make_vocabulary(vocabulary_size, seed), exponent, rng)
+    titles = [page_title(number, sampler) for number in range(pages)]
+    for title in titles:
+        # Page lengths vary a lot, like real articles
+        length = max(20, int(rng.lognormal(np.log(words_per_page), 0.6)))
+        words = sampler.words(length)
+        cuts = np.sort(
+            rng.choice(
+                np.arange(1, length), size=min(length - 1, length // 80), replace=False
+            )
+        )
+        paragraphs = "\n".join(
+            "<p>" + " ".join(chunk) + ".</p>"
+            for chunk in np.split(np.array(words, dtype=object), cuts)
+            if len(chunk)
+        )
+        links = "".join(
+            f'<li><a href="/wiki/{titles[i]}">{titles[i].replace("_", " ")}</a></li>'
+            for i in rng.integers(0, pages, 5)
+        )
+        html = PAGE.format(
+            title=title.replace("_", " "), paragraphs=paragraphs, links=links
+        )
+        yield title, html.encode("utf-8")
+
+
+def write_corpus(
+    output,
+    pages,
+    vocabulary_size=50000,
+    exponent=1.07,
+    words_per_page=400,
+    seed=0,
+    layout="archive",
+):
+    # layout "archive" writes a crawl archive (indexer.py --archive), "files"
+    # one .html file per page (indexer.py --data-dir)
+    os.makedirs(output, exist_ok=True)
+    generated = generate_pages(pages, vocabulary_size, exponent, words_per_page, seed)
+    if layout == "archive":
+        with PageArchiveWriter(output) as archive:
+            for title, body in generated:
+                archive.add(
+                    f"https://en.wikipedia.org/wiki/{title}", f"{title}.html", body
+                )
+    else:
+        for title, body in generated:
+            with open(os.path.join(output, f"{title}.html"), "wb") as f:
+                f.write(body)
+
+    settings = {
+        "pages": pages,
+        "vocabulary_size": vocabulary_size,
+        "zipf_exponent": exponent,
+        "words_per_page": words_per_page,
+        "seed": seed,
+        "layout": layout,
+    }
+    with open(os.path.join(output, CORPUS_FILE), "w", encoding="utf-8") as f:
+        json.dump(settings, f, indent=4)
+    return settings
+
+
+def load_corpus_settings(directory):
+    path = os.path.join(directory, CORPUS_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate a synthetic wiki corpus")
+    parser.add_argument("output", help="directory to write the corpus to")
+    parser.add_argument("--pages", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=50000, help="distinct words")
+    parser.add_argument("--zipf", type=float, default=1.07, help="Zipf exponent")
+    parser.add_argument("--words", type=int, default=400, help="median words per page")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--layout", choices=["archive", "files"], default="archive")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    write_corpus(
+        args.output,
+        args.pages,
+        args.vocabulary,
+        args.zipf,
+        args.words,
+        args.seed,
+        args.layout,
+    )
+    print(f"Wrote {args.pages} pages to {args.output}")
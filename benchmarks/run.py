@@ -0,0 +1,283 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timezone
+from corpus import load_corpus_settings, write_corpus
+
+# End-to-end benchmarks. For every corpus size: generate a synthetic corpus
+# (cached in the work directory), run a full build with indexer.py, time its
+# stages with bench_indexer.py, and load the processor on the result and drive
+# it with a query mix with bench_search.py. Every step runs in its own process
+# so peak RSS figures don't mix. Results are written as one JSON file; with
+# --compare they are checked against an earlier one.
+#
+#   $ python run.py --sizes 1000 10000 --output before.json
+#   $ python run.py --sizes 1000 10000 --compare before.json
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+INDEXER_DIR = os.path.join(REPO_DIR, "indexer")
+PROCESSOR_DIR = os.path.join(REPO_DIR, "processor")
+
+# Metrics --compare checks: lower is better for all but queries_per_second
+LOWER_IS_BETTER = ("seconds", "peak_rss_mb", "mean", "p50", "p95", "p99", "index_bytes")
+HIGHER_IS_BETTER = ("queries_per_second",)
+
+
+def run_process(command, cwd, env=None):
+    # Returns (the last JSON object the process printed, wall seconds)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        command,
+        cwd=cwd,
+        env=env,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    stdout, stderr = process.communicate()
+    elapsed = time.perf_counter() - start
+    if process.returncode != 0:
+        sys.stderr.write(stderr)
+        raise SystemExit(
+            f"{' '.join(command)} failed with exit code {process.returncode}"
+        )
+    lines = [line for line in stdout.splitlines() if line.startswith("{")]
+    return (json.loads(lines[-1]) if lines else None), elapsed
+
+
+def corpus_dir(work_dir, pages, args):
+    # Reused while the generator settings stay the same
+    path = os.path.join(work_dir, f"corpus-{pages}")
+    settings = load_corpus_settings(path)
+    wanted = {
+        "pages": pages,
+        "vocabulary_size": args.vocabulary,
+        "zipf_exponent": args.zipf,
+        "words_per_page": args.words,
+        "seed": args.seed,
+        "layout": "archive",
+    }
+    if settings != wanted:
+        shutil.rmtree(path, ignore_errors=True)
+        print(f"Generating {pages} pages", file=sys.stderr)
+        write_corpus(path, pages, args.vocabulary, args.zipf, args.words, args.seed)
+    return path, wanted
+
+
+def index_dir_for(work_dir, pages):
+    # indexer.py writes content.json, tfidf/ and index/ to its working directory
+    path = os.path.join(work_dir, f"indexer-{pages}")
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path)
+    shutil.copy(os.path.join(INDEXER_DIR, "config.json"), path)
+    return path
+
+
+def time_full_build(corpus, work_dir, pages, args):
+    cwd = index_dir_for(work_dir, pages)
+    command = [
+        sys.executable,
+        os.path.join(INDEXER_DIR, "indexer.py"),
+        "--archive",
+        corpus,
+        "--shards",
+        str(args.shards),
+    ]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    if args.spimi:
+        command += ["--spimi", "--memory-budget", str(args.spimi)]
+    with tempfile.TemporaryFile() as stderr:
+        start = time.perf_counter()
+        process = subprocess.Popen(
+            command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=stderr
+        )
+        # wait4 gives the resource usage of this one child (and the workers it reaped)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.perf_counter() - start
+        if process.returncode != 0:
+            stderr.seek(0)
+            sys.stderr.write(stderr.read().decode("utf-8", errors="replace"))
+            raise SystemExit("indexer.py failed")
+    return cwd, {
+        "seconds": round(elapsed, 4),
+        "peak_rss_mb": round(usage.ru_maxrss / 1024, 1),
+    }
+
+
+def benchmark_size(pages, args):
+    corpus, settings = corpus_dir(args.work_dir, pages, args)
+    print(f"{pages} pages: full build", file=sys.stderr)
+    _, full_build = time_full_build(corpus, args.work_dir, pages, args)
+
+    print(f"{pages} pages: build stages", file=sys.stderr)
+    stages_dir = index_dir_for(args.work_dir, f"{pages}-stages")
+    command = [sys.executable, os.path.join(BENCHMARKS_DIR, "bench_indexer.py"), corpus]
+    command += ["--shards", str(args.shards)]
+    if args.workers:
+        command += ["--workers", str(args.workers)]
+    stages, _ = run_process(command, stages_dir)
+
+    print(f"{pages} pages: search", file=sys.stderr)
+    env = dict(
+        os.environ, INDEX_DIR=os.path.join(stages_dir, "index"), INDEX_POLL_INTERVAL="0"
+    )
+    if args.no_cache:
+        env.update(RESULT_CACHE_SIZE="0", CORRECTION_CACHE_SIZE="0")
+    command = [
+        sys.executable,
+        os.path.join(BENCHMARKS_DIR, "bench_search.py"),
+        corpus,
+        "--queries",
+        str(args.queries),
+        "--threads",
+        str(args.threads),
+    ]
+    search, _ = run_process(command, PROCESSOR_DIR, env)
+    return {
+        "corpus": settings,
+        "full_build": full_build,
+        "indexer": stages,
+        "search": search,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=REPO_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def flatten(data, prefix=""):
+    # {"a": {"b": 1}} -> {"a.b": 1}, numbers only
+    values = {}
+    for key, value in data.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            values.update(flatten(value, path + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[path] = value
+    return values
+
+
+def compare(baseline, results, threshold):
+    # Prints the change of every timing, memory and throughput metric of the
+    # sizes both runs have; returns the ones that got worse by more than threshold
+    regressions = []
+    old_runs = {run["corpus"]["pages"]: run for run in baseline["runs"]}
+    for run in results["runs"]:
+        old = old_runs.get(run["corpus"]["pages"])
+        if old is None:
+            continue
+        old_values = flatten(old)
+        for path, value in flatten(run).items():
+            metric = path.rsplit(".", 1)[-1]
+            lower = metric in LOWER_IS_BETTER
+            if not (lower or metric in HIGHER_IS_BETTER) or not old_values.get(path):
+                continue
+            change = value / old_values[path] - 1
+            worse = change > threshold if lower else change < -threshold
+            name = f"{run['corpus']['pages']} pages {path}"
+            print(
+                f"{'REGRESSION ' if worse else ''}{name}: {old_values[path]} -> {value} ({change:+.1%})"
+            )
+            if worse:
+                regressions.append(name)
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run the end-to-end benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1000, 10000],
+        help="corpus sizes in pages",
+    )
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--zipf", type=float, default=1.07)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--workers", type=int, default=None, help="indexer parsing processes"
+    )
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument(
+        "--spimi",
+        type=int,
+        metavar="MB",
+        default=None,
+        help="run the full build out-of-core with this memory budget",
+    )
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument(
+        "--threads", type=int, default=1, help="concurrent search clients"
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="turn off the processor's caches"
+    )
+    parser.add_argument("--work-dir", default=os.path.join(BENCHMARKS_DIR, "work"))
+    parser.add_argument(
+        "--output", default=None, help="results file (default: results/<date>.json)"
+    )
+    parser.add_argument(
+        "--compare", metavar="FILE", help="earlier results to check for regressions"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=0.10, help="allowed slowdown for --compare"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    os.makedirs(args.work_dir, exist_ok=True)
+    results = {
+        "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "workers": args.workers,
+            "shards": args.shards,
+            "spimi_memory_budget_mb": args.spimi,
+            "queries": args.queries,
+            "threads": args.threads,
+            "cache": not args.no_cache,
+        },
+        "runs": [benchmark_size(pages, args) for pages in args.sizes],
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(os.path.join(BENCHMARKS_DIR, "results"), exist_ok=True)
+        name = results["date"].replace(":", "") + ".json"
+        output = os.path.join(BENCHMARKS_DIR, "results", name)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=4)
+    print(f"Results written to {output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), results, args.threshold)
+        if regressions:
+            raise SystemExit(
+                f"{len(regressions)} metrics regressed by more than {args.threshold:.0%}"
+            )
@@ -0,0 +1,90 @@
+import os
+import hashlib
+import argparse
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+# Local stand-in for Wikipedia, to test crawls offline. Serves the saved pages
+# in --data-dir at /wiki/<title> (from <title>.html) with an ETag and
+# Last-Modified, and answers conditional requests with 304 Not Modified like
+# the real site. Editing or touching a file there makes it a changed page.
+#
+#   $ python stand_in_server.py --port 8000
+#   $ scrapy crawl wiki_spider -a base_url=http://localhost:8000
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    directory = "data"
+    served_bytes = 0
+
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        title = path[len("/wiki/") :] if path.startswith("/wiki/") else ""
+        filepath = os.path.join(self.directory, f"{title}.html")
+        if not title or "/" in title or not os.path.isfile(filepath):
+            self.send_error(404)
+            return
+
+        with open(filepath, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        mtime = int(os.stat(filepath).st_mtime)
+        last_modified = formatdate(mtime, usegmt=True)
+
+        if self.not_modified(etag, mtime):
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(body)
+        type(self).served_bytes += len(body)
+
+    def not_modified(self, etag, mtime):
+        # If-None-Match wins over If-Modified-Since, as in RFC 9110
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return mtime <= since
+        return False
+
+
+def make_server(directory, host="127.0.0.1", port=0):
+    # Port 0 binds a free port, see server.server_address
+    handler = type("Handler", (StandInHandler,), {"directory": directory})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Serve saved pages like Wikipedia")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = make_server(args.data_dir, args.host, args.port)
+    print(f"Serving {args.data_dir} on http://{args.host}:{args.port}/wiki/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Served {server.RequestHandlerClass.served_bytes} bytes of pages")
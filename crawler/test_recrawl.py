@@ -0,0 +1,93 @@
+import os
+import sys
+import json
+import tempfile
+import threading
+import subprocess
+import unittest
+from urllib.parse import urlparse
+
+from stand_in_server import make_server
+from wiki_crawler.spiders.wiki_spider import WikiSpider
+
+# Run from crawler/: python -m unittest test_recrawl
+#
+# Crawls a stand-in server twice with RecrawlMiddleware on. The spider's start
+# pages and a few pages they link to are served from a temporary directory on
+# a free port. Start requests are never filtered as duplicates, so the start
+# pages don't link to each other. Between the crawls one linked page is
+# edited: the second crawl should get a 304 for every other page, reach the
+# linked pages through the archived copies of the start pages, and store only
+# the edited page again.
+
+CRAWLER_DIR = os.path.dirname(os.path.abspath(__file__))
+START_TITLES = [urlparse(url).path[len("/wiki/") :] for url in WikiSpider.start_urls]
+LINKED_TITLES = ["Linked_page_1", "Linked_page_2", "Linked_page_3"]
+TITLES = START_TITLES + LINKED_TITLES
+
+
+def page(title, text):
+    links = "".join(f'<a href="/wiki/{other}">{other}</a>' for other in LINKED_TITLES)
+    return f"<html><body><h1>{title}</h1><p>{text}</p>{links}</body></html>"
+
+
+class RecrawlTest(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.pages_dir = os.path.join(self.tmp.name, "pages")
+        self.archive_dir = os.path.join(self.tmp.name, "archive")
+        os.makedirs(self.pages_dir)
+        for title in TITLES:
+            self.write_page(title, f"First version of {title}.")
+
+        self.server = make_server(self.pages_dir)
+        self.server.RequestHandlerClass.log_message = lambda *args: None
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.addCleanup(self.tmp.cleanup)
+
+    def write_page(self, title, text):
+        with open(os.path.join(self.pages_dir, f"{title}.html"), "w") as f:
+            f.write(page(title, text))
+
+    def page_size(self, title):
+        return os.path.getsize(os.path.join(self.pages_dir, f"{title}.html"))
+
+    def crawl(self):
+        # Only the archive pipeline, the index is not needed here
+        host, port = self.server.server_address
+        pipelines = {"wiki_crawler.pipelines.PageArchivePipeline": 100}
+        subprocess.run(
+            [sys.executable, "-m", "scrapy", "crawl", "wiki_spider"]
+            + ["-a", f"base_url=http://{host}:{port}"]
+            + ["-s", f"ARCHIVE_DIR={self.archive_dir}"]
+            + ["-s", f"ITEM_PIPELINES={json.dumps(pipelines)}"]
+            + ["-s", "LOG_LEVEL=WARNING"],
+            cwd=CRAWLER_DIR,
+            check=True,
+        )
+        with open(os.path.join(self.archive_dir, "crawls.jsonl")) as f:
+            return json.loads(f.readlines()[-1])
+
+    def test_recrawl_downloads_only_the_changed_page(self):
+        first = self.crawl()
+        self.assertEqual(first["pages_stored"], len(TITLES))
+        self.assertEqual(first["pages_not_modified"], 0)
+
+        changed = LINKED_TITLES[0]
+        self.write_page(changed, "Second version, edited since the last crawl.")
+        second = self.crawl()
+        self.assertEqual(second["pages_stored"], 1)
+        self.assertEqual(second["pages_unchanged"], 0)
+        self.assertEqual(second["pages_not_modified"], len(TITLES) - 1)
+        self.assertEqual(
+            second["bytes_saved"],
+            sum(self.page_size(title) for title in TITLES if title != changed),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
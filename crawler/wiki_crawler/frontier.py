@@ -0,0 +1,166 @@
+import os
+import math
+import hashlib
+import logging
+from urllib.parse import quote, unquote, urlsplit, urlunsplit, parse_qs
+from scrapy.dupefilters import BaseDupeFilter
+
+# Crawl frontier for wiki pages. Links are canonicalized to one URL per
+# article and links to anything that is not an article (other namespaces,
+# edit/history/permalink variants, query strings) are dropped before they
+# reach the scheduler. Requests are deduplicated on the canonical URL with a
+# Bloom filter, so the seen set takes the same memory however long the crawl.
+
+logger = logging.getLogger(__name__)
+
+# Namespaces of pages that are not articles; every "..._talk" namespace too
+NON_ARTICLE_NAMESPACES = {
+    "special",
+    "talk",
+    "user",
+    "wikipedia",
+    "wp",
+    "project",
+    "file",
+    "image",
+    "media",
+    "mediawiki",
+    "template",
+    "help",
+    "category",
+    "portal",
+    "draft",
+    "timedtext",
+    "module",
+    "book",
+    "education_program",
+    "gadget",
+    "gadget_definition",
+}
+
+
+def canonical_title(title):
+    # MediaWiki titles: underscores for spaces, first letter upper case
+    title = unquote(title).replace(" ", "_").strip("_")
+    if not title:
+        return None
+    namespace, colon, _ = title.partition(":")
+    namespace = namespace.lower()
+    if colon and (namespace in NON_ARTICLE_NAMESPACES or namespace.endswith("_talk")):
+        return None
+    return title[0].upper() + title[1:]
+
+
+def canonicalize_url(url):
+    # The canonical URL of the article url links to, or None if it is not an
+    # article: https://en.m.wikipedia.org/wiki/solar%20power#History and
+    # /w/index.php?title=Solar_power both become .../wiki/Solar_power, while
+    # ?action=edit, ?oldid=..., Talk:, Special: and the like are dropped
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return None
+    host = (parts.hostname or "").lower()
+    if host.endswith(".wikipedia.org"):
+        host = host.replace(".m.wikipedia.org", ".wikipedia.org")
+    if parts.port:
+        host = f"{host}:{parts.port}"
+
+    if parts.path.startswith("/wiki/") and not parts.query:
+        title = parts.path[len("/wiki/") :]
+    elif parts.path == "/w/index.php":
+        query = parse_qs(parts.query)
+        if set(query) != {"title"}:  # action=, oldid=, diff=, printable=, ...
+            return None
+        title = query["title"][0]
+    else:
+        return None
+
+    title = canonical_title(title)
+    if title is None:
+        return None
+    path = "/wiki/" + quote(title, safe="_-.,()'!*:@$;~/")
+    return urlunsplit((parts.scheme, host, path, "", ""))
+
+
+class BloomFilter:
+    # Set membership in a fixed number of bits: no false negatives, and false
+    # positives at about error_rate once capacity keys have been added
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Double hashing over one 128-bit digest
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def __contains__(self, key):
+        return all(self.bits[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+    def add(self, key):
+        # Returns True if key was (probably) added before
+        seen = True
+        for p in self._positions(key):
+            if not self.bits[p >> 3] & (1 << (p & 7)):
+                seen = False
+                self.bits[p >> 3] |= 1 << (p & 7)
+        if not seen:
+            self.count += 1
+        return seen
+
+    def save(self, path):
+        with open(path, "wb") as f:
+            f.write(self.bits)
+
+    def load(self, path):
+        with open(path, "rb") as f:
+            bits = f.read()
+        if len(bits) == len(self.bits):  # else sized differently, start over
+            self.bits = bytearray(bits)
+
+
+class BloomDupeFilter(BaseDupeFilter):
+    # DUPEFILTER_CLASS that remembers canonical URLs in a Bloom filter sized
+    # by FRONTIER_CAPACITY and FRONTIER_ERROR_RATE. A false positive skips a
+    # page that was not crawled yet, so keep the error rate low. With a JOBDIR
+    # the filter is saved there when the crawl stops and loaded on resume.
+    def __init__(self, capacity, error_rate, path=None, stats=None):
+        self.seen = BloomFilter(capacity, error_rate)
+        self.path = path
+        self.stats = stats
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        job_dir = settings.get("JOBDIR")
+        return cls(
+            settings.getint("FRONTIER_CAPACITY", 1_000_000),
+            settings.getfloat("FRONTIER_ERROR_RATE", 0.001),
+            os.path.join(job_dir, "frontier.bloom") if job_dir else None,
+            crawler.stats,
+        )
+
+    def open(self):
+        if self.path and os.path.exists(self.path):
+            self.seen.load(self.path)
+
+    def close(self, reason):
+        if self.path:
+            self.seen.save(self.path)
+        logger.info(
+            f"Frontier: {self.seen.count} distinct URLs in "
+            f"{len(self.seen.bits) // 1024} KB"
+        )
+
+    def request_seen(self, request):
+        return self.seen.add(canonicalize_url(request.url) or request.url)
+
+    def log(self, request, spider):
+        if self.stats is not None:
+            self.stats.inc_value("frontier/duplicates_filtered")
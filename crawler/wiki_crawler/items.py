@@ -7,6 +7,9 @@ import scrapy
 
 
 class WikiCrawlerItem(scrapy.Item):
-    # define the fields for your item here like:
-    # name = scrapy.Field()
-    pass
+    # One crawled page
+    url = scrapy.Field()
+    filename = scrapy.Field()  # document name in the index, e.g. "Solar_power.html"
+    body = scrapy.Field()  # raw HTML bytes
+    etag = scrapy.Field()  # validators for conditional requests when recrawling
+    last_modified = scrapy.Field()
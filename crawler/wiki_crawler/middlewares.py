@@ -3,11 +3,25 @@
 # See documentation in:
 # https://docs.scrapy.org/en/latest/topics/spider-middleware.html
 
+import os
+import sys
+import json
+from datetime import datetime, timezone
 from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import HtmlResponse
 
 # useful for handling different item types with a single interface
 from itemadapter import is_item, ItemAdapter
 
+# The crawl archive is read with the indexer's own module
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "indexer")
+)
+from page_archive import has_archive, latest_by_url, read_pages
+
+CRAWLS_FILE = "crawls.jsonl"
+
 
 class WikiCrawlerSpiderMiddleware:
     # Not all methods need to be defined. If a method is not defined,
@@ -101,3 +115,86 @@ class WikiCrawlerDownloaderMiddleware:
 
     def spider_opened(self, spider):
         spider.logger.info("Spider opened: %s" % spider.name)
+
+
+class RecrawlMiddleware:
+    # Incremental recrawl. Requests for pages already in the crawl archive are
+    # sent with the ETag / Last-Modified the server gave them last time. A 304
+    # Not Modified response is answered from the archive instead, flagged
+    # "not_modified" so the spider only follows its links, and the page is
+    # neither stored nor indexed again. Pages that come back in full with the
+    # same content are dropped by PageArchivePipeline on their content hash.
+    # A summary of what the crawl saved is logged and appended to
+    # archive/crawls.jsonl.
+    def __init__(self, archive_dir, stats):
+        self.archive_dir = archive_dir
+        self.stats = stats
+        self.known = {}  # url -> latest cdx entry
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        if not crawler.settings.getbool("RECRAWL_ENABLED"):
+            raise NotConfigured
+        middleware = cls(crawler.settings.get("ARCHIVE_DIR", "archive"), crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        if has_archive(self.archive_dir):
+            self.known = latest_by_url(self.archive_dir)
+        spider.logger.info(f"Recrawl: {len(self.known)} pages known from the archive")
+
+    def process_request(self, request):
+        entry = self.known.get(request.url)
+        if entry is not None:
+            if "etag" in entry:
+                request.headers.setdefault("If-None-Match", entry["etag"])
+            if "last_modified" in entry:
+                request.headers.setdefault("If-Modified-Since", entry["last_modified"])
+        return None
+
+    def process_response(self, request, response):
+        entry = self.known.get(request.url)
+        if response.status != 304 or entry is None:
+            self.stats.inc_value("recrawl/pages_downloaded")
+            self.stats.inc_value("recrawl/bytes_downloaded", len(response.body))
+            return response
+
+        _, body = next(read_pages(self.archive_dir, [entry]))
+        self.stats.inc_value("recrawl/pages_not_modified")
+        self.stats.inc_value("recrawl/bytes_saved", len(body))
+        return HtmlResponse(
+            url=request.url,
+            status=200,
+            headers={"Content-Type": "text/html; charset=utf-8"},
+            body=body,
+            request=request,
+            flags=["not_modified"],
+        )
+
+    def spider_closed(self, spider, reason):
+        stats = self.stats
+        summary = {
+            "date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "reason": reason,
+            "pages_downloaded": stats.get_value("recrawl/pages_downloaded", 0),
+            "bytes_downloaded": stats.get_value("recrawl/bytes_downloaded", 0),
+            "pages_not_modified": stats.get_value("recrawl/pages_not_modified", 0),
+            "bytes_saved": stats.get_value("recrawl/bytes_saved", 0),
+            # downloaded in full but already archived with the same content
+            "pages_unchanged": stats.get_value("recrawl/pages_unchanged", 0),
+            "pages_stored": stats.get_value("recrawl/pages_stored", 0),
+        }
+        spider.logger.info(
+            f"Recrawl: {summary['pages_not_modified']} pages not modified "
+            f"({summary['bytes_saved']} bytes not downloaded), "
+            f"{summary['pages_unchanged']} unchanged pages not stored again, "
+            f"{summary['pages_stored']} new or changed pages stored; "
+            f"{summary['bytes_downloaded']} bytes downloaded "
+            f"in {summary['pages_downloaded']} responses"
+        )
+        os.makedirs(self.archive_dir, exist_ok=True)
+        path = os.path.join(self.archive_dir, CRAWLS_FILE)
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(summary) + "\n")
@@ -3,11 +3,240 @@
 # Don't forget to add your pipeline to the ITEM_PIPELINES setting
 # See: https://docs.scrapy.org/en/latest/topics/item-pipeline.html
 
+import os
+import sys
 
 # useful for handling different item types with a single interface
 from itemadapter import ItemAdapter
+from scrapy.exceptions import DropItem
+from scrapy.utils.defer import maybe_deferred_to_future
+from twisted.internet import task, threads
 
+# The index is written with the indexer's own modules
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "indexer")
+)
+from binary_index import load_segments, save_segments
+from extraction import paragraph_text
+from generations import (
+    IndexLocked,
+    current_generation,
+    discard_generation,
+    new_generation,
+    publish_generation,
+    writer_lock,
+)
+from incremental_index import (
+    add_documents,
+    apply_merge_policy,
+    load_manifest,
+    page_entry,
+    save_manifest,
+    start_index,
+)
+from page_archive import PageArchiveWriter
+from spelling_index import update_spelling_index, write_spelling_index
+from startup_bundle import write_startup_bundle
+
+
+class HtmlFilePipeline:
+    # Keeps the raw HTML of every page as a file in data/, the layout from
+    # before the crawl archive; indexer.py reads it with --data-dir when there
+    # is no archive
+    def __init__(self, directory):
+        self.directory = directory
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("HTML_DIR", "data"))
+
+    def open_spider(self, spider):
+        os.makedirs(self.directory, exist_ok=True)
 
-class WikiCrawlerPipeline:
     def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        with open(os.path.join(self.directory, adapter["filename"]), "wb") as file:
+            file.write(adapter["body"])
+        return item
+
+
+class PageArchivePipeline:
+    # Appends the raw HTML of every page to the compressed crawl archive
+    # (indexer/page_archive.py), which full builds of the index read. Pages
+    # whose exact content is already stored and current, such as redirects,
+    # alias titles and unchanged refetches, are only noted in the archive's
+    # index and dropped, so they are not indexed again.
+    def __init__(self, archive_dir, stats=None):
+        self.archive_dir = archive_dir
+        self.stats = stats
+        self.writer = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler.settings.get("ARCHIVE_DIR", "archive"), crawler.stats)
+
+    def open_spider(self, spider):
+        self.writer = PageArchiveWriter(self.archive_dir)
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        stored = self.writer.add(
+            adapter["url"],
+            adapter["filename"],
+            adapter["body"],
+            etag=adapter.get("etag"),
+            last_modified=adapter.get("last_modified"),
+        )
+        if self.stats is not None:
+            self.stats.inc_value(
+                "recrawl/pages_stored" if stored else "recrawl/pages_unchanged"
+            )
+        if not stored:
+            raise DropItem(f"Duplicate content: {adapter['url']}")
+        return item
+
+    def close_spider(self, spider):
+        self.writer.close()
+
+
+class WikiCrawlerPipeline:
+    # Streams pages into the index while the crawl runs. The paragraph text is
+    # extracted as each page arrives, and pages are buffered until
+    # STREAM_BATCH_SIZE of them are waiting or STREAM_FLUSH_INTERVAL seconds
+    # have passed. Each flush adds them to a new segment and publishes a new
+    # generation, so a running processor can search the crawl so far. Pages
+    # are weighted with the document frequencies of what was indexed up to
+    # then, as in indexer.py --incremental, and pages indexed before with the
+    # same content are skipped.
+    #
+    # Text extraction and flushes run in the reactor's thread pool, so the
+    # crawl keeps going while a batch is written, and one flush runs at a
+    # time. Pages leave the buffer only once their generation is published: a
+    # flush that fails, or finds indexer.py holding the index's writer lock,
+    # leaves them for the next one.
+    def __init__(self, index_dir, batch_size, flush_interval, num_shards):
+        self.index_dir = index_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.num_shards = num_shards
+        self.pending = {}  # filename -> (manifest entry, text); a refetch replaces
+        self.flushing = None  # Deferred of the flush under way
+        self.flusher = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            settings.get("STREAM_INDEX_DIR", "../indexer/index"),
+            settings.getint("STREAM_BATCH_SIZE", 50),
+            settings.getfloat("STREAM_FLUSH_INTERVAL", 30),
+            settings.getint("STREAM_INDEX_SHARDS", 1),
+        )
+
+    def open_spider(self, spider):
+        self.spider = spider
+        with writer_lock(self.index_dir):
+            if current_generation(self.index_dir) is None:
+                generation_dir = new_generation(self.index_dir)
+                start_index(generation_dir, self.num_shards)
+                write_spelling_index(generation_dir)
+                write_startup_bundle(generation_dir)
+                publish_generation(generation_dir)
+        self.flusher = task.LoopingCall(self.flush)
+        self.flusher.start(self.flush_interval, now=False)
+
+    async def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        body = adapter["body"]
+        text = await maybe_deferred_to_future(
+            threads.deferToThread(
+                paragraph_text, body.decode("utf-8", errors="replace")
+            )
+        )
+        self.pending.pop(adapter["filename"], None)
+        self.pending[adapter["filename"]] = (page_entry(body), text)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
         return item
+
+    def flush(self, wait=False):
+        if self.flushing is not None or not self.pending:
+            return
+        batch = dict(self.pending)
+        self.flushing = threads.deferToThread(self.write_batch, batch, wait)
+        self.flushing.addCallbacks(self.flushed, self.flush_failed, (batch,))
+        return self.flushing
+
+    def flushed(self, published, batch):
+        self.flushing = None
+        if not published:
+            self.spider.logger.debug(
+                f"Index is locked by another writer, {len(self.pending)} pages wait"
+            )
+            return
+        # Pages refetched while the batch was written stay for the next flush
+        for filename, page in batch.items():
+            if self.pending.get(filename) is page:
+                del self.pending[filename]
+
+    def flush_failed(self, failure):
+        self.flushing = None
+        self.spider.logger.error(
+            f"Could not index {len(self.pending)} pages, keeping them for the "
+            f"next flush: {failure.getErrorMessage()}"
+        )
+
+    def write_batch(self, batch, wait):
+        # In a thread. Returns False if another writer holds the lock.
+        try:
+            with writer_lock(self.index_dir, wait=wait):
+                self.write_generation(batch)
+        except IndexLocked:
+            return False
+        return True
+
+    def write_generation(self, batch):
+        base = current_generation(self.index_dir)
+        generation_dir = new_generation(self.index_dir, base=base)
+        try:
+            segments = load_segments(generation_dir)
+            manifest = load_manifest(generation_dir)
+            documents = [
+                (filename, entry, text)
+                for filename, (entry, text) in batch.items()
+                if manifest.get(filename, {}).get("hash") != entry["hash"]
+            ]
+            unchanged = len(batch) - len(documents)
+            if not documents:
+                self.spider.logger.info(f"{unchanged} pages are already indexed")
+                discard_generation(generation_dir)
+                return
+            names, replaced = add_documents(
+                generation_dir, segments, manifest, documents
+            )
+            save_segments(segments, generation_dir)
+            save_manifest(manifest, generation_dir)
+            self.spider.logger.info(
+                f"Indexed {len(documents)} pages into {', '.join(names)}, "
+                f"replaced {replaced}, skipped {unchanged} already indexed"
+            )
+            # Without tombstones every term of base is still live
+            if replaced:
+                write_spelling_index(generation_dir)
+            else:
+                update_spelling_index(generation_dir, base, names)
+            apply_merge_policy(generation_dir)
+            write_startup_bundle(generation_dir)
+        except Exception:
+            discard_generation(generation_dir)
+            raise
+        publish_generation(generation_dir)
+
+    async def close_spider(self, spider):
+        if self.flusher is not None and self.flusher.running:
+            self.flusher.stop()
+        if self.flushing is not None:
+            await maybe_deferred_to_future(self.flushing)
+        # The last pages wait for the lock rather than being dropped
+        if self.pending:
+            await maybe_deferred_to_future(self.flush(wait=True))
@@ -50,9 +50,17 @@ ROBOTSTXT_OBEY = True
 
 # Enable or disable downloader middlewares
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html
-#DOWNLOADER_MIDDLEWARES = {
+DOWNLOADER_MIDDLEWARES = {
 #    "wiki_crawler.middlewares.WikiCrawlerDownloaderMiddleware": 543,
-#}
+    # Next to the downloader, so it sees 304s before the other middlewares
+    "wiki_crawler.middlewares.RecrawlMiddleware": 950,
+}
+
+# Incremental recrawl: pages already in the crawl archive are requested with
+# If-None-Match / If-Modified-Since, and unchanged ones are answered from the
+# archive without being stored or indexed again. Set to False (or run with
+# -s RECRAWL_ENABLED=0) to refetch everything in full.
+RECRAWL_ENABLED = True
 
 # Enable or disable extensions
 # See https://docs.scrapy.org/en/latest/topics/extensions.html
@@ -60,11 +68,34 @@ ROBOTSTXT_OBEY = True
 #    "scrapy.extensions.telnet.TelnetConsole": None,
 #}
 
+# Requests are deduplicated on their canonical article URL with a Bloom filter
+# (wiki_crawler/frontier.py) sized for FRONTIER_CAPACITY URLs at a false
+# positive rate of FRONTIER_ERROR_RATE: about 1.8 MB for a million URLs
+DUPEFILTER_CLASS = "wiki_crawler.frontier.BloomDupeFilter"
+FRONTIER_CAPACITY = 1_000_000
+FRONTIER_ERROR_RATE = 0.001
+
 # Configure item pipelines
 # See https://docs.scrapy.org/en/latest/topics/item-pipeline.html
-#ITEM_PIPELINES = {
-#    "wiki_crawler.pipelines.WikiCrawlerPipeline": 300,
-#}
+ITEM_PIPELINES = {
+    "wiki_crawler.pipelines.PageArchivePipeline": 100,
+    # "wiki_crawler.pipelines.HtmlFilePipeline": 100,
+    "wiki_crawler.pipelines.WikiCrawlerPipeline": 300,
+}
+
+# Compressed archive of the raw HTML of every page, read by full builds of the
+# index. HTML_DIR is where HtmlFilePipeline saves one file per page instead.
+ARCHIVE_DIR = "archive"
+HTML_DIR = "data"
+
+# Pages are streamed into the index in ../indexer/index as they are crawled,
+# in batches of up to STREAM_BATCH_SIZE pages and at least every
+# STREAM_FLUSH_INTERVAL seconds. STREAM_INDEX_SHARDS only applies when the
+# pipeline creates the index.
+STREAM_INDEX_DIR = "../indexer/index"
+STREAM_BATCH_SIZE = 50
+STREAM_FLUSH_INTERVAL = 30
+STREAM_INDEX_SHARDS = 1
 
 # Enable and configure the AutoThrottle extension (disabled by default)
 # See https://docs.scrapy.org/en/latest/topics/autothrottle.html
@@ -80,6 +111,8 @@ ROBOTSTXT_OBEY = True
 #AUTOTHROTTLE_DEBUG = False
 
 # Enable and configure HTTP caching (disabled by default)
+# The crawl archive already serves as the cache for conditional requests (see
+# RECRAWL_ENABLED), so this would only keep a second copy of every page.
 # See https://docs.scrapy.org/en/latest/topics/downloader-middleware.html#httpcache-middleware-settings
 #HTTPCACHE_ENABLED = True
 #HTTPCACHE_EXPIRATION_SECS = 0
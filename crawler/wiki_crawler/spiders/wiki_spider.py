@@ -1,7 +1,10 @@
 import scrapy
 from scrapy.crawler import CrawlerProcess
 from scrapy.exceptions import CloseSpider
+from scrapy.utils.project import get_project_settings
 from urllib.parse import urlparse, unquote
+from wiki_crawler.frontier import canonicalize_url
+from wiki_crawler.items import WikiCrawlerItem
 
 
 class WikiSpider(scrapy.Spider):
@@ -34,24 +37,51 @@ class WikiSpider(scrapy.Spider):
         "CLOSESPIDER_PAGECOUNT": max_pages,
     }
 
+    def __init__(self, base_url=None, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Crawl a mirror of the same paths instead, e.g. the local stand-in
+        # server: scrapy crawl wiki_spider -a base_url=http://localhost:8000
+        if base_url:
+            base_url = base_url.rstrip("/")
+            self.start_urls = [base_url + urlparse(url).path for url in self.start_urls]
+            self.allowed_domains = [urlparse(base_url).hostname]
+
     def parse(self, response):
         # Generate a filename from the URL
         parsed_url = urlparse(response.url)
         page_title = parsed_url.path.split("/")[-1]
-        filename = f"data/{unquote(page_title)}.html"
 
-        # Save the raw HTML content to an HTML file
-        with open(filename, "wb") as file:
-            file.write(response.body)
+        # The pipelines archive the raw HTML and stream the page into the index.
+        # A page the server reported as not modified since the last crawl is
+        # already in both, and is only followed for its links.
+        if "not_modified" not in response.flags:
+            yield WikiCrawlerItem(
+                url=response.url,
+                filename=f"{unquote(page_title)}.html",
+                body=response.body,
+                etag=response.headers.get("ETag", b"").decode("latin-1"),
+                last_modified=response.headers.get("Last-Modified", b"").decode(
+                    "latin-1"
+                ),
+            )
 
-        # Follow links to next pages, within allowed_domains
-        for next_page in response.css("a::attr(href)"):
-            if next_page is not None:
-                yield response.follow(next_page, self.parse)
+        # Follow links to other articles, within allowed_domains. Links are
+        # canonicalized so every article is requested under one URL, and links
+        # to talk, special, edit or history pages are dropped here instead of
+        # using up the page budget.
+        stats = self.crawler.stats
+        for href in response.css("a::attr(href)").getall():
+            url = canonicalize_url(response.urljoin(href))
+            if url is None:
+                stats.inc_value("frontier/links_filtered")
+                continue
+            stats.inc_value("frontier/links_followed")
+            yield scrapy.Request(url, self.parse)
 
 
-# To run the spider without a project (script way)
+# To run the spider as a script, with the project's pipelines:
+# python -m wiki_crawler.spiders.wiki_spider (from the crawler directory)
 if __name__ == "__main__":
-    process = CrawlerProcess()
+    process = CrawlerProcess(get_project_settings())
     process.crawl(WikiSpider)
     process.start()
@@ -0,0 +1,304 @@
+import os
+import json
+import uuid
+import struct
+from array import array
+from index_format import (
+    FORMAT_VERSION,
+    LEXICON_RECORD,
+    SEGMENTS_DIR,
+    SEGMENTS_FILE,
+    WEIGHT_ENCODINGS,
+    decode_postings,
+    encode_postings,
+    from_little_endian,
+    to_little_endian,
+)
+
+# Compact on-disk layout of the inverted index (read by processor/index_reader.py)
+#
+#   index/CURRENT                name of the live generation (see generations.py)
+#   index/gen-NNNNNN/            one generation of the index:
+#       segments.json            format version, index version, weight encoding, number of
+#                                shards, next doc id, live segments (each belonging to one
+#                                shard) and deleted (tombstoned) doc ids
+#       docnames.bin             utf-8 bytes of every filename, concatenated (append-only)
+#       docnames.idx             uint64 offsets into docnames.bin (next_doc_id + 1 entries)
+#       manifest.json            size, mtime and content hash of every indexed file
+#       docstore-S.*             document texts of shard S (see doc_store.py)
+#       spelling/                spelling correction index (see spelling_index.py)
+#   index/segments/seg-NNNNNN/   one immutable segment, shared by the generations listing it:
+#       header.json              document/term/postings counts
+#       lexicon.bin              one fixed-size record per term, sorted by the term's utf-8 bytes
+#       terms.bin                utf-8 bytes of every term, concatenated
+#       postings.bin             per term: weights block, then delta-encoded varint doc ids;
+#                                with weights="impact", impact blocks instead
+#       docids.bin               uint32 doc ids stored in this segment, ascending
+#
+# The records and codecs of these files are defined in index_format.py.
+
+INDEX_DIR = "index"
+
+
+def iter_postings(tfidf_matrix):
+    # Yields (column, doc_ids, weights) for every term that has postings, touching
+    # only the stored nonzeros. Converting to CSC groups the entries by column
+    # and sorting the indices keeps each term's doc ids ascending.
+    csc = tfidf_matrix.tocsc(copy=True)
+    csc.eliminate_zeros()
+    csc.sort_indices()
+    indptr = csc.indptr
+    for col in range(csc.shape[1]):
+        start, end = indptr[col], indptr[col + 1]
+        if start < end:
+            yield col, csc.indices[start:end], csc.data[start:end]
+
+
+def write_string_table(strings, blob_path, offsets_path):
+    offsets = array("Q", [0])
+    with open(blob_path, "wb") as blob:
+        for value in strings:
+            data = value.encode("utf-8")
+            blob.write(data)
+            offsets.append(offsets[-1] + len(data))
+    with open(offsets_path, "wb") as f:
+        f.write(to_little_endian(offsets))
+
+
+def string_table_end(offsets_path):
+    # Length of the blob the offsets refer to
+    with open(offsets_path, "rb") as f:
+        f.seek(-8, os.SEEK_END)
+        return struct.unpack("<Q", f.read(8))[0]
+
+
+def read_string_table(blob_path, offsets_path, count=None):
+    # The first count strings (all by default)
+    with open(offsets_path, "rb") as f:
+        offsets = from_little_endian("Q", f.read())
+    if count is not None:
+        offsets = offsets[: count + 1]
+    with open(blob_path, "rb") as f:
+        data = f.read(offsets[-1])
+    return [
+        data[start:end].decode("utf-8") for start, end in zip(offsets, offsets[1:])
+    ]
+
+
+def append_string_table(strings, blob_path, offsets_path):
+    end = string_table_end(offsets_path)
+    offsets = array("Q")
+    with open(blob_path, "ab") as blob:
+        for value in strings:
+            data = value.encode("utf-8")
+            blob.write(data)
+            end += len(data)
+            offsets.append(end)
+    with open(offsets_path, "ab") as f:
+        f.write(to_little_endian(offsets))
+
+
+def write_segment(segment_dir, postings, doc_ids, weights="float32"):
+    # postings: iterable of (term, doc_ids, weights) in ascending term order
+    if weights not in WEIGHT_ENCODINGS:
+        raise ValueError(f"Unknown weight encoding: {weights}")
+    os.makedirs(segment_dir, exist_ok=True)
+
+    num_terms = 0
+    num_postings = 0
+    term_offset = 0
+    postings_offset = 0
+    with open(os.path.join(segment_dir, "lexicon.bin"), "wb") as lexicon, open(
+        os.path.join(segment_dir, "terms.bin"), "wb"
+    ) as terms, open(os.path.join(segment_dir, "postings.bin"), "wb") as postings_file:
+        for term, term_doc_ids, term_weights in postings:
+            max_weight = max(term_weights)
+            block = encode_postings(term_doc_ids, term_weights, max_weight, weights)
+            term_bytes = term.encode("utf-8")
+
+            lexicon.write(
+                LEXICON_RECORD.pack(
+                    term_offset,
+                    len(term_bytes),
+                    len(term_doc_ids),
+                    postings_offset,
+                    len(block),
+                    max_weight,
+                )
+            )
+            terms.write(term_bytes)
+            postings_file.write(block)
+            term_offset += len(term_bytes)
+            postings_offset += len(block)
+            num_terms += 1
+            num_postings += len(term_doc_ids)
+
+    with open(os.path.join(segment_dir, "docids.bin"), "wb") as f:
+        f.write(to_little_endian(array("I", sorted(doc_ids))))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "num_docs": len(doc_ids),
+        "num_terms": num_terms,
+        "num_postings": num_postings,
+        "weights": weights,
+    }
+    with open(os.path.join(segment_dir, "header.json"), "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=4)
+    return header
+
+
+def read_segment_header(segment_dir):
+    with open(os.path.join(segment_dir, "header.json"), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def read_segment_doc_ids(segment_dir):
+    with open(os.path.join(segment_dir, "docids.bin"), "rb") as f:
+        return from_little_endian("I", f.read()).tolist()
+
+
+def read_lexicon(segment_dir):
+    # Returns [(term, df, postings offset, postings length, max weight), ...] in term order
+    with open(os.path.join(segment_dir, "lexicon.bin"), "rb") as f:
+        lexicon = f.read()
+    with open(os.path.join(segment_dir, "terms.bin"), "rb") as f:
+        terms = f.read()
+    entries = []
+    for record in LEXICON_RECORD.iter_unpack(lexicon):
+        term_offset, term_length, df, offset, length, max_weight = record
+        term = terms[term_offset : term_offset + term_length].decode("utf-8")
+        entries.append((term, df, offset, length, max_weight))
+    return entries
+
+
+def read_segment(segment_dir):
+    # Yields (term, doc_ids, weights) for every term of the segment in term order
+    encoding = read_segment_header(segment_dir)["weights"]
+    lexicon = read_lexicon(segment_dir)
+    with open(os.path.join(segment_dir, "postings.bin"), "rb") as f:
+        for term, df, offset, length, max_weight in lexicon:
+            f.seek(offset)
+            doc_ids, weights = decode_postings(f.read(length), df, max_weight, encoding)
+            yield term, doc_ids, weights
+
+
+def load_segments(generation_dir):
+    with open(os.path.join(generation_dir, SEGMENTS_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_segments(segments, generation_dir):
+    # Written to a temporary file and renamed, so readers never see a partial file.
+    # Every save gets a new version, which the processor uses to drop its caches.
+    segments["version"] = uuid.uuid4().hex
+    path = os.path.join(generation_dir, SEGMENTS_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(segments, f, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def numbered_entries(directory, prefix):
+    # [(number, name), ...] of the "<prefix>-NNNNNN" entries in directory, ascending
+    entries = []
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            head, _, number = name.partition("-")
+            if head == prefix and number.isdigit():
+                entries.append((int(number), name))
+    return sorted(entries)
+
+
+def segments_dir(generation_dir):
+    return os.path.join(os.path.dirname(os.path.normpath(generation_dir)), SEGMENTS_DIR)
+
+
+def segment_path(generation_dir, name):
+    return os.path.join(segments_dir(generation_dir), name)
+
+
+def new_segment_name(generation_dir):
+    # Segment names are unique across generations, so a full build never
+    # reuses the name of a segment an older generation still lists
+    numbers = numbered_entries(segments_dir(generation_dir), "seg")
+    return f"seg-{numbers[-1][0] + 1 if numbers else 0:06d}"
+
+
+def shard_of(doc_id, num_shards):
+    # Documents are dealt to the shards round-robin by doc id, so shard S holds
+    # doc ids S, S + num_shards, ... and its document store is indexed by
+    # doc_id // num_shards. Every weight uses the idf of the whole index.
+    return doc_id % num_shards
+
+
+def segment_entry(name, header, shard=0):
+    return {
+        "name": name,
+        "shard": shard,
+        "num_docs": header["num_docs"],
+        "num_postings": header["num_postings"],
+    }
+
+
+def write_binary_index(
+    vectorizer,
+    tfidf_matrix,
+    filenames,
+    generation_dir,
+    weights="float32",
+    num_shards=1,
+):
+    # Full build: one segment per shard
+
+    # sklearn sorts the vocabulary by code point, which matches utf-8 byte order,
+    # so columns can be written in order and binary searched by the processor
+    feature_names = vectorizer.get_feature_names_out()
+
+    def shard_postings(shard):
+        # Row i of the shard's rows is document shard + i * num_shards
+        rows = tfidf_matrix[shard::num_shards]
+        return (
+            (
+                feature_names[col],
+                (doc_ids * num_shards + shard).tolist(),
+                col_weights.tolist(),
+            )
+            for col, doc_ids, col_weights in iter_postings(rows)
+        )
+
+    return write_shards(shard_postings, filenames, generation_dir, weights, num_shards)
+
+
+def write_shards(
+    shard_postings, filenames, generation_dir, weights="float32", num_shards=1
+):
+    # Writes a full build: shard_postings(shard) yields the (term, doc_ids,
+    # weights) of one shard in term order, filenames are in doc id order
+    entries = []
+    for shard in range(num_shards):
+        name = new_segment_name(generation_dir)
+        header = write_segment(
+            segment_path(generation_dir, name),
+            shard_postings(shard),
+            range(shard, len(filenames), num_shards),
+            weights=weights,
+        )
+        entries.append(segment_entry(name, header, shard))
+
+    write_string_table(
+        filenames,
+        os.path.join(generation_dir, "docnames.bin"),
+        os.path.join(generation_dir, "docnames.idx"),
+    )
+    save_segments(
+        {
+            "format_version": FORMAT_VERSION,
+            "weights": weights,
+            "num_shards": num_shards,
+            "next_doc_id": len(filenames),
+            "segments": entries,
+            "deleted": [],
+        },
+        generation_dir,
+    )
+    return entries
@@ -0,0 +1,89 @@
+import os
+import json
+import zlib
+from index_format import DOCSTORE_RECORD
+
+# Document store read by processor/doc_store.py. Every shard has its own store.
+# The cleaned text of every document is appended to the store of its shard,
+# packed into zlib-compressed blocks of about BLOCK_SIZE bytes (or stored as is
+# with compression "none"), and one fixed-size record per document of the
+# shard (doc_id // num_shards) lets any document be fetched without reading
+# the others. The files live in each generation directory:
+#
+#   docstore-S.json   compression and block size
+#   docstore-S.bin    document blocks (append-only)
+#   docstore-S.idx    per document: block offset, block length, offset in block, length
+
+COMPRESSIONS = ("zlib", "none")
+BLOCK_SIZE = 64 * 1024
+
+
+def store_name(shard):
+    return f"docstore-{shard}"
+
+
+def stored_size(generation_dir, shard):
+    # Length of the store's .bin the records refer to; blocks are written in order
+    path = os.path.join(generation_dir, store_name(shard) + ".idx")
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return 0
+    with open(path, "rb") as f:
+        f.seek(-DOCSTORE_RECORD.size, os.SEEK_END)
+        offset, block_length, _, _ = DOCSTORE_RECORD.unpack(f.read())
+    return offset + block_length
+
+
+class DocStoreWriter:
+    # Appends to an existing store, so incremental builds can add documents
+    def __init__(
+        self, generation_dir, shard=0, compression="zlib", block_size=BLOCK_SIZE
+    ):
+        path = os.path.join(generation_dir, store_name(shard))
+        settings_path = path + ".json"
+        if os.path.exists(settings_path):
+            with open(settings_path, "r", encoding="utf-8") as f:
+                settings = json.load(f)
+        else:
+            if compression not in COMPRESSIONS:
+                raise ValueError(f"Unknown compression: {compression}")
+            settings = {"compression": compression, "block_size": block_size}
+            with open(settings_path, "w", encoding="utf-8") as f:
+                json.dump(settings, f, indent=4)
+        self.compression = settings["compression"]
+        self.block_size = settings["block_size"]
+
+        self.data = open(path + ".bin", "ab")
+        self.records = open(path + ".idx", "ab")
+        self.block = bytearray()
+        self.pending = []  # (offset in block, length) of the buffered documents
+
+    def add(self, text):
+        data = text.encode("utf-8")
+        self.pending.append((len(self.block), len(data)))
+        self.block += data
+        if self.compression == "none" or len(self.block) >= self.block_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        block = bytes(self.block)
+        if self.compression == "zlib":
+            block = zlib.compress(block)
+        offset = self.data.tell()
+        self.data.write(block)
+        for start, length in self.pending:
+            self.records.write(DOCSTORE_RECORD.pack(offset, len(block), start, length))
+        self.block = bytearray()
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.records.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
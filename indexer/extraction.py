@@ -0,0 +1,59 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from bs4 import BeautifulSoup
+from w3lib.html import replace_entities, remove_tags
+
+
+def list_html_files(directory):
+    # Sorted so document IDs are the same on every run and every machine
+    return sorted(
+        filename for filename in os.listdir(directory) if filename.endswith(".html")
+    )
+
+
+def paragraph_text(html):
+    # The text of every <p> of a page, which is what gets indexed
+    soup = BeautifulSoup(html, "lxml")
+    paragraphs = soup.find_all("p")
+    return " ".join(replace_entities(remove_tags(str(p))) for p in paragraphs).strip()
+
+
+def html_to_text(filepath):
+    with open(filepath, "r", encoding="utf-8") as file:
+        return paragraph_text(file.read())
+
+
+def page_to_text(body):
+    # Pages from the crawl archive are utf-8 bytes, like the saved files
+    return paragraph_text(body.decode("utf-8"))
+
+
+def parallel_map(function, items, workers=None, prefetch=4):
+    # Yields function(item) for each item in the order given. The calls run in
+    # a process pool, but only workers * prefetch items are in flight at a time
+    # so a slow consumer never has the whole corpus sitting in memory.
+    if workers == 1:
+        for item in items:
+            yield function(item)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for item in items:
+            pending.append(pool.submit(function, item))
+            if len(pending) >= workers * prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def extract_texts(filepaths, workers=None, prefetch=4):
+    # Yields the cleaned text of each file in the order given
+    return parallel_map(html_to_text, filepaths, workers, prefetch)
+
+
+def extract_page_texts(bodies, workers=None, prefetch=4):
+    # Yields the cleaned text of each raw page (bytes) in the order given
+    return parallel_map(page_to_text, bodies, workers, prefetch)
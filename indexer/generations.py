@@ -0,0 +1,156 @@
+import os
+import fcntl
+import shutil
+from contextlib import contextmanager
+from binary_index import (
+    INDEX_DIR,
+    load_segments,
+    numbered_entries,
+    segments_dir,
+    string_table_end,
+)
+from doc_store import store_name, stored_size
+
+# Every build, update or merge writes a new generation directory and publishes
+# it by atomically replacing index/CURRENT. The processor notices the new
+# pointer, opens the new generation in the background and swaps it in, while
+# the generation it was serving stays untouched on disk.
+#
+# An update starts from a copy of the current generation. The append-only
+# docnames.bin and docstore-S.bin are hard-linked instead of copied: the new
+# generation appends past the end that the old generation's offsets refer to.
+# Segments are shared, and a segment is removed once no kept generation lists it.
+#
+# Writers (indexer.py and the crawler's streaming pipeline) hold an exclusive
+# flock on index/LOCK from new_generation() until the generation is published
+# or discarded, so two writers never start from the same CURRENT or remove
+# each other's files. The kernel releases the lock when its process exits.
+
+CURRENT_FILE = "CURRENT"
+LOCK_FILE = "LOCK"
+KEEP_GENERATIONS = 2  # the live generation and the one before it
+
+_locked = set()  # real paths of the index directories this process holds
+
+
+class IndexLocked(Exception):
+    pass
+
+
+@contextmanager
+def writer_lock(index_dir=INDEX_DIR, wait=True):
+    # Raises IndexLocked if another writer holds the lock and wait is False
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, LOCK_FILE), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            if not wait:
+                raise IndexLocked(f"{index_dir} is being written by another process")
+            print(f"Waiting for the other process writing {index_dir} to finish")
+            fcntl.flock(f, fcntl.LOCK_EX)
+        path = os.path.realpath(index_dir)
+        _locked.add(path)
+        try:
+            yield
+        finally:
+            _locked.discard(path)
+
+
+def check_locked(index_dir):
+    if os.path.realpath(index_dir) not in _locked:
+        raise RuntimeError(f"Writing to {index_dir} without holding writer_lock()")
+
+
+def referenced_size(generation_dir, filename):
+    # How much of an append-only file the generation refers to, or None for
+    # the files that are rewritten instead
+    if filename == "docnames.bin":
+        return string_table_end(os.path.join(generation_dir, "docnames.idx"))
+    name, extension = os.path.splitext(filename)
+    prefix = store_name("")
+    if extension == ".bin" and name.startswith(prefix):
+        return stored_size(generation_dir, int(name[len(prefix) :]))
+    return None
+
+
+def generation_name(number):
+    return f"gen-{number:06d}"
+
+
+def current_generation(index_dir=INDEX_DIR):
+    # Path of the live generation, or None before the first full build
+    path = os.path.join(index_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return os.path.join(index_dir, f.read().strip())
+
+
+def new_generation(index_dir=INDEX_DIR, base=None):
+    # Empty for a full build, or a copy of base (a generation path) for an update.
+    # The writer lock is held, so generations newer than the live one were
+    # left behind by a writer that failed before publishing
+    check_locked(index_dir)
+    generations = numbered_entries(index_dir, "gen")
+    current = current_generation(index_dir)
+    for _, name in generations:
+        if current is None or name > os.path.basename(current):
+            discard_generation(os.path.join(index_dir, name))
+    number = generations[-1][0] + 1 if generations else 0
+    generation_dir = os.path.join(index_dir, generation_name(number))
+    os.makedirs(generation_dir)
+    os.makedirs(segments_dir(generation_dir), exist_ok=True)
+    if base is None:
+        return generation_dir
+
+    for filename in os.listdir(base):
+        source = os.path.join(base, filename)
+        target = os.path.join(generation_dir, filename)
+        size = referenced_size(base, filename)
+        if size is not None:
+            os.link(source, target)
+            # Drop whatever an abandoned update appended after the last record
+            os.truncate(target, size)
+        elif os.path.isfile(source):
+            shutil.copy2(source, target)
+        # spelling/ is rebuilt for every generation
+    return generation_dir
+
+
+def publish_generation(generation_dir):
+    # The rename is atomic, so readers see either the old or the new generation
+    index_dir = os.path.dirname(os.path.normpath(generation_dir))
+    check_locked(index_dir)
+    path = os.path.join(index_dir, CURRENT_FILE)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        f.write(os.path.basename(os.path.normpath(generation_dir)) + "\n")
+    os.replace(path + ".tmp", path)
+    collect_garbage(index_dir)
+
+
+def discard_generation(generation_dir):
+    # An unpublished generation; shared files are only unlinked
+    shutil.rmtree(generation_dir)
+
+
+def collect_garbage(index_dir=INDEX_DIR):
+    # Processes that still have removed files mapped keep reading them until
+    # they switch to a newer generation
+    current = current_generation(index_dir)
+    if current is None:
+        return
+    current_name = os.path.basename(current)
+    generations = [name for _, name in numbered_entries(index_dir, "gen")]
+    kept = generations[: generations.index(current_name) + 1][-KEEP_GENERATIONS:]
+    for name in generations:
+        if name not in kept:
+            shutil.rmtree(os.path.join(index_dir, name))
+
+    listed = set()
+    for name in kept:
+        segments = load_segments(os.path.join(index_dir, name))
+        listed.update(segment["name"] for segment in segments["segments"])
+    for _, name in numbered_entries(segments_dir(current), "seg"):
+        if name not in listed:
+            shutil.rmtree(os.path.join(segments_dir(current), name))
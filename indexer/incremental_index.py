@@ -0,0 +1,430 @@
+import os
+import math
+import json
+import heapq
+import hashlib
+import numpy as np
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from binary_index import (
+    FORMAT_VERSION,
+    append_string_table,
+    iter_postings,
+    load_segments,
+    new_segment_name,
+    read_lexicon,
+    read_segment,
+    read_segment_doc_ids,
+    save_segments,
+    segment_entry,
+    segment_path,
+    shard_of,
+    write_segment,
+    write_string_table,
+)
+from doc_store import DocStoreWriter
+from extraction import extract_page_texts, extract_texts, list_html_files
+from page_archive import live_pages, read_pages
+
+# Incremental indexing: new and changed pages go into a new immutable segment,
+# removed and replaced documents are tombstoned in segments.json, and segments
+# are merged under a size-tiered policy. All of it happens in a new generation
+# (see generations.py), so the generation being served is never modified.
+#
+# Near-duplicates collapsed by a full build (see near_duplicates.py) stay in
+# the manifest with "alias_of" instead of a doc id. Incremental updates don't
+# look for new near-duplicates; an alias whose page or canonical document
+# changes is indexed again as a document of its own.
+
+MANIFEST_FILE = "manifest.json"
+ALIASES_FILE = "aliases.json"
+MERGE_FACTOR = 4  # merge once a size tier holds this many segments
+MIN_MERGE_SIZE = 1000  # postings; smaller segments all share the lowest tier
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_entry(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "hash": file_hash(path)}
+
+
+def page_entry(body):
+    # Manifest entry of a page that was never read from a file. Without an
+    # mtime, scan_changes compares the hash with the file saved for the page.
+    return {"size": len(body), "mtime": None, "hash": hashlib.sha1(body).hexdigest()}
+
+
+def load_manifest(generation_dir):
+    with open(os.path.join(generation_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_json(data, path):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(path + ".tmp", path)
+
+
+def save_manifest(manifest, generation_dir):
+    # Also writes the canonical filename -> aliases table the processor reads
+    aliases = {}
+    for filename, entry in sorted(manifest.items()):
+        if "alias_of" in entry:
+            aliases.setdefault(entry["alias_of"], []).append(filename)
+    write_json(aliases, os.path.join(generation_dir, ALIASES_FILE))
+    write_json(manifest, os.path.join(generation_dir, MANIFEST_FILE))
+
+
+def manifest_entries(filenames, entries, aliases):
+    # entries: filename -> manifest entry for every page read by a full build,
+    # filenames: the indexed ones in doc-id order, aliases: alias -> canonical
+    manifest = {
+        filename: {**entries[filename], "doc_id": doc_id}
+        for doc_id, filename in enumerate(filenames)
+    }
+    for alias, canonical in aliases.items():
+        manifest[alias] = {**entries[alias], "alias_of": canonical}
+    return manifest
+
+
+def build_manifest(directory, filenames, generation_dir, aliases=None):
+    # Called after a full build: filenames are in doc-id order
+    aliases = aliases or {}
+    entries = {
+        filename: file_entry(os.path.join(directory, filename))
+        for filename in [*filenames, *aliases]
+    }
+    manifest = manifest_entries(filenames, entries, aliases)
+    save_manifest(manifest, generation_dir)
+    return manifest
+
+
+def build_archive_manifest(pages, filenames, generation_dir, aliases=None):
+    # Same for a full build from the crawl archive: pages are the live cdx
+    # entries that were read
+    aliases = aliases or {}
+    entries = {page["filename"]: archive_entry(page) for page in pages}
+    manifest = manifest_entries(filenames, entries, aliases)
+    save_manifest(manifest, generation_dir)
+    return manifest
+
+
+def orphaned_aliases(manifest, changed, deleted):
+    # Aliases of documents that are being replaced or removed, and not
+    # themselves changed or removed
+    gone = set(changed) | set(deleted)
+    return sorted(
+        filename
+        for filename, entry in manifest.items()
+        if entry.get("alias_of") in gone and filename not in gone
+    )
+
+
+def scan_changes(directory, manifest):
+    # Size and mtime are checked first; the content hash is only computed for
+    # files whose metadata changed, so untouched pages are never read. Returns
+    # (changed, deleted, touched): touched counts the files whose mtime changed
+    # without their content, which are updated in the manifest.
+    current = list_html_files(directory)
+    changed = []
+    touched = 0
+    for filename in current:
+        path = os.path.join(directory, filename)
+        stat = os.stat(path)
+        known = manifest.get(filename)
+        if (
+            known
+            and known["size"] == stat.st_size
+            and known["mtime"] == stat.st_mtime_ns
+        ):
+            continue
+        entry = file_entry(path)
+        if known and known["hash"] == entry["hash"]:
+            known["mtime"] = entry["mtime"]  # touched, content unchanged
+            touched += 1
+            continue
+        changed.append((filename, entry))
+    deleted = sorted(set(manifest) - set(current))
+    orphans = orphaned_aliases(manifest, [f for f, _ in changed], deleted)
+    changed += [(f, file_entry(os.path.join(directory, f))) for f in orphans]
+    return changed, deleted, touched
+
+
+def archive_entry(page):
+    # Manifest entry of a page from the crawl archive (a cdx entry), the same
+    # as page_entry of its body
+    return {"size": page["size"], "mtime": None, "hash": page["sha1"]}
+
+
+def scan_archive(archive_dir, manifest):
+    # Like scan_changes for the crawl archive; returns (cdx entries of the new
+    # or changed pages in archive order, deleted filenames)
+    pages = live_pages(archive_dir)
+    changed = [
+        page
+        for page in pages
+        if manifest.get(page["filename"], {}).get("hash") != page["sha1"]
+    ]
+    deleted = sorted(set(manifest) - {page["filename"] for page in pages})
+    orphans = set(orphaned_aliases(manifest, [p["filename"] for p in changed], deleted))
+    changed += [page for page in pages if page["filename"] in orphans]
+    changed.sort(key=lambda page: page["offset"])  # read the archive front to back
+    return changed, deleted
+
+
+def segment_doc_frequencies(generation_dir, segments):
+    doc_frequencies = {}
+    for segment in segments["segments"]:
+        lexicon = read_lexicon(segment_path(generation_dir, segment["name"]))
+        for term, df, _, _, _ in lexicon:
+            doc_frequencies[term] = doc_frequencies.get(term, 0) + df
+    return doc_frequencies
+
+
+def weight_documents(texts, generation_dir, segments):
+    # Same weighting as TfidfVectorizer() (raw counts, smooth idf, l2 norm), but
+    # the idf uses document frequencies across the existing segments as well,
+    # so scores from the new segment are comparable with the old ones
+    counter = CountVectorizer()
+    try:
+        counts = counter.fit_transform(texts).astype(np.float64)
+    except ValueError:  # no terms at all in the new documents
+        return [], None
+    terms = counter.get_feature_names_out()
+
+    existing = segment_doc_frequencies(generation_dir, segments)
+    doc_frequencies = np.bincount(counts.indices, minlength=len(terms))
+    doc_frequencies += np.array([existing.get(term, 0) for term in terms])
+    num_docs = sum(s["num_docs"] for s in segments["segments"]) + counts.shape[0]
+    idf = np.log((1 + num_docs) / (1 + doc_frequencies)) + 1
+    return terms, normalize(counts.multiply(idf).tocsr())
+
+
+def add_documents(generation_dir, segments, manifest, documents):
+    # documents: [(filename, manifest entry, text), ...] with distinct filenames.
+    # Earlier versions of the same filenames are tombstoned. Updates segments
+    # and manifest in place (the caller saves them) and returns
+    # (names of the new segments, number of documents tombstoned).
+    previous = [manifest.get(filename, {}) for filename, _, _ in documents]
+    removed_ids = [entry["doc_id"] for entry in previous if "doc_id" in entry]
+    segments["deleted"] = sorted(set(segments["deleted"]) | set(removed_ids))
+
+    first_id = segments["next_doc_id"]
+    filenames = [filename for filename, _, _ in documents]
+    texts = [text for _, _, text in documents]
+    terms, tfidf_matrix = weight_documents(texts, generation_dir, segments)
+
+    # One new segment for every shard receiving documents
+    num_shards = segments["num_shards"]
+    doc_ids = range(first_id, first_id + len(filenames))
+    names = []
+    for shard in range(num_shards):
+        first_row = (shard - first_id) % num_shards
+        shard_ids = doc_ids[first_row::num_shards]
+        if not shard_ids:
+            continue
+        postings = []
+        if tfidf_matrix is not None:
+            postings = (
+                (
+                    terms[col],
+                    (rows * num_shards + shard_ids[0]).tolist(),
+                    weights.tolist(),
+                )
+                for col, rows, weights in iter_postings(
+                    tfidf_matrix[first_row::num_shards]
+                )
+            )
+        name = new_segment_name(generation_dir)
+        header = write_segment(
+            segment_path(generation_dir, name),
+            postings,
+            shard_ids,
+            segments["weights"],
+        )
+        segments["segments"].append(segment_entry(name, header, shard))
+        names.append(name)
+
+    append_string_table(
+        filenames,
+        os.path.join(generation_dir, "docnames.bin"),
+        os.path.join(generation_dir, "docnames.idx"),
+    )
+    stores = [DocStoreWriter(generation_dir, shard) for shard in range(num_shards)]
+    for doc_id, text in zip(doc_ids, texts):
+        stores[shard_of(doc_id, num_shards)].add(text)
+    for store in stores:
+        store.close()
+
+    segments["next_doc_id"] += len(filenames)
+    for doc_id, (filename, entry, _) in zip(doc_ids, documents):
+        manifest[filename] = {**entry, "doc_id": doc_id}
+    return names, len(removed_ids)
+
+
+def update_index(
+    directory, generation_dir, workers=None, merge=True, archive_dir=None, base=None
+):
+    # Pages come from the crawl archive if archive_dir is given, else from the
+    # .html files in directory. Returns False if nothing was added, changed or
+    # removed. If only mtimes were refreshed, the manifest of base (the
+    # generation generation_dir was copied from) is updated in place, since
+    # nothing the processor reads changed. Merges due under the merge policy
+    # run here, before the update returns.
+    segments = load_segments(generation_dir)
+    manifest = load_manifest(generation_dir)
+    touched = 0
+    if archive_dir is not None:
+        pages, deleted = scan_archive(archive_dir, manifest)
+        changed = [(page["filename"], archive_entry(page)) for page in pages]
+        bodies = (body for _, body in read_pages(archive_dir, pages))
+        texts = extract_page_texts(bodies, workers=workers)
+    else:
+        changed, deleted, touched = scan_changes(directory, manifest)
+        filepaths = [os.path.join(directory, filename) for filename, _ in changed]
+        texts = extract_texts(filepaths, workers=workers)
+    if not changed and not deleted:
+        if touched:
+            # Saved so the next run doesn't hash these files again
+            write_json(manifest, os.path.join(base or generation_dir, MANIFEST_FILE))
+            print(f"Index is up to date, refreshed the mtime of {touched} files")
+            return base is None
+        print("Index is up to date")
+        return False
+
+    # Tombstone removed documents; changed ones are replaced by add_documents
+    removed = [manifest.pop(f) for f in deleted]
+    removed_ids = [entry["doc_id"] for entry in removed if "doc_id" in entry]
+    segments["deleted"] = sorted(set(segments["deleted"]) | set(removed_ids))
+
+    documents = [
+        (filename, entry, text) for (filename, entry), text in zip(changed, texts)
+    ]
+    names, replaced = add_documents(generation_dir, segments, manifest, documents)
+    save_segments(segments, generation_dir)
+    save_manifest(manifest, generation_dir)
+    print(
+        f"Indexed {len(documents)} new or changed documents"
+        + (f" into {', '.join(names)}" if names else "")
+        + f", tombstoned {len(removed_ids) + replaced}"
+    )
+
+    if merge:
+        apply_merge_policy(generation_dir)
+    return True
+
+
+def start_index(generation_dir, num_shards=1, weights="float32"):
+    # An index without documents, for builds that only ever add pages (such as
+    # the crawler's streaming pipeline)
+    write_string_table(
+        [],
+        os.path.join(generation_dir, "docnames.bin"),
+        os.path.join(generation_dir, "docnames.idx"),
+    )
+    for shard in range(num_shards):
+        DocStoreWriter(generation_dir, shard).close()
+    save_manifest({}, generation_dir)
+    save_segments(
+        {
+            "format_version": FORMAT_VERSION,
+            "weights": weights,
+            "num_shards": num_shards,
+            "next_doc_id": 0,
+            "segments": [],
+            "deleted": [],
+        },
+        generation_dir,
+    )
+
+
+def merge_postings(streams, deleted):
+    # streams: per-segment iterators of (term, doc_ids, weights) in term order
+    merged = heapq.merge(*streams, key=lambda entry: entry[0])
+    current_term, current = None, []
+    for term, doc_ids, weights in merged:
+        if term != current_term:
+            if current:
+                current.sort()
+                yield current_term, [d for d, _ in current], [w for _, w in current]
+            current_term, current = term, []
+        current.extend((d, w) for d, w in zip(doc_ids, weights) if d not in deleted)
+    if current:
+        current.sort()
+        yield current_term, [d for d, _ in current], [w for _, w in current]
+
+
+def merge_segments(names, generation_dir):
+    # Only segments of the same shard are merged
+    segments = load_segments(generation_dir)
+    (shard,) = {s["shard"] for s in segments["segments"] if s["name"] in names}
+    deleted = set(segments["deleted"])
+    segment_dirs = [segment_path(generation_dir, name) for name in names]
+
+    merged_ids = set()
+    for segment_dir in segment_dirs:
+        merged_ids.update(read_segment_doc_ids(segment_dir))
+
+    name = new_segment_name(generation_dir)
+    header = write_segment(
+        segment_path(generation_dir, name),
+        merge_postings([read_segment(d) for d in segment_dirs], deleted),
+        merged_ids - deleted,
+        segments["weights"],
+    )
+
+    # Tombstones of the merged segments are purged along with their postings
+    segments["segments"] = [s for s in segments["segments"] if s["name"] not in names]
+    segments["segments"].append(segment_entry(name, header, shard))
+    segments["deleted"] = sorted(deleted - merged_ids)
+    save_segments(segments, generation_dir)
+
+    # The merged segments are removed with the last generation listing them
+    return name
+
+
+def select_merges(segments, merge_factor=MERGE_FACTOR, min_size=MIN_MERGE_SIZE):
+    # Size-tiered: segments of a shard within a factor of merge_factor of each
+    # other share a tier, and a tier with merge_factor segments is merged into one
+    tiers = {}
+    for segment in segments["segments"]:
+        size = max(segment["num_postings"], min_size)
+        tier = int(math.log(size / min_size, merge_factor))
+        tiers.setdefault((segment["shard"], tier), []).append(segment["name"])
+    return [names[:merge_factor] for names in tiers.values() if len(names) >= merge_factor]
+
+
+def apply_merge_policy(generation_dir, merge_factor=MERGE_FACTOR):
+    # Repeat, since a merged segment can fill up the next tier
+    while True:
+        selected = select_merges(load_segments(generation_dir), merge_factor)
+        if not selected:
+            return
+        for names in selected:
+            merged = merge_segments(names, generation_dir)
+            print(f"Merging {', '.join(names)} into {merged}")
+
+
+def force_merge(generation_dir):
+    # On-demand merge of every shard's segments into one, purging all
+    # tombstones. Returns False if there was nothing to merge.
+    segments = load_segments(generation_dir)
+    num_shards = segments["num_shards"]
+    merged_any = False
+    for shard in range(num_shards):
+        names = [s["name"] for s in segments["segments"] if s["shard"] == shard]
+        deleted = [d for d in segments["deleted"] if shard_of(d, num_shards) == shard]
+        if len(names) > 1 or (names and deleted):
+            merged = merge_segments(names, generation_dir)
+            print(f"Merging {', '.join(names)} into {merged}")
+            merged_any = True
+    if not merged_any:
+        print("Nothing to merge")
+    return merged_any
@@ -0,0 +1,156 @@
+import sys
+import struct
+from array import array
+from itertools import accumulate
+
+# Binary format of the index files, shared by the writer (binary_index.py and
+# the other indexer modules) and the reader (processor/index_reader.py), so the
+# two can't drift apart. Any change to the records or codecs here is a format
+# change and must bump FORMAT_VERSION.
+
+FORMAT_VERSION = 2
+SEGMENTS_FILE = "segments.json"
+SEGMENTS_DIR = "segments"
+
+# term offset, term length, document frequency, postings offset, postings length, max weight
+LEXICON_RECORD = struct.Struct("<IHIQIf")
+
+# Per document in docstore-S.idx (see doc_store.py): block offset, block
+# length, offset and length of the text in the decompressed block
+DOCSTORE_RECORD = struct.Struct("<QIII")
+
+WEIGHT_ENCODINGS = ("float32", "uint8", "impact")
+
+# weights="impact" stores a term's postings impact-ordered for score-at-a-time
+# ranking (processor/evaluator.py): weights are quantized like "uint8", and
+# the postings sharing a quantized weight (impact) form one block. Blocks come
+# highest impact first, each as the impact byte, the number of postings
+# (varint) and their delta-encoded varint doc ids, ascending.
+
+
+def to_little_endian(values):
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values.tobytes()
+
+
+def from_little_endian(typecode, data):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def encode_varint(value, encoded):
+    # Appends value as a LEB128 varint
+    while value >= 0x80:
+        encoded.append((value & 0x7F) | 0x80)
+        value >>= 7
+    encoded.append(value)
+
+
+def encode_doc_ids(doc_ids):
+    # Store the gap to the previous doc id as a LEB128 varint
+    encoded = bytearray()
+    previous = 0
+    for doc_id in doc_ids:
+        encode_varint(doc_id - previous, encoded)
+        previous = doc_id
+    return bytes(encoded)
+
+
+def decode_doc_ids(data):
+    doc_ids = []
+    doc_id = 0
+    value = 0
+    shift = 0
+    for byte in data:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            doc_id += value
+            doc_ids.append(doc_id)
+            value = 0
+            shift = 0
+    return doc_ids
+
+
+def decode_varints(data, position, count):
+    # Returns count varints starting at position, and the position after them
+    values = []
+    value = 0
+    shift = 0
+    while len(values) < count:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            values.append(value)
+            value = 0
+            shift = 0
+    return values, position
+
+
+def quantize(weights, max_weight):
+    # Scale against the term's max weight, keeping every posting non-zero
+    scale = 255.0 / max_weight if max_weight > 0 else 0.0
+    return [max(1, min(255, round(w * scale))) for w in weights]
+
+
+def encode_weights(weights, max_weight, encoding):
+    if encoding == "float32":
+        return to_little_endian(array("f", weights))
+    return bytes(quantize(weights, max_weight))
+
+
+def decode_weights(data, df, max_weight, encoding):
+    if encoding == "float32":
+        return from_little_endian("f", data[: df * 4]).tolist(), data[df * 4 :]
+    scale = max_weight / 255.0
+    return [q * scale for q in data[:df]], data[df:]
+
+
+def encode_impact_blocks(doc_ids, weights, max_weight):
+    blocks = {}
+    for doc_id, impact in zip(doc_ids, quantize(weights, max_weight)):
+        blocks.setdefault(impact, []).append(doc_id)
+    encoded = bytearray()
+    for impact in sorted(blocks, reverse=True):
+        encoded.append(impact)
+        encode_varint(len(blocks[impact]), encoded)
+        encoded += encode_doc_ids(blocks[impact])
+    return bytes(encoded)
+
+
+def decode_impact_blocks(data):
+    # Yields (impact, doc_ids) highest impact first
+    position = 0
+    while position < len(data):
+        impact = data[position]
+        (count,), position = decode_varints(data, position + 1, 1)
+        gaps, position = decode_varints(data, position, count)
+        yield impact, list(accumulate(gaps))
+
+
+def encode_postings(doc_ids, weights, max_weight, encoding):
+    if encoding == "impact":
+        return encode_impact_blocks(doc_ids, weights, max_weight)
+    return encode_weights(weights, max_weight, encoding) + encode_doc_ids(doc_ids)
+
+
+def decode_postings(data, df, max_weight, encoding):
+    # Returns (doc_ids, weights) in doc id order
+    if encoding == "impact":
+        scale = max_weight / 255.0
+        postings = sorted(
+            (doc_id, impact * scale)
+            for impact, doc_ids in decode_impact_blocks(data)
+            for doc_id in doc_ids
+        )
+        return [doc_id for doc_id, _ in postings], [weight for _, weight in postings]
+    weights, rest = decode_weights(data, df, max_weight, encoding)
+    return decode_doc_ids(rest), weights
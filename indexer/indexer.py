@@ -1,86 +1,179 @@
 import os
-import pickle
+import sys
+import time
 import json
+import argparse
+import numpy as np
+from contextlib import nullcontext
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from bs4 import BeautifulSoup
-from w3lib.html import replace_entities, remove_tags
-
-
-def extract_text_from_html(directory):
-    documents = []
-    filenames = []
-    document_contents = {}
-    for filename in os.listdir(directory):
-        if filename.endswith(".html"):
-            filepath = os.path.join(directory, filename)
-            with open(filepath, "r", encoding="utf-8") as file:
-                soup = BeautifulSoup(file.read(), "lxml")
-                paragraphs = soup.find_all("p")
-                clean_text = " ".join(
-                    replace_entities(remove_tags(str(p))) for p in paragraphs
-                ).strip()
-                documents.append(clean_text)
-                filenames.append(filename)
-                document_id = len(documents) - 1  # Use document index as ID
-                document_contents[document_id] = {
-                    "document_name": filename,
-                    "content": clean_text,
-                }
-    with open("content.json", "w", encoding="utf-8") as f:
-        json.dump(document_contents, f, ensure_ascii=False, indent=4)
-    return documents, filenames
+from binary_index import (
+    WEIGHT_ENCODINGS,
+    iter_postings,
+    read_string_table,
+    shard_of,
+    write_binary_index,
+)
+from doc_store import DocStoreWriter
+from extraction import extract_page_texts, extract_texts, list_html_files
+from generations import (
+    current_generation,
+    discard_generation,
+    new_generation,
+    publish_generation,
+    writer_lock,
+)
+from incremental_index import (
+    build_archive_manifest,
+    build_manifest,
+    force_merge,
+    update_index,
+)
+from near_duplicates import THRESHOLD, NearDuplicateDetector
+from page_archive import has_archive, live_pages, read_pages
+from spelling_index import write_spelling_index
+from spimi import build_spimi_index
+from startup_bundle import write_startup_bundle
+from tfidf_artifacts import TfidfArtifacts, save_tfidf_artifacts
+
+
+class JsonObjectWriter:
+    # Writes a JSON object one member at a time. The file is identical to
+    # json.dump(obj, f, ensure_ascii=False, indent=4) on the complete dict.
+    def __init__(self, path):
+        self.file = open(path, "w", encoding="utf-8")
+        self.file.write("{")
+        self.empty = True
+
+    def write(self, key, value):
+        self.file.write("\n    " if self.empty else ",\n    ")
+        self.file.write(json.dumps(key, ensure_ascii=False) + ": ")
+        self.file.write(
+            json.dumps(value, ensure_ascii=False, indent=4).replace("\n", "\n    ")
+        )
+        self.empty = False
+
+    def close(self):
+        self.file.write("}" if self.empty else "\n}")
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def list_documents(num_docs):
+    # Filenames of the last full build in doc-id order. Doc ids are never
+    # reused, so they are the first num_docs names of the current generation.
+    generation_dir = current_generation()
+    if generation_dir is None:
+        raise SystemExit("No index yet, run a full build first")
+    return read_string_table(
+        os.path.join(generation_dir, "docnames.bin"),
+        os.path.join(generation_dir, "docnames.idx"),
+        num_docs,
+    )
+
+
+def extract_text_from_html(
+    directory,
+    generation_dir,
+    workers=None,
+    num_shards=1,
+    archive_dir=None,
+    pages=None,
+    detector=None,
+):
+    # Returns a lazy stream of document texts plus the filenames in doc-id order.
+    # Each document is written to content.json and its shard's document store
+    # as soon as it is parsed, so the full text of the corpus is never held in memory.
+    # With a crawl archive, pages (its live cdx entries) are read from it front to back.
+    # Near-duplicates found by detector are skipped; the returned filenames
+    # list only holds the indexed documents once the stream is consumed.
+    if archive_dir is not None:
+        filenames = [page["filename"] for page in pages]
+    else:
+        filenames = list_html_files(directory)
+    indexed = []
+
+    def page_texts():
+        if archive_dir is not None:
+            bodies = (body for _, body in read_pages(archive_dir, pages))
+            return extract_page_texts(bodies, workers=workers)
+        filepaths = [os.path.join(directory, filename) for filename in filenames]
+        return extract_texts(filepaths, workers=workers)
+
+    def documents():
+        stores = [DocStoreWriter(generation_dir, shard) for shard in range(num_shards)]
+        with JsonObjectWriter("content.json") as content:
+            for filename, clean_text in zip(filenames, page_texts()):
+                if detector is not None:
+                    if detector.add(filename, clean_text) is not None:
+                        continue  # a near-duplicate of an earlier document
+                document_id = len(indexed)
+                indexed.append(filename)
+                content.write(
+                    str(document_id),
+                    {"document_name": filename, "content": clean_text},
+                )
+                stores[shard_of(document_id, num_shards)].add(clean_text)
+                yield clean_text
+        for store in stores:
+            store.close()
+
+    if detector is None:
+        return documents(), filenames
+    return documents(), indexed
+
+
+def save_near_duplicates_report(detector, kept_postings, path="near_duplicates.json"):
+    report = detector.report(kept_postings)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+    print(
+        f"Near-duplicates: {report['aliases']} documents collapsed into "
+        f"{report['clusters']} canonical documents, "
+        f"{report['postings_removed']} postings removed "
+        f"({report['postings_removed_percent']}% of the postings)"
+    )
 
 
 def build_tfidf_index(documents):
     vectorizer = TfidfVectorizer()
     tfidf_matrix = vectorizer.fit_transform(documents)
-    with open("tfidf_model.pkl", "wb") as f:
-        pickle.dump(vectorizer, f)
-    with open("tfidf_matrix.pkl", "wb") as f:
-        pickle.dump(tfidf_matrix, f)
+    save_tfidf_artifacts(vectorizer, tfidf_matrix)
     return vectorizer, tfidf_matrix
 
 
 def save_inverted_index_json(vectorizer, tfidf_matrix, filenames):
     feature_names = vectorizer.get_feature_names_out()
-    dense = tfidf_matrix.todense()
-    densed_list = dense.tolist()
-
-    inverted_index = {}
-    for col in range(tfidf_matrix.shape[1]):
-        term = feature_names[col]
-        for row in range(tfidf_matrix.shape[0]):
-            if densed_list[row][col] > 0:
-                if term not in inverted_index:
-                    inverted_index[term] = []
-                document_entry = {
-                    "filename": filenames[row],
-                    "tfidf": densed_list[row][col],
-                    "document_id": row,  # Using the row index as a document ID
-                }
-                inverted_index[term].append(document_entry)
-
-    with open("inverted_index.json", "w", encoding="utf-8") as f:
-        json.dump(inverted_index, f, ensure_ascii=False, indent=4)
-
-
-# Example usage
-directory = "../crawler/data"
-documents, filenames = extract_text_from_html(directory)
-vectorizer, tfidf_matrix = build_tfidf_index(documents)
-save_inverted_index_json(vectorizer, tfidf_matrix, filenames)
+
+    # Stream one term at a time straight from the sparse matrix
+    with JsonObjectWriter("inverted_index.json") as inverted_index:
+        for col, doc_ids, weights in iter_postings(tfidf_matrix):
+            inverted_index.write(
+                feature_names[col],
+                [
+                    {
+                        "filename": filenames[row],
+                        "tfidf": score,
+                        "document_id": row,  # Using the row index as a document ID
+                    }
+                    for row, score in zip(doc_ids.tolist(), weights.tolist())
+                ],
+            )
 
 
 # below code is to see the console output
 
 
 def load_index():
-    with open("tfidf_model.pkl", "rb") as f:
-        vectorizer = pickle.load(f)
-    with open("tfidf_matrix.pkl", "rb") as f:
-        tfidf_matrix = pickle.load(f)
-    return vectorizer, tfidf_matrix
+    # The memory-mapped artifacts stand in for the vectorizer; the matrix is
+    # term x document
+    artifacts = TfidfArtifacts()
+    return artifacts, artifacts.term_matrix
+
 
 def load_config(config_path="config.json"):
     with open(config_path, "r") as f:
@@ -88,9 +181,11 @@ def load_config(config_path="config.json"):
     return config["top_k"], config["query"]
 
 
-def query_index(query, vectorizer, tfidf_matrix, filenames, top_k):
+def query_index(query, vectorizer, term_matrix, filenames, top_k):
+    # Query and documents are l2-normalized, so the dot product is the cosine
+    # similarity; only the rows of the query's terms are read
     query_vector = vectorizer.transform([query])
-    similarities = cosine_similarity(query_vector, tfidf_matrix).flatten()
+    similarities = (query_vector @ term_matrix).toarray().ravel()
     doc_similarities = sorted(
         enumerate(zip(filenames, similarities)), key=lambda x: x[1][1], reverse=True
     )
@@ -101,19 +196,269 @@ def query_index(query, vectorizer, tfidf_matrix, filenames, top_k):
     return top_documents
 
 
-# Load index and configuration
-top_k, query_text = load_config()
-vectorizer, tfidf_matrix = load_index()
-filenames = [
-    filename for filename in os.listdir("../crawler/data") if filename.endswith(".html")
-]
+# Batch mode for offline evaluation: many queries are vectorized together and
+# scored with one sparse matrix product per chunk
+
+BATCH_SIZE = 1024
+MAX_SCORE_CELLS = 1 << 24  # dense (query x document) scores per chunk, 128 MB
+
+
+def top_k_rows(scores, top_k):
+    # Best top_k columns of every row, ordered like query_index: by descending
+    # score, ties broken by the lower document ID
+    num_docs = scores.shape[1]
+    k = min(top_k, num_docs)
+    if k < num_docs:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(num_docs), (scores.shape[0], 1))
+
+    # argpartition picks arbitrarily among documents tied at the k-th score
+    kth = np.take_along_axis(scores, candidates, axis=1).min(axis=1)
+    for row in np.flatnonzero((scores >= kth[:, None]).sum(axis=1) > k):
+        above = np.flatnonzero(scores[row] > kth[row])
+        tied = np.flatnonzero(scores[row] == kth[row])[: k - len(above)]
+        candidates[row] = np.concatenate([above, tied])
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.lexsort((candidates, -candidate_scores), axis=1)
+    return (
+        np.take_along_axis(candidates, order, axis=1),
+        np.take_along_axis(candidate_scores, order, axis=1),
+    )
+
+
+def batch_query_index(queries, vectorizer, term_matrix, filenames, top_k):
+    # Yields (query, top_documents) for every query, in input order. Columns
+    # of term_matrix and the query vectors are l2-normalized, so the dot
+    # product is the cosine similarity.
+    chunk_size = max(1, min(BATCH_SIZE, MAX_SCORE_CELLS // max(1, len(filenames))))
+    chunk = []
+    for query in queries:
+        chunk.append(query)
+        if len(chunk) == chunk_size:
+            yield from _score_chunk(chunk, vectorizer, term_matrix, filenames, top_k)
+            chunk = []
+    if chunk:
+        yield from _score_chunk(chunk, vectorizer, term_matrix, filenames, top_k)
+
+
+def _score_chunk(chunk, vectorizer, term_matrix, filenames, top_k):
+    scores = (vectorizer.transform(chunk) @ term_matrix).toarray()
+    doc_ids, doc_scores = top_k_rows(scores, top_k)
+    for query, row_ids, row_scores in zip(chunk, doc_ids.tolist(), doc_scores.tolist()):
+        yield query, [
+            {"document_id": doc_id, "filename": filenames[doc_id], "tfidf_score": score}
+            for doc_id, score in zip(row_ids, row_scores)
+        ]
 
-# Fetch top documents based on the query
-top_docs = query_index(query_text, vectorizer, tfidf_matrix, filenames, top_k)
 
-# Print the top documents with their details
-print(f"Top {top_k} documents based on cosine similarity:")
-for doc in top_docs:
+def run_batch_queries(queries_path, output_path, top_k):
+    # One query per line in, one JSON object per line out
+    vectorizer, term_matrix = load_index()
+    filenames = list_documents(term_matrix.shape[1])
+    start = time.perf_counter()
+    count = 0
+    with open(queries_path, "r", encoding="utf-8") as queries_file, (
+        open(output_path, "w", encoding="utf-8") if output_path else nullcontext(sys.stdout)
+    ) as output:
+        queries = (line.strip() for line in queries_file if line.strip())
+        for query, top_docs in batch_query_index(
+            queries, vectorizer, term_matrix, filenames, top_k
+        ):
+            output.write(json.dumps({"query": query, "results": top_docs}) + "\n")
+            count += 1
+    elapsed = time.perf_counter() - start
     print(
-        f"Document ID: {doc['document_id']}, Document: {doc['filename']}, TF-IDF Score: {doc['tfidf_score']}"
+        f"{count} queries in {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} queries/s)",
+        file=sys.stderr,
+    )
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Build the search index")
+    parser.add_argument("--data-dir", default="../crawler/data")
+    parser.add_argument(
+        "--archive",
+        default="../crawler/archive",
+        help="crawl archive to index; used instead of --data-dir when it exists",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="HTML parsing processes (default: one per CPU, 1 parses in-process)",
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="split a full build into this many shards (default 1)",
+    )
+    parser.add_argument(
+        "--weights",
+        choices=WEIGHT_ENCODINGS,
+        default="float32",
+        help="posting weights of a full build: float32, 8-bit (uint8), or 8-bit in "
+        "impact-ordered blocks for score-at-a-time ranking (impact); incremental "
+        "updates keep the index's encoding",
+    )
+    parser.add_argument(
+        "--dedup-threshold",
+        type=float,
+        default=THRESHOLD,
+        help="similarity at which a page is collapsed into an earlier near-duplicate "
+        "(MinHash estimate of word 5-gram Jaccard; default %(default)s)",
+    )
+    parser.add_argument(
+        "--no-dedup",
+        action="store_true",
+        help="index near-duplicate pages as separate documents",
+    )
+    parser.add_argument(
+        "--spimi",
+        action="store_true",
+        help="out-of-core full build for corpora larger than memory; writes "
+        "everything but inverted_index.json. Near-duplicate detection still "
+        "keeps about 3.5 KB per document, add --no-dedup for the smallest peak",
+    )
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=256,
+        help="MB of postings --spimi buffers before writing a sorted run (default 256)",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only index new or changed pages into a new segment",
+    )
+    parser.add_argument(
+        "--merge",
+        action="store_true",
+        help="merge all index segments into one and purge deleted documents",
+    )
+    parser.add_argument(
+        "--batch-queries",
+        metavar="FILE",
+        help="rank every query in FILE (one per line) against the last full build",
+    )
+    parser.add_argument(
+        "--output", metavar="FILE", help="JSON lines output for --batch-queries"
+    )
+    parser.add_argument(
+        "--top-k", type=int, default=None, help="results per query (default: config.json)"
+    )
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    if args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1 MB")
+    return args
+
+
+if __name__ == "__main__":
+    args = parse_args()
+
+    directory = args.data_dir
+    archive_dir = args.archive if has_archive(args.archive) else None
+    if args.batch_queries:
+        top_k = args.top_k or load_config()[0]
+        run_batch_queries(args.batch_queries, args.output, top_k)
+        raise SystemExit
+
+    # Incremental updates and merges only touch index/; content.json,
+    # inverted_index.json and tfidf/ keep the last full build
+    if args.incremental or args.merge:
+        with writer_lock():
+            base = current_generation()
+            if base is None:
+                raise SystemExit("No index to update yet, run a full build first")
+            generation_dir = new_generation(base=base)
+            updated = False
+            if args.incremental:
+                updated = update_index(
+                    directory,
+                    generation_dir,
+                    workers=args.workers,
+                    archive_dir=archive_dir,
+                    base=base,
+                )
+            if args.merge:
+                updated = force_merge(generation_dir) or updated
+            if updated:
+                write_spelling_index(generation_dir)
+                write_startup_bundle(generation_dir)
+                publish_generation(generation_dir)
+            else:
+                discard_generation(generation_dir)
+        raise SystemExit
+
+    # Example usage
+    # The new generation is only published once it is complete; until then the
+    # processor keeps serving the previous one. Updates and merges wait for
+    # the build to finish, and it waits for them.
+    with writer_lock():
+        generation_dir = new_generation()
+        # Listed once so the manifest matches what was read if the crawler is
+        # still appending to the archive
+        pages = live_pages(archive_dir) if archive_dir is not None else None
+        detector = (
+            None if args.no_dedup else NearDuplicateDetector(args.dedup_threshold)
+        )
+        documents, filenames = extract_text_from_html(
+            directory,
+            generation_dir,
+            workers=args.workers,
+            num_shards=args.shards,
+            archive_dir=archive_dir,
+            pages=pages,
+            detector=detector,
+        )
+        if args.spimi:
+            num_postings = build_spimi_index(
+                documents,
+                filenames,
+                generation_dir,
+                num_shards=args.shards,
+                memory_budget=args.memory_budget * 1024 * 1024,
+                weights=args.weights,
+            )
+        else:
+            vectorizer, tfidf_matrix = build_tfidf_index(documents)
+            num_postings = tfidf_matrix.nnz
+            save_inverted_index_json(vectorizer, tfidf_matrix, filenames)
+            write_binary_index(
+                vectorizer,
+                tfidf_matrix,
+                filenames,
+                generation_dir,
+                weights=args.weights,
+                num_shards=args.shards,
+            )
+        aliases = {}
+        if detector is not None:
+            aliases = detector.alias_map()
+            save_near_duplicates_report(detector, num_postings)
+        if archive_dir is not None:
+            build_archive_manifest(pages, filenames, generation_dir, aliases)
+        else:
+            build_manifest(directory, filenames, generation_dir, aliases)
+        write_spelling_index(generation_dir)
+        write_startup_bundle(generation_dir)
+        publish_generation(generation_dir)
+
+    # Load index and configuration
+    top_k, query_text = load_config()
+    vectorizer, term_matrix = load_index()
+    filenames = list_documents(term_matrix.shape[1])
+
+    # Fetch top documents based on the query
+    top_docs = query_index(query_text, vectorizer, term_matrix, filenames, top_k)
+
+    # Print the top documents with their details
+    print(f"Top {top_k} documents based on cosine similarity:")
+    for doc in top_docs:
+        print(
+            f"Document ID: {doc['document_id']}, Document: {doc['filename']}, TF-IDF Score: {doc['tfidf_score']}"
+        )
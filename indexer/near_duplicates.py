@@ -0,0 +1,112 @@
+import re
+import zlib
+import numpy as np
+
+# Near-duplicate detection for full builds: MinHash signatures over word
+# shingles of the cleaned text, with LSH banding to find candidates. Documents
+# are checked in doc-id order as they stream in; one whose estimated Jaccard
+# similarity to an earlier canonical document reaches the threshold becomes an
+# alias of it and is left out of the index.
+
+SHINGLE_SIZE = 5  # words per shingle
+NUM_HASHES = 128
+BANDS = 16  # of NUM_HASHES // BANDS rows; pairs above ~0.7 similarity collide
+THRESHOLD = 0.9
+
+# Same tokens as TfidfVectorizer(), so the distinct tokens of a document are
+# the postings it adds to the index
+TOKEN = re.compile(r"(?u)\b\w\w+\b")
+PRIME = (1 << 31) - 1
+
+
+def shingles(tokens, size=SHINGLE_SIZE):
+    if len(tokens) <= size:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i : i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class NearDuplicateDetector:
+    def __init__(self, threshold=THRESHOLD, num_hashes=NUM_HASHES, bands=BANDS, seed=1):
+        rng = np.random.default_rng(seed)
+        # h(x) = (a * x + b) mod PRIME; with x < 2**31 nothing overflows uint64
+        self.a = rng.integers(1, PRIME, num_hashes, dtype=np.uint64)
+        self.b = rng.integers(0, PRIME, num_hashes, dtype=np.uint64)
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_hashes // bands
+        # Kept for every canonical document, so kept small: the band keys are
+        # hashes (a collision only adds a candidate, which is checked anyway)
+        # and the signatures uint32 (every value is below PRIME)
+        self.buckets = {}  # hash of (band, band values) -> [canonical keys]
+        self.signatures = {}  # canonical key -> signature
+        self.aliases = {}  # canonical key -> [(alias key, estimated similarity)]
+        self.removed_postings = 0
+
+    def signature(self, tokens):
+        hashes = np.fromiter(
+            (zlib.crc32(s.encode("utf-8")) & PRIME for s in shingles(tokens)),
+            dtype=np.uint64,
+        )
+        if not len(hashes):
+            return None
+        minimums = ((np.outer(self.a, hashes) + self.b[:, None]) % PRIME).min(axis=1)
+        return minimums.astype(np.uint32)
+
+    def add(self, key, text):
+        # Returns the canonical key text is a near-duplicate of, or None if key
+        # is kept as a canonical document itself
+        tokens = TOKEN.findall(text.lower())
+        signature = self.signature(tokens)
+        if signature is None:
+            return None
+        band_keys = [
+            hash((band, signature[band * self.rows : (band + 1) * self.rows].tobytes()))
+            for band in range(self.bands)
+        ]
+        candidates = dict.fromkeys(  # in the order they were added
+            other for band_key in band_keys for other in self.buckets.get(band_key, ())
+        )
+        # The most similar candidate at or above the threshold, the earliest on ties
+        best, best_similarity = None, self.threshold
+        for candidate in candidates:
+            similarity = float(np.mean(self.signatures[candidate] == signature))
+            if similarity > best_similarity or (
+                best is None and similarity == best_similarity
+            ):
+                best, best_similarity = candidate, similarity
+        if best is not None:
+            self.aliases.setdefault(best, []).append((key, best_similarity))
+            self.removed_postings += len(set(tokens))
+            return best
+
+        self.signatures[key] = signature
+        for band_key in band_keys:
+            self.buckets.setdefault(band_key, []).append(key)
+        return None
+
+    def alias_map(self):
+        # alias key -> canonical key
+        return {
+            alias: canonical
+            for canonical, aliases in self.aliases.items()
+            for alias, _ in aliases
+        }
+
+    def report(self, kept_postings):
+        removed = self.removed_postings
+        total = kept_postings + removed
+        return {
+            "threshold": self.threshold,
+            "clusters": len(self.aliases),
+            "aliases": sum(len(aliases) for aliases in self.aliases.values()),
+            "postings_kept": kept_postings,
+            "postings_removed": removed,
+            "postings_removed_percent": round(100 * removed / max(total, 1), 2),
+            "canonical": {
+                canonical: [
+                    {"alias": alias, "similarity": round(similarity, 3)}
+                    for alias, similarity in aliases
+                ]
+                for canonical, aliases in self.aliases.items()
+            },
+        }
@@ -0,0 +1,169 @@
+import os
+import json
+import gzip
+import uuid
+import hashlib
+from datetime import datetime, timezone
+
+# Append-only archive of crawled pages, written by the crawler and read
+# sequentially by the indexer. Every page is one WARC-style record compressed
+# as its own gzip member, so the archive is a valid multi-member gzip file and
+# any record can be decompressed on its own from its offset.
+#
+#   archive/pages.warc.gz   records: WARC headers, blank line, raw HTML
+#   archive/pages.cdx       one JSON line per fetched page: url, filename,
+#                           offset and length of its record, sha1 and size of the
+#                           HTML, and the page's ETag / Last-Modified if it had any
+#
+# Pages are deduplicated on the sha1 of their content: a page whose exact
+# bytes are already stored (a redirect, an alias title or an unchanged
+# refetch) only gets a cdx line pointing at the existing record, marked
+# "duplicate". The latest cdx line of a filename is its current version.
+
+ARCHIVE_FILE = "pages.warc.gz"
+INDEX_FILE = "pages.cdx"
+
+
+def has_archive(archive_dir):
+    return os.path.exists(os.path.join(archive_dir, INDEX_FILE))
+
+
+def read_index(archive_dir):
+    entries = []
+    with open(os.path.join(archive_dir, INDEX_FILE), "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    return entries
+
+
+def latest_by_url(archive_dir):
+    # url -> latest cdx entry, for conditional requests when recrawling
+    return {entry["url"]: entry for entry in read_index(archive_dir)}
+
+
+def live_pages(archive_dir):
+    # The current version of every filename, in archive order, with every
+    # distinct content once: of the filenames currently holding the same
+    # bytes, the one whose fetch stored them is kept (else the first)
+    latest = {}
+    for entry in read_index(archive_dir):
+        latest[entry["filename"]] = entry
+    by_content = {}
+    for entry in sorted(
+        latest.values(), key=lambda e: (e.get("duplicate", False), e["offset"])
+    ):
+        by_content.setdefault(entry["sha1"], entry)
+    return sorted(by_content.values(), key=lambda entry: entry["offset"])
+
+
+def parse_record(data):
+    # Returns (headers, body) of one decompressed record
+    head, _, rest = data.partition(b"\r\n\r\n")
+    lines = head.decode("utf-8").split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return headers, rest[: int(headers["Content-Length"])]
+
+
+def read_pages(archive_dir, entries):
+    # Yields (entry, html bytes) for entries sorted by offset, reading the
+    # archive front to back
+    with open(os.path.join(archive_dir, ARCHIVE_FILE), "rb") as f:
+        for entry in entries:
+            f.seek(entry["offset"])
+            _, body = parse_record(gzip.decompress(f.read(entry["length"])))
+            yield entry, body
+
+
+class PageArchiveWriter:
+    def __init__(self, archive_dir, compresslevel=6):
+        os.makedirs(archive_dir, exist_ok=True)
+        self.compresslevel = compresslevel
+        index_path = os.path.join(archive_dir, INDEX_FILE)
+        archive_path = os.path.join(archive_dir, ARCHIVE_FILE)
+
+        self.stored = {}  # sha1 -> cdx entry of the record holding that content
+        self.current = {}  # filename -> sha1 of its current version
+        self.holders = {}  # sha1 -> number of filenames currently holding it
+        end = 0
+        if os.path.exists(index_path):
+            for entry in read_index(archive_dir):
+                self.stored.setdefault(entry["sha1"], entry)
+                self._set_current(entry["filename"], entry["sha1"])
+                end = max(end, entry["offset"] + entry["length"])
+        if os.path.exists(archive_path):
+            # Drop a record that was written without its cdx line
+            os.truncate(archive_path, end)
+        self.archive = open(archive_path, "ab")
+        self.index = open(index_path, "a", encoding="utf-8")
+
+    def _set_current(self, filename, digest):
+        # Returns True if no other filename currently holds this content
+        previous = self.current.get(filename)
+        if previous == digest:
+            return False
+        if previous is not None:
+            self.holders[previous] -= 1
+        self.current[filename] = digest
+        self.holders[digest] = self.holders.get(digest, 0) + 1
+        return self.holders[digest] == 1
+
+    def add(self, url, filename, body, etag=None, last_modified=None):
+        # Returns True if the page needs indexing, False for an unchanged
+        # refetch or content that another page currently holds (same rule as
+        # live_pages)
+        digest = hashlib.sha1(body).hexdigest()
+        date = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        entry = {
+            "url": url,
+            "filename": filename,
+            "sha1": digest,
+            "size": len(body),
+            "date": date,
+        }
+        if etag:
+            entry["etag"] = etag
+        if last_modified:
+            entry["last_modified"] = last_modified
+        original = self.stored.get(digest)
+        if original is not None:
+            entry.update(
+                offset=original["offset"], length=original["length"], duplicate=True
+            )
+            self._write_index(entry)
+            return self._set_current(filename, digest)
+
+        head = (
+            "WARC/1.0\r\n"
+            "WARC-Type: resource\r\n"
+            f"WARC-Record-ID: <urn:uuid:{uuid.uuid4()}>\r\n"
+            f"WARC-Date: {date}\r\n"
+            f"WARC-Target-URI: {url}\r\n"
+            f"WARC-Block-Digest: sha1:{digest}\r\n"
+            "Content-Type: text/html\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "\r\n"
+        )
+        record = gzip.compress(
+            head.encode("utf-8") + body + b"\r\n\r\n", compresslevel=self.compresslevel
+        )
+        entry.update(offset=self.archive.tell(), length=len(record))
+        self.archive.write(record)
+        self.archive.flush()
+        self._write_index(entry)
+        self.stored[digest] = entry
+        return self._set_current(filename, digest)
+
+    def _write_index(self, entry):
+        self.index.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.index.flush()
+
+    def close(self):
+        self.archive.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
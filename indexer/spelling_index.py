@@ -0,0 +1,159 @@
+import os
+import json
+import heapq
+import bisect
+import numpy as np
+from array import array
+from binary_index import (
+    FORMAT_VERSION,
+    load_segments,
+    read_lexicon,
+    read_segment,
+    read_segment_doc_ids,
+    read_string_table,
+    segment_path,
+    to_little_endian,
+    write_string_table,
+)
+
+# Character-trigram candidate index for spelling correction (read by
+# processor/spelling.py). Instead of scoring every vocabulary term, the processor
+# only scores terms that share trigrams with the misspelled word.
+#
+#   spelling/header.json       format version and counts
+#   spelling/vocab.bin/.idx    string table of the vocabulary, sorted (term id -> term)
+#   spelling/grams.bin/.idx    string table of the trigrams, sorted
+#   spelling/gram_offsets.idx  uint64 offsets into gram_terms.bin, per trigram (+1)
+#   spelling/gram_terms.bin    uint32 term ids containing each trigram, ascending
+#
+# The spelling/ directory is written into every new generation. A generation
+# that only adds segments to the one it was copied from gets the old index with
+# the new terms merged in (update_spelling_index), without rebuilding it.
+
+SPELLING_DIR = "spelling"
+
+
+def trigrams(term):
+    # Padded like pg_trgm so prefixes and short words still produce trigrams
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def segment_live_terms(segment_dir, deleted):
+    # Terms with at least one posting of a document that isn't tombstoned.
+    # Postings are only decoded for segments holding tombstoned documents.
+    if deleted.isdisjoint(read_segment_doc_ids(segment_dir)):
+        return (entry[0] for entry in read_lexicon(segment_dir))
+    return (
+        term
+        for term, doc_ids, _ in read_segment(segment_dir)
+        if not deleted.issuperset(doc_ids)
+    )
+
+
+def live_vocabulary(generation_dir):
+    # Terms whose postings are all tombstoned are left out, so the corrector
+    # never suggests a word that finds nothing
+    segments = load_segments(generation_dir)
+    deleted = set(segments["deleted"])
+    lexicons = [
+        segment_live_terms(segment_path(generation_dir, segment["name"]), deleted)
+        for segment in segments["segments"]
+    ]
+    previous = None
+    for term in heapq.merge(*lexicons):
+        if term != previous:
+            yield term
+            previous = term
+
+
+def write_spelling_index(generation_dir):
+    vocabulary = list(live_vocabulary(generation_dir))
+    gram_terms = {}
+    for term_id, term in enumerate(vocabulary):
+        for gram in trigrams(term):
+            gram_terms.setdefault(gram, []).append(term_id)
+    return write_spelling_files(generation_dir, vocabulary, gram_terms)
+
+
+def update_spelling_index(generation_dir, base_dir, added_segments):
+    # For a generation that differs from base_dir (the generation it was
+    # copied from) only by the segments added_segments: no document was
+    # tombstoned, so every term of base stays live. Term ids after an inserted
+    # term shift up, which is done on the old index's arrays in place of
+    # recomputing every term's trigrams.
+    spelling_dir = os.path.join(base_dir, SPELLING_DIR)
+    vocabulary = read_string_table(
+        os.path.join(spelling_dir, "vocab.bin"), os.path.join(spelling_dir, "vocab.idx")
+    )
+    known = set(vocabulary)
+    added = sorted(
+        {
+            entry[0]
+            for name in added_segments
+            for entry in read_lexicon(segment_path(generation_dir, name))
+        }
+        - known
+    )
+    # added[j] goes before the old term at positions[j], so becomes term
+    # positions[j] + j; old term i moves up by the number of terms before it
+    positions = np.array([bisect.bisect_left(vocabulary, term) for term in added])
+    old_ids = np.arange(len(vocabulary))
+    new_ids = old_ids + np.searchsorted(positions, old_ids, side="right")
+
+    grams = read_string_table(
+        os.path.join(spelling_dir, "grams.bin"), os.path.join(spelling_dir, "grams.idx")
+    )
+    with open(os.path.join(spelling_dir, "gram_offsets.idx"), "rb") as f:
+        offsets = np.frombuffer(f.read(), dtype="<u8")
+    with open(os.path.join(spelling_dir, "gram_terms.bin"), "rb") as f:
+        term_ids = new_ids[np.frombuffer(f.read(), dtype="<u4")]
+    gram_terms = {
+        gram: term_ids[offsets[i] : offsets[i + 1]] for i, gram in enumerate(grams)
+    }
+
+    added_grams = {}
+    for j, term in enumerate(added):
+        for gram in trigrams(term):
+            added_grams.setdefault(gram, []).append(positions[j] + j)
+    for gram, ids in added_grams.items():
+        old = gram_terms.get(gram)
+        gram_terms[gram] = ids if old is None else np.sort(np.concatenate([old, ids]))
+
+    vocabulary = list(heapq.merge(vocabulary, added))
+    return write_spelling_files(generation_dir, vocabulary, gram_terms)
+
+
+def write_spelling_files(generation_dir, vocabulary, gram_terms):
+    # gram_terms: trigram -> ascending term ids
+    spelling_dir = os.path.join(generation_dir, SPELLING_DIR)
+    os.makedirs(spelling_dir, exist_ok=True)
+    grams = sorted(gram_terms, key=lambda gram: gram.encode("utf-8"))
+
+    write_string_table(
+        vocabulary,
+        os.path.join(spelling_dir, "vocab.bin"),
+        os.path.join(spelling_dir, "vocab.idx"),
+    )
+    write_string_table(
+        grams,
+        os.path.join(spelling_dir, "grams.bin"),
+        os.path.join(spelling_dir, "grams.idx"),
+    )
+    offsets = array("Q", [0])
+    with open(os.path.join(spelling_dir, "gram_terms.bin"), "wb") as f:
+        for gram in grams:
+            term_ids = gram_terms[gram]
+            f.write(np.asarray(term_ids, dtype="<u4").tobytes())
+            offsets.append(offsets[-1] + len(term_ids))
+    with open(os.path.join(spelling_dir, "gram_offsets.idx"), "wb") as f:
+        f.write(to_little_endian(offsets))
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "num_terms": len(vocabulary),
+        "num_grams": len(grams),
+    }
+    with open(os.path.join(spelling_dir, "header.json"), "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=4)
+    return header
@@ -0,0 +1,206 @@
+import os
+import heapq
+import shutil
+import struct
+import numpy as np
+from array import array
+from collections import Counter
+from sklearn.feature_extraction.text import CountVectorizer
+from binary_index import write_shards
+from index_format import from_little_endian, to_little_endian
+from tfidf_artifacts import ArtifactWriter
+
+# Out-of-core full build (indexer.py --spimi) for corpora whose text, vocabulary
+# or tf-idf matrix don't fit in memory, with the same weights as
+# TfidfVectorizer() (raw counts, smooth idf, l2-normalized documents):
+#
+#   1. Single-pass in-memory indexing (SPIMI): documents are tokenized like
+#      TfidfVectorizer and their term counts go into a block dictionary
+#      (term -> doc ids, counts). When the block reaches the memory budget it
+#      is written as a run sorted by term, and a new block starts.
+#   2. The runs are merged k-way into one file of final postings. Runs hold
+#      consecutive doc id ranges, so concatenating a term's postings in run
+#      order keeps them in doc id order. Every term's document frequency is
+#      known once it is merged, so the document norms are summed here.
+#   3. A second pass over the merged postings applies idf and the norms and
+#      streams every shard's postings into its segment, and a last one writes
+#      the tf-idf artifacts (tfidf_artifacts.py).
+#
+# Memory is bounded by the budget plus what is kept per document, whatever
+# the vocabulary size: the norms and the doc store offsets (a few bytes), the
+# filename and, unless indexer.py runs with --no-dedup, the near-duplicate
+# detector's MinHash signature (128 uint32s) and band keys of every canonical
+# document, about 3.5 KB in all.
+#
+#   run-NNNNNN.bin, merged.bin: per term, in utf-8 byte order: RUN_RECORD
+#   (term length, df), the term's utf-8 bytes, df uint32 doc ids, df uint32 counts
+
+RUNS_DIR = "spimi-runs"
+MEMORY_BUDGET = 256 * 1024 * 1024
+RUN_RECORD = struct.Struct("<II")
+
+# Estimated memory of the block dictionary, to decide when to flush it: a
+# term costs its dict slot, str and two arrays, a posting two uint32s
+TERM_BYTES = 250
+POSTING_BYTES = 8
+
+
+def write_run_record(f, term, doc_ids, counts):
+    data = term.encode("utf-8")
+    f.write(RUN_RECORD.pack(len(data), len(doc_ids)))
+    f.write(data)
+    f.write(to_little_endian(doc_ids))
+    f.write(to_little_endian(counts))
+
+
+def write_run(block, path):
+    # Python sorts strings by code point, which matches utf-8 byte order
+    with open(path, "wb") as f:
+        for term in sorted(block):
+            write_run_record(f, term, *block[term])
+
+
+def read_run(path):
+    # Yields (term, doc_ids, counts) in term order
+    with open(path, "rb", buffering=1 << 20) as f:
+        while True:
+            header = f.read(RUN_RECORD.size)
+            if not header:
+                return
+            length, df = RUN_RECORD.unpack(header)
+            term = f.read(length).decode("utf-8")
+            doc_ids = from_little_endian("I", f.read(4 * df))
+            counts = from_little_endian("I", f.read(4 * df))
+            yield term, doc_ids, counts
+
+
+def smooth_idf(df, num_docs):
+    # TfidfVectorizer(smooth_idf=True)
+    return np.log((1 + num_docs) / (1 + df)) + 1
+
+
+class SpimiIndexer:
+    def __init__(self, runs_dir, memory_budget=MEMORY_BUDGET):
+        self.runs_dir = runs_dir
+        self.memory_budget = memory_budget
+        self.analyze = CountVectorizer().build_analyzer()
+        self.num_docs = 0
+        self.runs = []
+        self.block = {}
+        self.block_bytes = 0
+        os.makedirs(runs_dir, exist_ok=True)
+
+    def add(self, text):
+        # Documents get doc ids in the order they are added
+        doc_id = self.num_docs
+        self.num_docs += 1
+        counts = Counter(self.analyze(text))
+        for term, count in counts.items():
+            postings = self.block.get(term)
+            if postings is None:
+                postings = self.block[term] = (array("I"), array("I"))
+                self.block_bytes += TERM_BYTES + len(term)
+            postings[0].append(doc_id)
+            postings[1].append(count)
+        self.block_bytes += POSTING_BYTES * len(counts)
+        if self.block_bytes >= self.memory_budget:
+            self.flush()
+
+    def flush(self):
+        if self.block:
+            path = os.path.join(self.runs_dir, f"run-{len(self.runs):06d}.bin")
+            write_run(self.block, path)
+            self.runs.append(path)
+            self.block = {}
+            self.block_bytes = 0
+
+    def merge(self, path):
+        # Merges the runs into path and deletes them. Returns the l2 norm of
+        # every document's tf-idf vector, the number of terms and of postings.
+        self.flush()
+        squared_norms = np.zeros(self.num_docs)
+        num_terms = num_postings = 0
+        merged = heapq.merge(*(read_run(run) for run in self.runs), key=lambda e: e[0])
+        with open(path, "wb") as f:
+            term, doc_ids, counts = None, array("I"), array("I")
+            for next_term, run_doc_ids, run_counts in merged:
+                if next_term != term:
+                    if term is not None:
+                        num_terms += 1
+                        num_postings += self._write_term(
+                            f, term, doc_ids, counts, squared_norms
+                        )
+                    term, doc_ids, counts = next_term, array("I"), array("I")
+                doc_ids.extend(run_doc_ids)
+                counts.extend(run_counts)
+            if term is not None:
+                num_terms += 1
+                num_postings += self._write_term(f, term, doc_ids, counts, squared_norms)
+        for run in self.runs:
+            os.remove(run)
+        self.runs = []
+        return np.sqrt(squared_norms), num_terms, num_postings
+
+    def _write_term(self, f, term, doc_ids, counts, squared_norms):
+        weights = np.asarray(counts, dtype=np.float64)
+        weights *= smooth_idf(len(doc_ids), self.num_docs)
+        squared_norms[np.asarray(doc_ids, dtype=np.int64)] += weights * weights
+        write_run_record(f, term, doc_ids, counts)
+        return len(doc_ids)
+
+    def weighted_postings(self, path, norms, shard=0, num_shards=1):
+        # Yields (term, doc_ids, weights) of one shard from the merged postings
+        for term, idf, doc_ids, counts in self._read_merged(path):
+            if num_shards > 1:
+                in_shard = doc_ids % num_shards == shard
+                doc_ids, counts = doc_ids[in_shard], counts[in_shard]
+                if not len(doc_ids):
+                    continue
+            yield term, doc_ids.tolist(), (counts * idf / norms[doc_ids]).tolist()
+
+    def write_artifacts(self, path, norms, num_terms, num_postings):
+        writer = ArtifactWriter(num_terms, self.num_docs, num_postings)
+        for term, idf, doc_ids, counts in self._read_merged(path):
+            writer.add(term, idf, doc_ids, counts * idf / norms[doc_ids])
+        writer.close()
+
+    def _read_merged(self, path):
+        for term, doc_ids, counts in read_run(path):
+            idf = smooth_idf(len(doc_ids), self.num_docs)
+            doc_ids = np.asarray(doc_ids, dtype=np.int64)
+            yield term, idf, doc_ids, np.asarray(counts, dtype=np.float64)
+
+
+def build_spimi_index(
+    documents,
+    filenames,
+    generation_dir,
+    num_shards=1,
+    memory_budget=MEMORY_BUDGET,
+    weights="float32",
+):
+    # documents: stream of texts in doc id order; filenames must be complete
+    # once it is consumed. Returns the number of postings.
+    runs_dir = os.path.join(generation_dir, RUNS_DIR)
+    indexer = SpimiIndexer(runs_dir, memory_budget)
+    for text in documents:
+        indexer.add(text)
+    indexer.flush()
+    num_runs = len(indexer.runs)
+
+    merged_path = os.path.join(runs_dir, "merged.bin")
+    norms, num_terms, num_postings = indexer.merge(merged_path)
+    write_shards(
+        lambda shard: indexer.weighted_postings(merged_path, norms, shard, num_shards),
+        filenames,
+        generation_dir,
+        weights,
+        num_shards,
+    )
+    indexer.write_artifacts(merged_path, norms, num_terms, num_postings)
+    shutil.rmtree(runs_dir)
+    print(
+        f"SPIMI: {indexer.num_docs} documents in {num_runs} runs, "
+        f"{num_postings} postings"
+    )
+    return num_postings
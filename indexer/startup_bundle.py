@@ -0,0 +1,59 @@
+import os
+import json
+from binary_index import FORMAT_VERSION, load_segments
+from spelling_index import SPELLING_DIR
+
+# startup.json: everything the processor needs before it can open a generation,
+# in one small file written next to segments.json when the generation is
+# published. The processor reads it instead of importing NLTK (which takes
+# over a second) and downloading the stopword list at startup:
+#
+#   version, num_shards, num_docs   the index header from segments.json
+#   vocabulary                      counts from spelling/header.json; the terms
+#                                   themselves stay in the memory-mapped
+#                                   spelling/vocab.bin
+#   stop_words                      the query stopword list (NLTK's English list)
+#
+# Written after the spelling index, so it also marks the generation complete.
+
+STARTUP_FILE = "startup.json"
+STOP_WORDS_LANGUAGE = "english"
+
+
+def load_stop_words(language=STOP_WORDS_LANGUAGE):
+    # NLTK is only needed here, at build time; the list is downloaded once
+    import nltk
+    from nltk.corpus import stopwords
+
+    try:
+        return stopwords.words(language)
+    except LookupError:
+        nltk.download("stopwords", quiet=True)
+        return stopwords.words(language)
+
+
+def write_startup_bundle(generation_dir, stop_words=None):
+    segments = load_segments(generation_dir)
+    with open(
+        os.path.join(generation_dir, SPELLING_DIR, "header.json"), "r", encoding="utf-8"
+    ) as f:
+        spelling = json.load(f)
+    if stop_words is None:
+        stop_words = load_stop_words()
+
+    bundle = {
+        "format_version": FORMAT_VERSION,
+        "generation": os.path.basename(os.path.normpath(generation_dir)),
+        "version": segments["version"],
+        "num_shards": segments["num_shards"],
+        "num_docs": sum(segment["num_docs"] for segment in segments["segments"])
+        - len(segments["deleted"]),
+        "vocabulary": {
+            "num_terms": spelling["num_terms"],
+            "num_grams": spelling["num_grams"],
+        },
+        "stop_words": sorted(set(stop_words)),
+    }
+    with open(os.path.join(generation_dir, STARTUP_FILE), "w", encoding="utf-8") as f:
+        json.dump(bundle, f, indent=4)
+    return bundle
@@ -0,0 +1,219 @@
+import os
+import json
+import mmap
+import shutil
+import numpy as np
+import scipy.sparse as sp
+from collections import Counter
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+from array import array
+from index_format import to_little_endian
+
+# The tf-idf model and matrix of the last full build, for the example query
+# and --batch-queries, as plain arrays instead of pickles. Nothing is
+# unpickled, and every array is memory-mapped when loaded, so opening them
+# costs almost nothing and their pages are shared by every process reading
+# them.
+#
+#   tfidf/header.json     format version, shape and the vectorizer settings
+#   tfidf/terms.bin       utf-8 terms in code point (= utf-8 byte) order, so a
+#   tfidf/terms.off       term's id is found by binary search; uint64 offsets
+#   tfidf/idf.npy         float64 idf of every term id
+#   tfidf/indptr.npy      term x document matrix in CSR form: the postings of
+#   tfidf/indices.npy     term t are indices[indptr[t]:indptr[t + 1]] (doc ids,
+#   tfidf/data.npy        ascending) with the weights data[indptr[t]:indptr[t + 1]]
+#
+# The matrix is stored term-major, so scoring a query only reads the rows of
+# its terms. Documents are l2-normalized, so query @ matrix is the cosine
+# similarity.
+
+ARTIFACTS_DIR = "tfidf"
+FORMAT_VERSION = 1
+
+# TfidfVectorizer() defaults; the SPIMI build always uses these
+DEFAULT_SETTINGS = {
+    "lowercase": True,
+    "token_pattern": r"(?u)\b\w\w+\b",
+    "norm": "l2",
+    "sublinear_tf": False,
+}
+
+
+class ArtifactWriter:
+    # Streams the matrix to disk one term at a time, in term order. Written to
+    # a temporary directory that replaces the previous artifacts on close.
+    def __init__(
+        self, num_terms, num_docs, nnz, settings=None, directory=ARTIFACTS_DIR
+    ):
+        self.directory = directory
+        self.tmp_dir = directory + ".tmp"
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        os.makedirs(self.tmp_dir)
+        self.header = {
+            "format_version": FORMAT_VERSION,
+            "num_terms": num_terms,
+            "num_docs": num_docs,
+            "nnz": nnz,
+            **(settings or DEFAULT_SETTINGS),
+        }
+        # scipy keeps index arrays of its own dtype, so both get the one it
+        # would pick and the loaded matrix wraps the maps without a copy
+        index_dtype = np.int32 if max(nnz, num_docs) < 2**31 else np.int64
+        self.idf = self._open("idf.npy", np.float64, num_terms)
+        self.indptr = self._open("indptr.npy", index_dtype, num_terms + 1)
+        self.indices = self._open("indices.npy", index_dtype, nnz)
+        self.data = self._open("data.npy", np.float64, nnz)
+        self.indptr[0] = 0
+        # terms.bin/terms.off as binary_index.write_string_table writes them
+        self.terms = open(os.path.join(self.tmp_dir, "terms.bin"), "wb")
+        self.term_offsets = array("Q", [0])
+        self.offset = 0
+
+    def _open(self, name, dtype, length):
+        path = os.path.join(self.tmp_dir, name)
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=(length,))
+
+    def add(self, term, idf, doc_ids, weights):
+        term_id = len(self.term_offsets) - 1
+        end = self.offset + len(doc_ids)
+        self.indices[self.offset : end] = doc_ids
+        self.data[self.offset : end] = weights
+        self.idf[term_id] = idf
+        self.indptr[term_id + 1] = end
+        data = term.encode("utf-8")
+        self.terms.write(data)
+        self.term_offsets.append(self.term_offsets[-1] + len(data))
+        self.offset = end
+
+    def close(self):
+        num_terms = len(self.term_offsets) - 1
+        if num_terms != self.header["num_terms"] or self.offset != len(self.data):
+            raise ValueError("tf-idf artifacts are incomplete")
+        for mapped in (self.idf, self.indptr, self.indices, self.data):
+            mapped.flush()
+        self.idf = self.indptr = self.indices = self.data = None
+        self.terms.close()
+        with open(os.path.join(self.tmp_dir, "terms.off"), "wb") as f:
+            f.write(to_little_endian(self.term_offsets))
+        with open(os.path.join(self.tmp_dir, "header.json"), "w") as f:
+            json.dump(self.header, f)
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.rename(self.tmp_dir, self.directory)
+
+
+def save_tfidf_artifacts(vectorizer, tfidf_matrix, directory=ARTIFACTS_DIR):
+    # From a fitted TfidfVectorizer and its (document x term) matrix
+    term_matrix = tfidf_matrix.T.tocsr()
+    term_matrix.sort_indices()
+    num_terms, num_docs = term_matrix.shape
+    settings = {key: getattr(vectorizer, key) for key in DEFAULT_SETTINGS}
+    writer = ArtifactWriter(num_terms, num_docs, term_matrix.nnz, settings, directory)
+    indptr = term_matrix.indptr
+    for term_id, term in enumerate(vectorizer.get_feature_names_out().tolist()):
+        start, end = indptr[term_id], indptr[term_id + 1]
+        writer.add(
+            term,
+            vectorizer.idf_[term_id],
+            term_matrix.indices[start:end],
+            term_matrix.data[start:end],
+        )
+    writer.close()
+
+
+class Vocabulary:
+    # Term -> term id by binary search over the memory-mapped sorted terms
+    def __init__(self, directory):
+        with open(os.path.join(directory, "terms.bin"), "rb") as f:
+            # mmap refuses empty files
+            empty = os.fstat(f.fileno()).st_size == 0
+            self.blob = (
+                b"" if empty else mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            )
+        self.offsets = np.memmap(
+            os.path.join(directory, "terms.off"), dtype="<u8", mode="r"
+        )
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def term(self, term_id):
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.blob[start:end].decode("utf-8")
+
+    def find(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            start, end = self.offsets[middle], self.offsets[middle + 1]
+            if self.blob[start:end] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self):
+            start, end = self.offsets[low], self.offsets[low + 1]
+            if self.blob[start:end] == key:
+                return low
+        return None
+
+
+class TfidfArtifacts:
+    # Stands in for the fitted TfidfVectorizer: transform() gives the same
+    # query vectors
+    def __init__(self, directory=ARTIFACTS_DIR):
+        path = os.path.join(directory, "header.json")
+        if not os.path.exists(path):
+            raise SystemExit("No tf-idf artifacts yet, run a full build first")
+        with open(path, "r") as f:
+            self.header = json.load(f)
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise SystemExit(
+                f"tf-idf artifacts have format {self.header['format_version']}, "
+                f"expected {FORMAT_VERSION}; run a full build"
+            )
+
+        def load(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+
+        self.idf = load("idf.npy")
+        self.term_matrix = sp.csr_matrix(
+            (load("data.npy"), load("indices.npy"), load("indptr.npy")),
+            shape=(self.header["num_terms"], self.header["num_docs"]),
+            copy=False,
+        )
+        self.vocabulary = Vocabulary(directory)
+        self.analyze = CountVectorizer(
+            lowercase=self.header["lowercase"],
+            token_pattern=self.header["token_pattern"],
+        ).build_analyzer()
+
+    @property
+    def num_docs(self):
+        return self.header["num_docs"]
+
+    def transform(self, queries):
+        # (query x term) matrix like TfidfVectorizer.transform: counts of the
+        # known terms, times idf, rows normalized
+        rows, cols, values = [], [], []
+        for row, query in enumerate(queries):
+            counts = Counter(self.analyze(query))
+            term_ids = {}
+            for term, count in counts.items():
+                term_id = self.vocabulary.find(term)
+                if term_id is not None:
+                    term_ids[term_id] = count
+            for term_id in sorted(term_ids):
+                rows.append(row)
+                cols.append(term_id)
+                values.append(term_ids[term_id])
+        tf = np.asarray(values, dtype=np.float64)
+        if self.header["sublinear_tf"]:
+            tf = np.log(tf) + 1
+        weights = tf * self.idf[np.asarray(cols, dtype=np.int64)]
+        matrix = sp.csr_matrix(
+            (weights, (rows, cols)), shape=(len(queries), len(self.vocabulary))
+        )
+        if self.header["norm"]:
+            matrix = normalize(matrix, norm=self.header["norm"], copy=False)
+        return matrix
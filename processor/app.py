@@ -1,50 +1,308 @@
-from flask import Flask, request, render_template_string, jsonify
-import json
-from fuzzywuzzy import process
+import time
 
-# Import NLTK for stop words removal
-import nltk
-from nltk.corpus import stopwords
+STARTED = time.perf_counter()
 
-# Download NLTK stopwords list if not already downloaded
-nltk.download("stopwords")
+from flask import Flask, request, render_template_string, jsonify
+from flask import g, has_request_context
+import os
+import threading
+from cache import LRUCache
+from index_manager import IndexManager
+from metrics import Registry, Trace, timed
+from scatter_gather import ScatterGather
+from startup import LoadProgress
 
 app = Flask(__name__)
 
-# Load the inverted index with explicit encoding
-with open("../indexer/inverted_index.json", "r", encoding="utf-8") as f:
-    inverted_index = json.load(f)
-
-# Load NLTK English stopwords
-stop_words = set(stopwords.words("english"))
-
-# Global variable to store the latest query results
-latest_results = []
-
-
-def get_top_k_results(query_terms, k=5):
-    # Calculate the aggregate tf-idf scores for documents and store document IDs
-    doc_scores = {}
-    doc_ids = {}
-    for term in query_terms:
-        if term in inverted_index:
-            for entry in inverted_index[term]:
-                doc = entry["filename"]
-                score = entry["tfidf"]
-                doc_id = entry["document_id"]
-                if doc in doc_scores:
-                    doc_scores[doc] += score
-                else:
-                    doc_scores[doc] = score
-                    doc_ids[doc] = doc_id  # Store document ID corresponding to filename
-
-    # Sort documents based on scores in descending order and select top-k
-    top_k_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)[:k]
+# Startup is timed step by step; /readyz reports it and it is printed once the
+# index is loaded. Nothing heavy is imported here: stopwords come from the
+# index's startup.json instead of NLTK, and fuzzywuzzy is imported on the
+# first spelling correction.
+startup = LoadProgress(started=STARTED)
+startup.add("imports", time.perf_counter() - STARTED)
+
+# Open the current generation of the index: the memory-mapped inverted index
+# (postings are read lazily per query term), the trigram index used to find
+# spelling correction candidates and the document texts for /json. New
+# generations published by the indexer are loaded in the background and swapped in.
+index_manager = IndexManager(
+    os.environ.get("INDEX_DIR", "../indexer/index"),
+    poll_interval=float(os.environ.get("INDEX_POLL_INTERVAL", 2)),
+)
+with startup.step("bundle"):
+    bundle = index_manager.startup_bundle()
+
+# A sharded index is ranked by one worker process per shard (up to one per
+# core), and the per-shard top-k lists are merged. SHARD_WORKERS=0 ranks
+# every query in this process instead.
+num_shards = bundle["num_shards"]
+default_workers = min(num_shards, os.cpu_count() or 1) if num_shards > 1 else 0
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", default_workers))
+
+# Under a preforking server (gunicorn.conf.py sets PROCESSOR_PREFORK=1) the
+# index is opened once, in the master, and every worker shares its mappings.
+# The shard pool and the hot reload thread don't survive a fork, so they are
+# started in each worker by after_fork() instead.
+PREFORK = os.environ.get("PROCESSOR_PREFORK", "0") == "1"
+scatter_gather = None
+
+
+def start_shard_workers():
+    global scatter_gather
+    with startup.step("shard_workers"):
+        scatter_gather = ScatterGather(workers=SHARD_WORKERS)
+        # Every worker maps the shards of a generation before it is served,
+        # so the generation can be garbage collected while it is still in use
+        index_manager.prepare = scatter_gather.open_generation
+        if index_manager.current is not None:
+            scatter_gather.open_generation(index_manager.current)
+
+
+def after_fork():
+    start_shard_workers()
+    index_manager.start()
+
+
+if not PREFORK:
+    start_shard_workers()
+
+
+def load_index():
+    index_manager.load(startup, bundle)
+    startup.finish()
+    if not PREFORK:
+        index_manager.start()
+    print(
+        f"Serving index generation {index_manager.current.name}, "
+        f"ready in {startup.summary()}"
+    )
+
+
+def load_index_in_background():
+    try:
+        load_index()
+    except (OSError, ValueError) as error:
+        # /livez stays up and /readyz reports the error
+        startup.fail(error)
+        print(f"Could not load the index: {error}")
+
+
+# With INDEX_LOAD_ASYNC=1 the server starts answering (/livez, /readyz, 503
+# for searches) while the generation is opened in a thread. A preforking
+# server loads it before forking, so there it is always loaded up front.
+if os.environ.get("INDEX_LOAD_ASYNC", "0") == "1" and not PREFORK:
+    threading.Thread(target=load_index_in_background, daemon=True).start()
+else:
+    load_index()
+
+# "daat" (document-at-a-time, MaxScore), "taat" (term-at-a-time) or "saat"
+# (score-at-a-time), see evaluator.py. saat stops early after scoring
+# SAAT_MAX_POSTINGS postings or after SAAT_MAX_MS milliseconds (0 = no limit).
+QUERY_STRATEGY = os.environ.get("QUERY_STRATEGY", "daat")
+QUERY_BUDGET = {
+    "max_postings": int(os.environ.get("SAAT_MAX_POSTINGS", 0)),
+    "max_seconds": float(os.environ.get("SAAT_MAX_MS", 0)) / 1000,
+}
+
+# Ranked results keyed on the corrected query terms and k, plus a smaller cache
+# for spelling corrections. Both are dropped when the index version changes.
+result_cache = LRUCache(
+    max_size=int(os.environ.get("RESULT_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("RESULT_CACHE_TTL", 600)),
+)
+correction_cache = LRUCache(
+    max_size=int(os.environ.get("CORRECTION_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("CORRECTION_CACHE_TTL", 600)),
+)
+
+# Metrics for /metrics. Every request is traced stage by stage; the stage
+# times go into one histogram labelled by stage. Requests sent with the
+# X-Search-Trace header get the breakdown back in a Server-Timing header and
+# are logged, and so is any request slower than SLOW_QUERY_SECONDS (0 = never).
+TRACE_HEADER = "X-Search-Trace"
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 1.0))
+
+metrics = Registry()
+stage_seconds = metrics.histogram(
+    "search_stage_seconds", "Time spent in each stage of answering searches", ["stage"]
+)
+request_seconds = metrics.histogram(
+    "search_request_seconds", "Time to answer a request", ["endpoint"]
+)
+queries_total = metrics.counter(
+    "search_queries_total", "Search queries answered", ["endpoint"]
+)
+corrected_terms_total = metrics.counter(
+    "search_corrected_terms_total", "Query terms changed by spelling correction"
+)
+stopwords_total = metrics.counter(
+    "search_stopwords_removed_total", "Query terms dropped as stopwords"
+)
+postings_total = metrics.counter(
+    "search_postings_scored_total",
+    "Postings of the query terms ranked (result cache misses only)",
+)
+for field in ("hits", "misses", "evictions"):
+    metrics.gauge(
+        f"search_cache_{field}_total",
+        f"Cache {field}",
+        lambda field=field: {
+            ("result",): result_cache.stats()[field],
+            ("correction",): correction_cache.stats()[field],
+        },
+        ["cache"],
+        type="counter",
+    )
+metrics.gauge(
+    "index_reloads_total",
+    "Index generations swapped in, and loads that failed",
+    lambda: {
+        ("ok",): index_manager.reloads,
+        ("failed",): index_manager.failed_reloads,
+    },
+    ["result"],
+    type="counter",
+)
+metrics.gauge(
+    "index_documents",
+    "Live documents in the current index generation",
+    lambda: (
+        {(): index_manager.current.index.num_docs} if index_manager.current else {}
+    ),
+)
+metrics.gauge(
+    "processor_startup_seconds",
+    "Time from the start of the processor's imports until it was ready",
+    lambda: {(): startup.finished} if startup.done else {},
+)
+
+
+def current_trace():
+    return g.get("trace") if has_request_context() else None
+
+
+def stage(name):
+    # with stage("scoring"): ... times the block into the histogram and the
+    # current request's trace
+    return timed(stage_seconds, name, current_trace())
+
+
+HEALTH_ENDPOINTS = ("livez", "readyz", "prometheus_metrics", "static")
+
+
+@app.before_request
+def start_trace():
+    g.trace = Trace()
+
+
+@app.before_request
+def require_index():
+    if index_manager.current is None and request.endpoint not in HEALTH_ENDPOINTS:
+        response = jsonify({"error": "The index is still loading."})
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+
+@app.after_request
+def finish_trace(response):
+    trace = g.get("trace")
+    if trace is None or request.endpoint in (None,) + HEALTH_ENDPOINTS:
+        return response
+    total = trace.elapsed()
+    request_seconds.observe(total, request.endpoint)
+    traced = TRACE_HEADER in request.headers
+    if traced:
+        response.headers["Server-Timing"] = trace.server_timing(total)
+    if traced or 0 < SLOW_QUERY_SECONDS <= total:
+        app.logger.warning(
+            f"{'Traced' if traced else 'Slow'} request to {request.endpoint} "
+            f"({total * 1000:.1f} ms) for {trace.queries!r}: "
+            f"{trace.server_timing(total)}"
+        )
+    return response
+
+
+def rank(generation, query_terms, k):
+    # Aggregate tf-idf scores per document, skipping documents that can no
+    # longer make the top-k, and return the best k
+    postings_total.inc(
+        sum(generation.index.doc_frequency(term) for term in set(query_terms))
+    )
+    top_k_docs = scatter_gather.top_k(
+        generation, query_terms, k=k, strategy=QUERY_STRATEGY, **QUERY_BUDGET
+    )
     return [
-        (doc, doc_ids[doc], score) for doc, score in top_k_docs
+        (generation.index.filename(doc_id), doc_id, score)
+        for doc_id, score in top_k_docs
     ]  # Return doc, doc_id, score
 
 
+def get_top_k_results(generation, query_terms, k=5):
+    # Scores don't depend on the order of the terms, so neither does the key
+    key = (tuple(sorted(query_terms)), k)
+    with stage("scoring"):
+        return result_cache.lookup(
+            key, lambda: rank(generation, query_terms, k), version=generation.version
+        )
+
+
+def correct_term(generation, term):
+    # Adjust the threshold according to your preference
+    return correction_cache.lookup(
+        term,
+        lambda: generation.spelling.correct(term, threshold=80),
+        version=generation.version,
+    )
+
+
+def get_query_terms(generation, query):
+    # Correct misspelled terms and drop stopwords
+    trace = current_trace()
+    if trace is not None:
+        trace.queries.append(query)
+    terms = query.split()
+    with stage("correction"):
+        corrected_terms = [correct_term(generation, term) for term in terms]
+    corrected_terms_total.inc(sum(a != b for a, b in zip(terms, corrected_terms)))
+    with stage("stopwords"):
+        query_terms = [
+            w for w in corrected_terms if w.lower() not in generation.stop_words
+        ]
+    stopwords_total.inc(len(corrected_terms) - len(query_terms))
+    return query_terms
+
+
+def search(generation, query, k=5, offset=0):
+    # Stateless search: safe to call from any number of threads at once. The
+    # caller takes index_manager.current once per request and passes it to
+    # every step, so a reload in the middle of a request can't mix generations.
+    query_terms = get_query_terms(generation, query)
+    ranked = get_top_k_results(generation, query_terms, k=offset + k)
+    return query_terms, ranked[offset : offset + k]
+
+
+def format_results(generation, ranked, offset=0, include_content=True):
+    with stage("content" if include_content else "format"):
+        return _format_results(generation, ranked, offset, include_content)
+
+
+def _format_results(generation, ranked, offset, include_content):
+    results = []
+    for rank, (doc, doc_id, score) in enumerate(ranked, start=offset + 1):
+        result = {
+            "rank": rank,
+            "document_id": doc_id,
+            "document_name": doc,
+            "tfidf_score": score,
+        }
+        if doc in generation.aliases:
+            result["aliases"] = generation.aliases[doc]
+        if include_content:
+            result["content"] = generation.doc_store.get(doc_id, "No content available")
+        results.append(result)
+    return results
+
+
 @app.route("/", methods=["GET", "POST"])
 def home():
     if request.method == "POST":
@@ -56,49 +314,172 @@ def home():
                 FORM_TEMPLATE, error="Please enter a search query."
             )
 
-        # Correct misspelled terms
-        corrected_terms = []
-        for term in query.split():
-            corrected_term, score = process.extractOne(term, inverted_index.keys())
-            if score >= 80:  # Adjust this threshold according to your preference
-                corrected_terms.append(corrected_term)
-            else:
-                corrected_terms.append(term)
-        query_terms = [
-            word for word in corrected_terms if word.lower() not in stop_words
-        ]
-
-        global latest_results
-        latest_results = get_top_k_results(query_terms, k=5)
+        queries_total.inc(1, "home")
+        generation = index_manager.current
+        ranked = get_top_k_results(generation, get_query_terms(generation, query), k=5)
         results = [
             {"document_id": doc_id, "document": doc, "score": score}
-            for doc, doc_id, score in latest_results
+            for doc, doc_id, score in ranked
         ]
-        return render_template_string(RESULTS_TEMPLATE, query=query, results=results)
+        with stage("render"):
+            return render_template_string(
+                RESULTS_TEMPLATE, query=query, results=results
+            )
     return render_template_string(FORM_TEMPLATE)
 
 
 @app.route("/json", methods=["GET"])
 def json_results():
-    # Load content data from JSON file
-    with open("../indexer/content.json", "r", encoding="utf-8") as file:
-        content_data = json.load(file)
-
-    # Prepare and return the latest results in JSON format, including the content
+    # The results page links here with its query. Nothing is kept between
+    # requests, so a request without a query has no results to show.
+    query = request.args.get("query", "").strip()
+    if not query:
+        raise BadRequest("Please enter a search query.")
+    queries_total.inc(1, "json_results")
+    generation = index_manager.current
+    ranked = search(generation, query)[1]
+
+    # Prepare and return the results in JSON format, including the content
     results = []
-    for doc, doc_id, score in latest_results:
-        doc_content = content_data.get(str(doc_id), {}).get(
-            "content", "No content available"
-        )
-        results.append(
-            {
-                "content": doc_content,
-                "document_id": doc_id,
-                "document_name": doc,
-                "tfidf_score": score,
-            }
-        )
-    return jsonify(results)
+    with stage("content"):
+        for doc, doc_id, score in ranked:
+            doc_content = generation.doc_store.get(doc_id, "No content available")
+            results.append(
+                {
+                    "content": doc_content,
+                    "document_id": doc_id,
+                    "document_name": doc,
+                    "tfidf_score": score,
+                }
+            )
+    with stage("serialize"):
+        return jsonify(results)
+
+
+# JSON search API
+
+MAX_K = 100
+MAX_OFFSET = 1000  # k + offset documents are ranked for a page
+MAX_BATCH_SIZE = 100
+
+
+class BadRequest(ValueError):
+    pass
+
+
+def parse_search_params(params, defaults=None):
+    # params: query string args or one JSON object; returns (query, k, offset, content)
+    params = {**(defaults or {}), **params}
+    query = params.get("query", params.get("q", ""))
+    if not isinstance(query, str) or not query.strip():
+        raise BadRequest("Please enter a search query.")
+    try:
+        k = int(params.get("k", 5))
+        offset = int(params.get("offset", 0))
+    except (TypeError, ValueError):
+        raise BadRequest("k and offset must be integers.")
+    if not 1 <= k <= MAX_K:
+        raise BadRequest(f"k must be between 1 and {MAX_K}.")
+    if not 0 <= offset <= MAX_OFFSET:
+        raise BadRequest(f"offset must be between 0 and {MAX_OFFSET}.")
+    content = params.get("content", False)
+    if isinstance(content, str):
+        content = content.lower() in ("1", "true", "yes")
+    return query.strip(), k, offset, bool(content)
+
+
+def run_search(generation, query, k, offset, content):
+    query_terms, ranked = search(generation, query, k=k, offset=offset)
+    return {
+        "query": query,
+        "terms": query_terms,
+        "k": k,
+        "offset": offset,
+        "results": format_results(
+            generation, ranked, offset=offset, include_content=content
+        ),
+    }
+
+
+@app.errorhandler(BadRequest)
+def bad_request(error):
+    return jsonify({"error": str(error)}), 400
+
+
+@app.route("/api/search", methods=["GET", "POST"])
+def api_search():
+    # GET /api/search?query=...&k=5&offset=0&content=true, or the same fields as a JSON body
+    if request.method == "POST":
+        params = request.get_json(silent=True)
+        if not isinstance(params, dict):
+            raise BadRequest("Expected a JSON object.")
+    else:
+        params = request.args.to_dict()
+    queries_total.inc(1, "api_search")
+    result = run_search(index_manager.current, *parse_search_params(params))
+    with stage("serialize"):
+        return jsonify(result)
+
+
+def parse_batch(body):
+    # {"queries": ["...", {"query": "...", "k": 10}], "k": 5, "offset": 0, "content": false}
+    # k, offset and content at the top level are defaults for every query
+    if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+        raise BadRequest('Expected a JSON object with a "queries" list.')
+    queries = body["queries"]
+    if len(queries) > MAX_BATCH_SIZE:
+        raise BadRequest(f"At most {MAX_BATCH_SIZE} queries per batch.")
+
+    defaults = {key: body[key] for key in ("k", "offset", "content") if key in body}
+    parsed = []
+    for item in queries:
+        params = item if isinstance(item, dict) else {"query": item}
+        parsed.append(parse_search_params(params, defaults))
+    return parsed
+
+
+@app.route("/api/search/batch", methods=["POST"])
+def api_search_batch():
+    parsed = parse_batch(request.get_json(silent=True))
+    # Every query of the batch is answered from the same generation
+    queries_total.inc(len(parsed), "api_search_batch")
+    generation = index_manager.current
+    results = [run_search(generation, *params) for params in parsed]
+    with stage("serialize"):
+        return jsonify({"results": results})
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return metrics.render(), 200, {"Content-Type": "text/plain; version=0.0.4"}
+
+
+# Health checks: /livez answers as soon as the server runs, /readyz only once
+# the index is loaded (503 until then, with the load progress)
+
+
+@app.route("/livez", methods=["GET"])
+def livez():
+    return jsonify({"status": "alive"})
+
+
+def readiness():
+    # Returns (body, status code)
+    current = index_manager.current
+    reloading = index_manager.loading if current is not None else None
+    body = {
+        "status": "ready" if current else ("failed" if startup.error else "loading"),
+        "generation": current.name if current else None,
+        "startup": startup.as_dict(),
+        "reload": reloading.as_dict() if reloading else None,
+    }
+    return body, 200 if current else 503
+
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    body, status = readiness()
+    return jsonify(body), status
 
 
 FORM_TEMPLATE = """
@@ -161,7 +542,7 @@ RESULTS_TEMPLATE = """
     {% else %}
         <p>No results found</p>
     {% endif %}
-    <a href="/">New search</a> | <a href="/json">JSON</a>
+    <a href="/">New search</a> | <a href="/json?query={{ query | urlencode }}">JSON</a>
     <h4>Note: Click on json link to view the json output which contains "document_id", "url" and most importantly "Content". so it is easy to review.</h4>
 </body>
 </html>
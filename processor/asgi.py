@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+# Loads the index as app.py does; the search path is shared, Flask is not used
+from app import (
+    BadRequest,
+    index_manager,
+    metrics,
+    parse_batch,
+    parse_search_params,
+    queries_total,
+    readiness,
+    request_seconds,
+    run_search,
+    scatter_gather,
+)
+
+# Asyncio variant of the JSON search API (/api/search and /api/search/batch,
+# same parameters and responses as app.py) as a plain ASGI application:
+#
+#   $ pip install uvicorn
+#   $ uvicorn asgi:app --port 5000
+#
+# The event loop only parses requests and writes responses. Searches run in a
+# bounded thread pool, and identical searches that arrive while one is being
+# computed (a trending query in a burst) wait for that computation instead of
+# repeating it. When the pool's queue is full, new searches are turned away
+# with a 503 right away instead of queueing without bound. A batch is checked
+# as a whole: its new searches either all fit or the batch gets the 503, and
+# a batch larger than the queue runs when nothing else is queued.
+#
+#   SEARCH_THREADS    threads computing searches (default 4)
+#   SEARCH_QUEUE      searches running or waiting before new ones get a 503 (default 64)
+#   SEARCH_COALESCE   0 turns coalescing off
+
+SEARCH_THREADS = int(os.environ.get("SEARCH_THREADS", 4))
+SEARCH_QUEUE = int(os.environ.get("SEARCH_QUEUE", 64))
+SEARCH_COALESCE = os.environ.get("SEARCH_COALESCE", "1") == "1"
+
+coalesced_total = metrics.counter(
+    "search_coalesced_total", "Searches answered by an identical search in flight"
+)
+rejected_total = metrics.counter(
+    "search_rejected_total", "Searches turned away because the queue was full"
+)
+
+
+class Overloaded(Exception):
+    pass
+
+
+class CoalescingSearcher:
+    # Only used from the event loop's thread, so it needs no lock
+    def __init__(self, threads, max_pending, coalesce=True):
+        self.executor = ThreadPoolExecutor(
+            max_workers=threads, thread_name_prefix="search"
+        )
+        self.max_pending = max_pending
+        self.coalesce = coalesce
+        self.pending = 0  # computations running or queued
+        self._in_flight = {}  # key -> future of its computation
+
+    def _finished(self, key, future):
+        self.pending -= 1
+        if self._in_flight.get(key) is future:
+            del self._in_flight[key]
+
+    def _submit(self, generation, key):
+        _, normalized, k, offset, content = key
+        future = asyncio.get_running_loop().run_in_executor(
+            self.executor, run_search, generation, normalized, k, offset, content
+        )
+        self.pending += 1
+        future.add_done_callback(lambda done: self._finished(key, done))
+        if self.coalesce:
+            self._in_flight[key] = future
+        return future
+
+    async def search(self, generation, query, k, offset, content):
+        results = await self.search_many(generation, [(query, k, offset, content)])
+        return results[0]
+
+    async def search_many(self, generation, searches):
+        # searches: [(query, k, offset, content), ...]. A batch is admitted or
+        # turned away as a whole before any of it is submitted, so a rejected
+        # batch leaves no computations behind whose results nobody reads.
+        # The results only depend on the whitespace-separated terms, so
+        # queries differing in spacing share a computation.
+        keys = []
+        for query, k, offset, content in searches:
+            normalized = " ".join(query.split())
+            keys.append((generation.version, normalized, k, offset, content))
+        new = [key for key in keys if key not in self._in_flight]
+        if self.coalesce:
+            new = set(new)
+        # A batch larger than the queue is admitted when the queue is empty
+        if new and self.pending + min(len(new), self.max_pending) > self.max_pending:
+            rejected_total.inc(len(searches))
+            raise Overloaded()
+
+        futures = []
+        for key in keys:
+            future = self._in_flight.get(key)
+            if future is not None:
+                coalesced_total.inc()
+            else:
+                future = self._submit(generation, key)
+            futures.append(future)
+        # A client that disconnects must not cancel the others' computation
+        results = await asyncio.gather(*(asyncio.shield(f) for f in futures))
+        return [
+            dict(result, query=query) for result, (query, *_) in zip(results, searches)
+        ]
+
+    def close(self):
+        self.executor.shutdown()
+
+
+searcher = CoalescingSearcher(SEARCH_THREADS, SEARCH_QUEUE, SEARCH_COALESCE)
+metrics.gauge(
+    "search_pending",
+    "Searches running or queued in the async server",
+    lambda: {(): searcher.pending},
+)
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def respond(send, status, body, content_type="application/json", headers=()):
+    if content_type == "application/json":
+        body = json.dumps(body)
+    data = body.encode("utf-8")
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", content_type.encode("latin-1")),
+                (b"content-length", str(len(data)).encode("latin-1")),
+            ]
+            + list(headers),
+        }
+    )
+    await send({"type": "http.response.body", "body": data})
+
+
+def json_body(body):
+    try:
+        return json.loads(body) if body else None
+    except ValueError:
+        return None
+
+
+async def api_search(method, query_string, body):
+    if method == "POST":
+        params = json_body(body)
+        if not isinstance(params, dict):
+            raise BadRequest("Expected a JSON object.")
+    else:
+        params = dict(parse_qsl(query_string))
+    params = parse_search_params(params)
+    queries_total.inc(1, "asgi_search")
+    return await searcher.search(index_manager.current, *params)
+
+
+async def api_search_batch(method, query_string, body):
+    parsed = parse_batch(json_body(body))
+    queries_total.inc(len(parsed), "asgi_search_batch")
+    # Every query of the batch is answered from the same generation
+    generation = index_manager.current
+    return {"results": await searcher.search_many(generation, parsed)}
+
+
+SEARCH_ROUTES = {
+    "/api/search": (("GET", "POST"), api_search),
+    "/api/search/batch": (("POST",), api_search_batch),
+}
+
+
+async def http(scope, receive, send):
+    path, method = scope["path"], scope["method"]
+    if path == "/livez":
+        return await respond(send, 200, {"status": "alive"})
+    if path == "/readyz":
+        body, status = readiness()
+        return await respond(send, status, body)
+    if path == "/metrics":
+        return await respond(send, 200, metrics.render(), "text/plain; version=0.0.4")
+    if path not in SEARCH_ROUTES:
+        return await respond(send, 404, {"error": "Not found."})
+    methods, handler = SEARCH_ROUTES[path]
+    if method not in methods:
+        return await respond(send, 405, {"error": "Method not allowed."})
+    if index_manager.current is None:
+        return await respond(
+            send,
+            503,
+            {"error": "The index is still loading."},
+            headers=[(b"retry-after", b"1")],
+        )
+
+    started = time.perf_counter()
+    body = await read_body(receive)
+    try:
+        result = await handler(method, scope["query_string"].decode("latin-1"), body)
+    except BadRequest as error:
+        return await respond(send, 400, {"error": str(error)})
+    except Overloaded:
+        return await respond(
+            send,
+            503,
+            {"error": "Too many searches in progress, try again."},
+            headers=[(b"retry-after", b"1")],
+        )
+    await respond(send, 200, result)
+    request_seconds.observe(time.perf_counter() - started, handler.__name__)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            searcher.close()
+            scatter_gather.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await lifespan(receive, send)
+    elif scope["type"] == "http":
+        await http(scope, receive, send)
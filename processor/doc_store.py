@@ -0,0 +1,48 @@
+import os
+import json
+import zlib
+from cache import LRUCache
+from index_reader import map_file
+from index_format import DOCSTORE_RECORD
+
+# Reader for the document stores written by indexer/doc_store.py, one per
+# shard. Only the blocks holding the requested documents are read and
+# decompressed, and the most recently decoded blocks are kept in a small cache.
+
+
+class DocStore:
+    def __init__(self, generation_dir, num_shards=1, cache_blocks=32):
+        self.num_shards = num_shards
+        self.compression = []
+        self._data = []
+        self._records = []
+        for shard in range(num_shards):
+            path = os.path.join(generation_dir, f"docstore-{shard}")
+            with open(path + ".json", "r", encoding="utf-8") as f:
+                settings = json.load(f)
+            self.compression.append(settings["compression"])
+            self._data.append(map_file(path + ".bin"))
+            self._records.append(map_file(path + ".idx"))
+        self.blocks = LRUCache(max_size=cache_blocks)
+
+    def __len__(self):
+        return sum(len(records) for records in self._records) // DOCSTORE_RECORD.size
+
+    def _block(self, shard, offset, length):
+        data = self._data[shard]
+        if self.compression[shard] == "none":
+            return data[offset : offset + length]
+        return self.blocks.lookup(
+            (shard, offset), lambda: zlib.decompress(data[offset : offset + length])
+        )
+
+    def get(self, doc_id, default=None):
+        if not 0 <= doc_id < len(self):
+            return default
+        # Documents are dealt to the shards round-robin by doc id
+        shard, position = doc_id % self.num_shards, doc_id // self.num_shards
+        offset, block_length, start, length = DOCSTORE_RECORD.unpack_from(
+            self._records[shard], position * DOCSTORE_RECORD.size
+        )
+        block = self._block(shard, offset, block_length)
+        return block[start : start + length].decode("utf-8")
@@ -0,0 +1,197 @@
+import time
+import heapq
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate
+from operator import itemgetter
+
+# Top-k query evaluation with a bounded heap. Every term's maximum weight is
+# stored in the lexicon, which gives an upper bound on what a document can
+# still gain from the terms not scored yet; documents that can no longer reach
+# the current k-th best score are skipped.
+#
+#   daat  document-at-a-time with MaxScore: the terms with the smallest bounds
+#         are only probed (by binary search) for documents found in the others
+#   taat  term-at-a-time, highest bound first: once the remaining terms cannot
+#         lift a new document into the top k, no new accumulators are created
+#   saat  score-at-a-time: the impact blocks of all query terms (postings
+#         grouped by weight, see index_reader.py) are scored highest
+#         contribution first. It is exact when it runs to the end; with a
+#         budget of postings or seconds it stops early and ranks what it has
+#         scored so far ("anytime ranking"), so the most common terms cost no
+#         more than the budget. What is left out is always the lowest weights.
+#         Fastest on an index built with weights="impact", whose blocks are
+#         stored in that order and decoded only when reached.
+
+STRATEGIES = ("daat", "taat", "saat")
+END = float("inf")
+
+_doc_id = itemgetter(0)
+
+
+class Cursor:
+    def __init__(self, postings, multiplier, max_weight):
+        self.postings = postings
+        self.multiplier = multiplier
+        self.max_score = max_weight * multiplier
+        self.position = 0
+
+    @property
+    def doc_id(self):
+        if self.position < len(self.postings):
+            return self.postings[self.position][0]
+        return END
+
+    def score(self):
+        return self.postings[self.position][1] * self.multiplier
+
+    def next(self):
+        self.position += 1
+
+    def seek(self, doc_id):
+        # Advance to the first posting with a doc id >= doc_id
+        self.position = bisect_left(
+            self.postings, doc_id, lo=self.position, key=_doc_id
+        )
+
+
+class TopK:
+    # Min-heap of the best k (score, -doc_id) pairs; ties go to the lower doc id
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    @property
+    def threshold(self):
+        return self.heap[0][0] if len(self.heap) >= self.k else 0.0
+
+    def push(self, doc_id, score):
+        entry = (score, -doc_id)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry > self.heap[0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def results(self):
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(self.heap, reverse=True)]
+
+
+def open_cursors(index, query_terms):
+    # A term repeated in the query counts once per occurrence, as before
+    cursors = []
+    for term, count in Counter(query_terms).items():
+        postings = index.postings(term)
+        if postings:
+            cursors.append(Cursor(postings, count, index.max_weight(term)))
+    return cursors
+
+
+def top_k_daat(cursors, k):
+    cursors.sort(key=lambda cursor: cursor.max_score)
+    # bounds[i]: the most a document can get from cursors[0..i]
+    bounds = list(accumulate(cursor.max_score for cursor in cursors))
+    top = TopK(k)
+    first_essential = 0
+    while first_essential < len(cursors):
+        essential = cursors[first_essential:]
+        doc_id = min(cursor.doc_id for cursor in essential)
+        if doc_id == END:
+            break
+
+        score = 0.0
+        for cursor in essential:
+            if cursor.doc_id == doc_id:
+                score += cursor.score()
+                cursor.next()
+        for i in range(first_essential - 1, -1, -1):
+            if score + bounds[i] <= top.threshold:
+                break
+            cursor = cursors[i]
+            cursor.seek(doc_id)
+            if cursor.doc_id == doc_id:
+                score += cursor.score()
+        top.push(doc_id, score)
+
+        # Documents found only in non-essential terms can't beat the threshold
+        while (
+            first_essential < len(cursors)
+            and bounds[first_essential] <= top.threshold
+        ):
+            first_essential += 1
+    return top.results()
+
+
+def top_k_taat(cursors, k):
+    cursors.sort(key=lambda cursor: cursor.max_score, reverse=True)
+    remaining = sum(cursor.max_score for cursor in cursors)
+    accumulators = {}
+    for cursor in cursors:
+        threshold = 0.0
+        if len(accumulators) >= k:
+            threshold = heapq.nlargest(k, accumulators.values())[-1]
+
+        if remaining < threshold:
+            # Only documents already accumulated can still make the top k
+            if len(accumulators) < len(cursor.postings):
+                for doc_id in sorted(accumulators):
+                    cursor.seek(doc_id)
+                    if cursor.doc_id == doc_id:
+                        accumulators[doc_id] += cursor.score()
+            else:
+                for doc_id, weight in cursor.postings:
+                    if doc_id in accumulators:
+                        accumulators[doc_id] += weight * cursor.multiplier
+        else:
+            for doc_id, weight in cursor.postings:
+                accumulators[doc_id] = (
+                    accumulators.get(doc_id, 0.0) + weight * cursor.multiplier
+                )
+        remaining -= cursor.max_score
+
+    top = TopK(k)
+    for doc_id, score in accumulators.items():
+        top.push(doc_id, score)
+    return top.results()
+
+
+def scaled_blocks(blocks, multiplier):
+    for weight, doc_ids in blocks:
+        yield weight * multiplier, doc_ids
+
+
+def top_k_saat(index, query_terms, k, max_postings=0, max_seconds=0):
+    # A budget of 0 means no limit
+    deadline = time.perf_counter() + max_seconds if max_seconds else None
+    budget = max_postings or END
+    streams = [
+        scaled_blocks(index.impact_blocks(term), count)
+        for term, count in Counter(query_terms).items()
+    ]
+    accumulators = {}
+    for contribution, doc_ids in heapq.merge(*streams, key=lambda block: -block[0]):
+        if len(doc_ids) > budget:
+            doc_ids = doc_ids[:budget]
+        for doc_id in doc_ids:
+            accumulators[doc_id] = accumulators.get(doc_id, 0.0) + contribution
+        budget -= len(doc_ids)
+        if budget <= 0 or (deadline is not None and time.perf_counter() >= deadline):
+            break
+
+    top = TopK(k)
+    for doc_id, score in accumulators.items():
+        top.push(doc_id, score)
+    return top.results()
+
+
+def top_k(index, query_terms, k=5, strategy="daat", max_postings=0, max_seconds=0):
+    # Returns [(doc_id, score), ...] best first. The budgets only apply to saat.
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown query strategy: {strategy}")
+    if k <= 0:
+        return []
+    if strategy == "saat":
+        return top_k_saat(index, query_terms, k, max_postings, max_seconds)
+    cursors = open_cursors(index, query_terms)
+    if strategy == "daat":
+        return top_k_daat(cursors, k)
+    return top_k_taat(cursors, k)
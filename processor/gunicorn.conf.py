@@ -0,0 +1,43 @@
+import gc
+import os
+
+# Production serving: several gunicorn workers sharing one copy of the index.
+#
+#   $ cd processor
+#   $ gunicorn -c gunicorn.conf.py
+#
+# The app is imported once in the master (preload_app), which opens the
+# current generation before forking. The index, spelling index and document
+# store are read-only memory maps, so the workers share their pages instead of
+# loading a copy each. Memory grows by a worker's private heap (caches, request
+# state), not by the index size. Settings come from the environment:
+#
+#   WEB_CONCURRENCY   worker processes (default: one per core)
+#   WEB_THREADS       threads per worker (default 4); the search path is thread-safe
+#   BIND              address to listen on (default 127.0.0.1:5000)
+
+os.environ["PROCESSOR_PREFORK"] = "1"
+# The workers already spread queries over the cores, so by default they rank
+# every shard in-process instead of each starting a pool of shard workers
+os.environ.setdefault("SHARD_WORKERS", "0")
+
+wsgi_app = "app:app"
+preload_app = True
+workers = int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+bind = os.environ.get("BIND", "127.0.0.1:5000")
+timeout = 30
+
+
+def pre_fork(server, worker):
+    # Move everything the master has allocated into the permanent generation:
+    # the workers' garbage collections then never walk (and write to) the
+    # objects they inherited, which would copy their pages
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import app
+
+    app.after_fork()
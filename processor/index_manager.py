@@ -0,0 +1,171 @@
+import os
+import json
+import time
+import threading
+from doc_store import DocStore
+from index_reader import FORMAT_VERSION, SegmentedIndex
+from spelling import SpellingIndex
+from startup import LoadProgress
+
+# Hot reload of the index. The indexer publishes every build by replacing
+# index/CURRENT with the name of a new generation directory (see
+# indexer/generations.py). A background thread polls CURRENT, opens the new
+# generation while the old one keeps serving, and swaps it in with a single
+# assignment. A request takes the current generation once and uses it until it
+# is done, so requests in flight during a swap finish on the generation they
+# started with; the old generation's files are unmapped when the last of them
+# lets go of it.
+
+CURRENT_FILE = "CURRENT"
+ALIASES_FILE = "aliases.json"
+STARTUP_FILE = "startup.json"
+
+
+def current_generation_name(index_dir):
+    with open(os.path.join(index_dir, CURRENT_FILE), "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def load_aliases(generation_dir):
+    # canonical filename -> near-duplicate filenames collapsed into it
+    path = os.path.join(generation_dir, ALIASES_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def nltk_stop_words():
+    # Only for generations written before startup.json existed. Never
+    # downloads: the list has to be installed already.
+    from nltk.corpus import stopwords
+
+    try:
+        return stopwords.words("english")
+    except LookupError:
+        raise ValueError(
+            "No startup.json in the index and NLTK's stopword list is not "
+            "installed; rebuild the index or run: python -m nltk.downloader stopwords"
+        )
+
+
+def load_startup_bundle(generation_dir):
+    # The generation's header and stopword list (see indexer/startup_bundle.py)
+    path = os.path.join(generation_dir, STARTUP_FILE)
+    if not os.path.exists(path):
+        with open(
+            os.path.join(generation_dir, "segments.json"), "r", encoding="utf-8"
+        ) as f:
+            segments = json.load(f)
+        return {
+            "format_version": segments["format_version"],
+            "version": segments["version"],
+            "num_shards": segments["num_shards"],
+            "stop_words": nltk_stop_words(),
+        }
+    with open(path, "r", encoding="utf-8") as f:
+        bundle = json.load(f)
+    if bundle["format_version"] != FORMAT_VERSION:
+        raise ValueError(
+            f"Unsupported index format {bundle['format_version']} in {generation_dir}"
+        )
+    return bundle
+
+
+class IndexGeneration:
+    # Everything a request reads from one generation. Each step is timed with
+    # progress.step(name) if a LoadProgress is given.
+    def __init__(self, index_dir, name, progress=None, bundle=None):
+        progress = progress or LoadProgress()
+        generation_dir = os.path.join(index_dir, name)
+        self.name = name
+        self.path = generation_dir
+        if bundle is None:
+            with progress.step("bundle"):
+                bundle = load_startup_bundle(generation_dir)
+        self.stop_words = frozenset(bundle["stop_words"])
+        with progress.step("index"):
+            self.index = SegmentedIndex(generation_dir)
+        if self.index.version != bundle["version"]:
+            raise ValueError(f"startup.json does not match the index in {name}")
+        with progress.step("spelling"):
+            self.spelling = SpellingIndex(os.path.join(generation_dir, "spelling"))
+        with progress.step("doc_store"):
+            self.doc_store = DocStore(generation_dir, self.index.num_shards)
+        with progress.step("aliases"):
+            self.aliases = load_aliases(generation_dir)
+        self.version = self.index.version
+        self.loaded_at = time.time()
+
+
+class IndexManager:
+    # Nothing is opened until load(): the server can answer health checks
+    # while the first generation is loading
+    def __init__(self, index_dir, poll_interval=2.0):
+        self.index_dir = index_dir
+        self.poll_interval = poll_interval
+        self.current = None
+        self.loading = None  # LoadProgress of the load under way
+        self.reloads = 0
+        self.failed_reloads = 0
+        # Called with each generation after it is opened and before it becomes
+        # current, e.g. to open it in the shard workers too
+        self.prepare = None
+        self._lock = threading.Lock()  # one load at a time; readers never take it
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def startup_bundle(self):
+        # Read ahead of load() by the server, e.g. to size the shard pool
+        return load_startup_bundle(
+            os.path.join(self.index_dir, current_generation_name(self.index_dir))
+        )
+
+    def load(self, progress=None, bundle=None):
+        # Opens the current generation; returns True if it was not open yet
+        with self._lock:
+            name = current_generation_name(self.index_dir)
+            if self.current is not None and name == self.current.name:
+                return False
+            if bundle is not None and bundle.get("generation") != name:
+                bundle = None  # read ahead for a generation replaced since
+            self.loading = progress or LoadProgress()
+            self.loading.generation = name
+            try:
+                generation = IndexGeneration(
+                    self.index_dir, name, self.loading, bundle
+                )
+                if self.prepare is not None:
+                    self.prepare(generation)
+            finally:
+                self.loading = None
+            if self.current is not None:
+                self.reloads += 1
+            self.current = generation
+            return True
+
+    def reload(self):
+        # Returns True if a new generation was swapped in
+        return self.load()
+
+    def _watch(self):
+        while not self._stopped.wait(self.poll_interval):
+            try:
+                if self.reload():
+                    print(f"Switched to index generation {self.current.name}")
+            except (OSError, ValueError) as error:
+                # Keep serving the old generation and try again on the next poll
+                self.failed_reloads += 1
+                print(f"Could not load the new index generation: {error}")
+
+    def start(self):
+        # A poll interval of 0 turns hot reload off
+        if self._thread is None and self.poll_interval > 0:
+            self._thread = threading.Thread(target=self._watch, daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,247 @@
+import os
+import sys
+import json
+import mmap
+import heapq
+import struct
+from itertools import groupby
+
+# The on-disk format is defined once, in the indexer's index_format.py.
+# Appended, so the processor's own modules (doc_store) still come first.
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer")
+)
+from index_format import (
+    FORMAT_VERSION,
+    LEXICON_RECORD,
+    SEGMENTS_DIR,
+    SEGMENTS_FILE,
+    decode_impact_blocks,
+    decode_postings,
+)
+
+# Reader for the compact index written by indexer/binary_index.py.
+# Files are memory-mapped and postings are decoded only when a term is queried,
+# so opening an index costs the same no matter how large the corpus is.
+# An index is a list of immutable segments plus a global doc id -> filename
+# table; documents replaced or removed by incremental builds are tombstoned.
+# Each generation directory lists its segments, which live in index/segments/.
+# Every segment belongs to one shard; a shard can be opened on its own.
+
+
+def map_file(path):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def scaled_impact_blocks(data, scale):
+    # Yields (weight, doc_ids) of weights="impact" postings, highest first.
+    # Blocks are decoded one at a time, as the caller asks for them.
+    for impact, doc_ids in decode_impact_blocks(data):
+        yield impact * scale, doc_ids
+
+
+def weight_blocks(postings):
+    # (weight, doc_ids) blocks of doc-ordered postings, highest weight first
+    ordered = sorted(postings, key=lambda posting: (-posting[1], posting[0]))
+    for weight, group in groupby(ordered, key=lambda posting: posting[1]):
+        yield weight, [doc_id for doc_id, _ in group]
+
+
+class StringTable:
+    # utf-8 strings addressed by position through a uint64 offsets file
+    def __init__(self, blob_path, offsets_path):
+        self._blob = map_file(blob_path)
+        self._offsets = map_file(offsets_path)
+
+    def __len__(self):
+        return max(len(self._offsets) // 8 - 1, 0)
+
+    def __getitem__(self, position):
+        start, end = struct.unpack_from("<QQ", self._offsets, position * 8)
+        return self._blob[start:end].decode("utf-8")
+
+    def lower_bound(self, value):
+        # First position whose string is not less than value (sorted tables)
+        key = value.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            start, end = struct.unpack_from("<QQ", self._offsets, mid * 8)
+            if self._blob[start:end] < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def find(self, value):
+        # Binary search; only valid for tables written in sorted order
+        key = value.encode("utf-8")
+        low, high = 0, len(self)
+        while low < high:
+            mid = (low + high) // 2
+            start, end = struct.unpack_from("<QQ", self._offsets, mid * 8)
+            candidate = self._blob[start:end]
+            if candidate < key:
+                low = mid + 1
+            elif candidate > key:
+                high = mid
+            else:
+                return mid
+        return None
+
+
+class BinaryIndex:
+    # One segment directory: lexicon, terms and postings
+    def __init__(self, segment_dir):
+        with open(os.path.join(segment_dir, "header.json"), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format {self.header['format_version']} in {segment_dir}"
+            )
+        self.num_docs = self.header["num_docs"]
+        self.num_terms = self.header["num_terms"]
+        self.weights = self.header["weights"]
+
+        self._lexicon = map_file(os.path.join(segment_dir, "lexicon.bin"))
+        self._terms = map_file(os.path.join(segment_dir, "terms.bin"))
+        self._postings = map_file(os.path.join(segment_dir, "postings.bin"))
+
+    def _record(self, position):
+        return LEXICON_RECORD.unpack_from(
+            self._lexicon, position * LEXICON_RECORD.size
+        )
+
+    def _term_at(self, record):
+        return self._terms[record[0] : record[0] + record[1]]
+
+    def lookup(self, term):
+        # Binary search over the sorted lexicon records
+        key = term.encode("utf-8")
+        low, high = 0, self.num_terms
+        while low < high:
+            mid = (low + high) // 2
+            record = self._record(mid)
+            candidate = self._term_at(record)
+            if candidate < key:
+                low = mid + 1
+            elif candidate > key:
+                high = mid
+            else:
+                return record
+        return None
+
+    def __contains__(self, term):
+        return self.lookup(term) is not None
+
+    def doc_frequency(self, term):
+        record = self.lookup(term)
+        return record[2] if record else 0
+
+    def max_weight(self, term):
+        record = self.lookup(term)
+        return record[5] if record else 0.0
+
+    def postings(self, term):
+        # Returns [(doc_id, weight), ...] in doc id order
+        record = self.lookup(term)
+        if record is None:
+            return []
+        _, _, df, offset, length, max_weight = record
+        block = self._postings[offset : offset + length]
+        doc_ids, weights = decode_postings(block, df, max_weight, self.weights)
+        return list(zip(doc_ids, weights))
+
+    def impact_blocks(self, term):
+        # Yields (weight, doc_ids) highest weight first; only weights="impact"
+        # segments store them in this order, other postings are sorted here
+        record = self.lookup(term)
+        if record is None:
+            return iter(())
+        if self.weights != "impact":
+            return weight_blocks(self.postings(term))
+        _, _, _, offset, length, max_weight = record
+        return scaled_impact_blocks(
+            self._postings[offset : offset + length], max_weight / 255.0
+        )
+
+    def terms(self):
+        for position in range(self.num_terms):
+            yield self._term_at(self._record(position)).decode("utf-8")
+
+
+class SegmentedIndex:
+    # The live segments listed in a generation's segments.json, queried as a
+    # single index: all of them, or only those of one shard
+    def __init__(self, generation_dir, shard=None):
+        with open(
+            os.path.join(generation_dir, SEGMENTS_FILE), "r", encoding="utf-8"
+        ) as f:
+            self.info = json.load(f)
+        if self.info["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format {self.info['format_version']} in {generation_dir}"
+            )
+        segments_dir = os.path.join(
+            os.path.dirname(os.path.normpath(generation_dir)), SEGMENTS_DIR
+        )
+        self.num_shards = self.info["num_shards"]
+        self.shard = shard
+        self.segments = [
+            BinaryIndex(os.path.join(segments_dir, segment["name"]))
+            for segment in self.info["segments"]
+            if shard is None or segment["shard"] == shard
+        ]
+        self.version = self.info["version"]
+        self.deleted = {
+            doc_id
+            for doc_id in self.info["deleted"]
+            if shard is None or doc_id % self.num_shards == shard
+        }
+        self.num_docs = sum(segment.num_docs for segment in self.segments) - len(
+            self.deleted
+        )
+        self.docnames = StringTable(
+            os.path.join(generation_dir, "docnames.bin"),
+            os.path.join(generation_dir, "docnames.idx"),
+        )
+
+    def __contains__(self, term):
+        return any(term in segment for segment in self.segments)
+
+    def doc_frequency(self, term):
+        return sum(segment.doc_frequency(term) for segment in self.segments)
+
+    def max_weight(self, term):
+        return max((segment.max_weight(term) for segment in self.segments), default=0.0)
+
+    def postings(self, term):
+        # Returns [(doc_id, weight), ...] in doc id order, without tombstoned documents
+        if len(self.segments) == 1 and not self.deleted:
+            return self.segments[0].postings(term)
+        merged = heapq.merge(*(segment.postings(term) for segment in self.segments))
+        return [posting for posting in merged if posting[0] not in self.deleted]
+
+    def impact_blocks(self, term):
+        # Yields (weight, doc_ids) highest weight first, without tombstoned documents
+        streams = [segment.impact_blocks(term) for segment in self.segments]
+        if len(streams) == 1 and not self.deleted:
+            return streams[0]
+        merged = heapq.merge(*streams, key=lambda block: -block[0])
+        return (
+            (weight, [doc_id for doc_id in doc_ids if doc_id not in self.deleted])
+            for weight, doc_ids in merged
+        )
+
+    def filename(self, doc_id):
+        return self.docnames[doc_id]
+
+    def terms(self):
+        previous = None
+        for term in heapq.merge(*(segment.terms() for segment in self.segments)):
+            if term != previous:
+                yield term
+                previous = term
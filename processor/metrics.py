@@ -0,0 +1,196 @@
+import time
+import threading
+from contextlib import contextmanager
+
+# In-process metrics in the Prometheus text format: counters and histograms
+# with labels, plus gauges read from a callback when /metrics is scraped.
+# Every process keeps its own; with several server processes each one has to
+# be scraped (or the numbers summed) on its own.
+
+# Seconds; from well under a millisecond for a cached lookup up to slow
+# spelling corrections on a large vocabulary
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.type = "counter"
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        if not values and not self.labels:
+            values = [((), 0)]
+        for label_values, value in values:
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.type = "histogram"
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def count(self, *label_values):
+        series = self._series.get(label_values)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            series = sorted(
+                (labels, list(values)) for labels, values in self._series.items()
+            )
+        for label_values, values in series:
+            for bound, count in zip(
+                self.buckets + (float("inf"),), values[:-2] + [values[-1]]
+            ):
+                labels = format_labels(
+                    self.labels, label_values, [("le", format_value(bound))]
+                )
+                yield self.name + "_bucket", labels, count
+            labels = format_labels(self.labels, label_values)
+            yield self.name + "_sum", labels, values[-2]
+            yield self.name + "_count", labels, values[-1]
+
+
+class Gauge:
+    # Read when scraped: callback() returns {label values tuple: value}. Also
+    # used with type="counter" for totals something else already keeps count of.
+    def __init__(self, name, help, callback, labels=(), type="gauge"):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.type = type
+        self.callback = callback
+
+    def samples(self):
+        for label_values, value in sorted(self.callback().items()):
+            yield self.name, format_labels(self.labels, label_values), value
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def gauge(self, name, help, callback, labels=(), type="gauge"):
+        return self.register(Gauge(name, help, callback, labels, type))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Trace:
+    # Time spent per stage during one request; a stage run more than once
+    # (e.g. once per query of a batch) adds up
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.queries = []
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        # Server-Timing header value, durations in milliseconds
+        parts = [
+            f"{stage};dur={seconds * 1000:.3f}"
+            for stage, seconds in self.stages.items()
+        ]
+        parts.append(f"total;dur={total * 1000:.3f}")
+        return ", ".join(parts)
+
+
+@contextmanager
+def timed(histogram, stage, trace=None):
+    # Observes how long the block took in histogram (labelled with stage) and
+    # adds it to trace if there is one
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        histogram.observe(seconds, stage)
+        if trace is not None:
+            trace.add(stage, seconds)
@@ -0,0 +1,108 @@
+import heapq
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from evaluator import top_k
+from index_reader import SegmentedIndex
+
+# Scatter-gather over the shards of the index. A query is sent to every shard
+# in a pool of worker processes, each ranks it against its shard with the
+# bounded heap from evaluator.py, and the per-shard top-k lists are merged
+# into the global top k. Weights use the idf of the whole index, so scores from
+# different shards are comparable, and since every document lives in exactly
+# one shard the merged list matches ranking the whole index at once.
+
+OPEN_GENERATIONS = 2  # generations whose shards a worker keeps open
+
+# In each worker process: generation dir -> {shard: SegmentedIndex}
+_open_shards = OrderedDict()
+# In each worker process: shared by the pool, see ScatterGather.open_generation
+_barrier = None
+
+
+def set_barrier(barrier):
+    global _barrier
+    _barrier = barrier
+
+
+def shard_index(generation_dir, shard):
+    # The oldest generation is dropped once a newer one is opened
+    shards = _open_shards.setdefault(generation_dir, {})
+    _open_shards.move_to_end(generation_dir)
+    while len(_open_shards) > OPEN_GENERATIONS:
+        _open_shards.popitem(last=False)
+    if shard not in shards:
+        shards[shard] = SegmentedIndex(generation_dir, shard)
+    return shards[shard]
+
+
+def open_shards(generation_dir, num_shards):
+    # Maps every shard of the generation. The maps outlive the files, so the
+    # worker keeps answering for the generation after the indexer has
+    # garbage collected it. Waiting for the other workers makes each worker
+    # take exactly one of these tasks, also when opening fails.
+    try:
+        for shard in range(num_shards):
+            shard_index(generation_dir, shard)
+    finally:
+        _barrier.wait()
+
+
+def search_shard(generation_dir, shard, query_terms, k, strategy, budget):
+    index = shard_index(generation_dir, shard)
+    return top_k(index, query_terms, k=k, strategy=strategy, **budget)
+
+
+def merge_top_k(shard_results, k):
+    # Every list is best first with ties going to the lower doc id, as in TopK
+    merged = heapq.merge(*shard_results, key=lambda result: (-result[1], result[0]))
+    return list(islice(merged, k))
+
+
+class ScatterGather:
+    def __init__(self, workers=0):
+        # With no workers every query is ranked in-process over all shards
+        self.pool = None
+        self.workers = workers
+        if workers > 0:
+            self.pool = ProcessPoolExecutor(
+                max_workers=workers,
+                initializer=set_barrier,
+                initargs=(multiprocessing.Barrier(workers),),
+            )
+            # Start the workers now, before the server starts any threads
+            self.pool.submit(int).result()
+
+    def open_generation(self, generation):
+        # Opens the generation in every worker before it becomes current, so
+        # a worker never opens a generation by path once it may be gone
+        num_shards = generation.index.num_shards
+        if self.pool is None or num_shards == 1:
+            return
+        futures = [
+            self.pool.submit(open_shards, generation.path, num_shards)
+            for _ in range(self.workers)
+        ]
+        for future in futures:
+            future.result()
+
+    def top_k(self, generation, query_terms, k=5, strategy="daat", **budget):
+        # Returns [(doc_id, score), ...] best first, like evaluator.top_k. A
+        # saat budget (max_postings, max_seconds) applies to every shard.
+        num_shards = generation.index.num_shards
+        if self.pool is None or num_shards == 1:
+            return top_k(
+                generation.index, query_terms, k=k, strategy=strategy, **budget
+            )
+        futures = [
+            self.pool.submit(
+                search_shard, generation.path, shard, query_terms, k, strategy, budget
+            )
+            for shard in range(num_shards)
+        ]
+        return merge_top_k([future.result() for future in futures], k)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
@@ -0,0 +1,128 @@
+import os
+import json
+import struct
+from index_reader import StringTable, map_file
+from index_format import FORMAT_VERSION, from_little_endian
+
+# Spelling correction over the trigram index written by indexer/spelling_index.py.
+# Candidates are the terms sharing the most trigrams with the query word, plus
+# the shorter terms that occur inside it and the longer terms it occurs in
+# (WRatio scores both 90 through its partial ratio). Only the candidates are
+# scored with fuzzywuzzy's WRatio, the scorer process.extractOne uses, instead
+# of scanning the whole vocabulary. Ties go to the first term in vocabulary
+# order, as with extractOne.
+# fuzzywuzzy is imported on the first correction, not at startup.
+
+MAX_CANDIDATES = 50
+MIN_OVERLAP = 0.2  # Dice coefficient of the trigram sets
+
+
+def trigrams(term):
+    # Must match indexer/spelling_index.py
+    padded = f"  {term} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class SpellingIndex:
+    def __init__(self, spelling_dir):
+        with open(os.path.join(spelling_dir, "header.json"), "r", encoding="utf-8") as f:
+            self.header = json.load(f)
+        if self.header["format_version"] != FORMAT_VERSION:
+            raise ValueError(
+                f"Unsupported index format {self.header['format_version']} in {spelling_dir}"
+            )
+        self.vocabulary = StringTable(
+            os.path.join(spelling_dir, "vocab.bin"),
+            os.path.join(spelling_dir, "vocab.idx"),
+        )
+        self.grams = StringTable(
+            os.path.join(spelling_dir, "grams.bin"),
+            os.path.join(spelling_dir, "grams.idx"),
+        )
+        self._gram_offsets = map_file(os.path.join(spelling_dir, "gram_offsets.idx"))
+        self._gram_terms = map_file(os.path.join(spelling_dir, "gram_terms.bin"))
+
+    def __contains__(self, term):
+        return self.vocabulary.find(term) is not None
+
+    def _terms_at(self, position):
+        start, end = struct.unpack_from("<QQ", self._gram_offsets, position * 8)
+        return from_little_endian("I", self._gram_terms[start * 4 : end * 4])
+
+    def _terms_with(self, gram):
+        position = self.grams.find(gram)
+        if position is None:
+            return []
+        return self._terms_at(position)
+
+    def containing(self, term):
+        # Term ids of the vocabulary terms that term occurs in. A longer word's
+        # own trigrams all occur in them. A word of two characters is followed
+        # by a character or the end padding, so it starts one of their
+        # trigrams. A single character starts one too unless it ends the term,
+        # and then it is the middle of "xc ", found by scanning the trigrams.
+        if len(term) <= 2:
+            term_ids = set()
+            position = self.grams.lower_bound(term)
+            while position < len(self.grams) and self.grams[position].startswith(term):
+                term_ids.update(self._terms_at(position))
+                position += 1
+            if len(term) == 1:
+                for position in range(len(self.grams)):
+                    if self.grams[position][1:] == term + " ":
+                        term_ids.update(self._terms_at(position))
+        else:
+            inner = [term[i : i + 3] for i in range(len(term) - 2)]
+            term_ids = set(self._terms_with(inner[0]))
+            for gram in inner[1:]:
+                if not term_ids:
+                    break
+                term_ids.intersection_update(self._terms_with(gram))
+        return {term_id for term_id in term_ids if term in self.vocabulary[term_id]}
+
+    def candidates(self, term):
+        # Term ids ranked by trigram overlap with the given (processed) word
+        grams = trigrams(term)
+        shared = {}
+        for gram in grams:
+            for term_id in self._terms_with(gram):
+                shared[term_id] = shared.get(term_id, 0) + 1
+
+        ranked = []
+        for term_id, count in shared.items():
+            # A padded term of n characters has n + 1 trigrams
+            overlap = 2 * count / (len(grams) + len(self.vocabulary[term_id]) + 1)
+            if overlap >= MIN_OVERLAP:
+                ranked.append((-overlap, term_id))
+        ranked.sort()
+        candidates = {term_id for _, term_id in ranked[:MAX_CANDIDATES]}
+
+        # WRatio switches to partial matching when one string is 1.5x longer
+        longest = int(len(term) / 1.5)
+        for length in range(2, longest + 1):
+            for start in range(len(term) - length + 1):
+                term_id = self.vocabulary.find(term[start : start + length])
+                if term_id is not None:
+                    candidates.add(term_id)
+        # and scales it down to 0.6, below any useful threshold, past 8x
+        for term_id in self.containing(term):
+            if len(term) * 1.5 <= len(self.vocabulary[term_id]) <= len(term) * 8:
+                candidates.add(term_id)
+        return candidates
+
+    def correct(self, term, threshold=80):
+        # Returns the best vocabulary match scoring at least threshold, else the
+        # word itself. Words already in the vocabulary are never corrected.
+        from fuzzywuzzy import fuzz, utils
+
+        processed = utils.full_process(term)
+        if processed in self:
+            return processed
+
+        best_term, best_score = None, 0
+        for term_id in sorted(self.candidates(processed)):
+            candidate = self.vocabulary[term_id]
+            score = fuzz.WRatio(processed, candidate)
+            if score > best_score:
+                best_term, best_score = candidate, score
+        return best_term if best_score >= threshold else term
@@ -0,0 +1,57 @@
+import time
+from contextlib import contextmanager
+
+# Progress of loading an index generation, step by step: the server's startup
+# (reported by /readyz and printed once ready) and every hot reload after it.
+
+
+def milliseconds(seconds):
+    return round(seconds * 1000, 3)
+
+
+class LoadProgress:
+    def __init__(self, started=None):
+        self.started = time.perf_counter() if started is None else started
+        self.generation = None
+        self.steps = {}  # finished step -> seconds, in order
+        self.current_step = None
+        self.finished = None  # seconds from started to ready
+        self.error = None
+
+    @contextmanager
+    def step(self, name):
+        self.current_step = name
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+            self.current_step = None
+
+    def add(self, name, seconds):
+        self.steps[name] = self.steps.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.finished = time.perf_counter() - self.started
+
+    def fail(self, error):
+        self.error = str(error)
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    def as_dict(self):
+        elapsed = self.finished if self.done else time.perf_counter() - self.started
+        return {
+            "generation": self.generation,
+            "elapsed_ms": milliseconds(elapsed),
+            "step": self.current_step,
+            "steps_ms": {name: milliseconds(s) for name, s in self.steps.items()},
+            "error": self.error,
+        }
+
+    def summary(self):
+        # "212.3 ms (imports 150.1 ms, bundle 0.4 ms, ...)"
+        steps = ", ".join(f"{name} {s * 1000:.1f} ms" for name, s in self.steps.items())
+        return f"{(self.finished or 0) * 1000:.1f} ms ({steps})"
@@ -0,0 +1,108 @@
+import os
+import sys
+import json
+import asyncio
+import tempfile
+import subprocess
+import unittest
+
+# Run from processor/: python -m unittest test_asgi
+#
+# asgi.py opens the index when it is imported, so setUpModule publishes an
+# empty index to a temporary directory first, the way the crawler's streaming
+# pipeline starts one, and points INDEX_DIR at it. The index is written by a
+# separate interpreter in indexer/, whose doc_store module is not this one.
+
+INDEXER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "indexer")
+EMPTY_INDEX = """
+import sys
+from generations import new_generation, publish_generation, writer_lock
+from incremental_index import start_index
+from spelling_index import write_spelling_index
+from startup_bundle import write_startup_bundle
+
+with writer_lock(sys.argv[1]):
+    generation_dir = new_generation(sys.argv[1])
+    start_index(generation_dir)
+    write_spelling_index(generation_dir)
+    write_startup_bundle(generation_dir, stop_words=[])
+    publish_generation(generation_dir)
+"""
+
+SEARCH_QUEUE = 8
+asgi = None
+index_dir = None
+
+
+def setUpModule():
+    global asgi, index_dir
+    index_dir = tempfile.TemporaryDirectory()
+    subprocess.run(
+        [sys.executable, "-c", EMPTY_INDEX, index_dir.name],
+        cwd=INDEXER_DIR,
+        check=True,
+    )
+
+    os.environ.update(
+        INDEX_DIR=index_dir.name,
+        INDEX_POLL_INTERVAL="0",
+        SHARD_WORKERS="0",
+        SEARCH_QUEUE=str(SEARCH_QUEUE),
+    )
+    import asgi
+
+
+def tearDownModule():
+    asgi.searcher.close()
+    index_dir.cleanup()
+
+
+def post(path, body):
+    # Sends one request to the ASGI app; returns (status, decoded JSON body)
+    messages = [{"type": "http.request", "body": json.dumps(body).encode("utf-8")}]
+    sent = []
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": path, "method": "POST", "query_string": b""}
+    asyncio.run(asgi.app(scope, receive, send))
+    return sent[0]["status"], json.loads(sent[1]["body"])
+
+
+class BatchAdmissionTest(unittest.TestCase):
+    def test_batch_larger_than_queue(self):
+        queries = [f"query {n}" for n in range(SEARCH_QUEUE * 3)]
+        status, body = post("/api/search/batch", {"queries": queries})
+        self.assertEqual(status, 200)
+        self.assertEqual([result["query"] for result in body["results"]], queries)
+        self.assertEqual(asgi.searcher.pending, 0)
+
+    def test_full_queue_rejects_batch_before_searching(self):
+        searcher = asgi.searcher
+        searcher.pending = searcher.max_pending - 1
+        try:
+            status, body = post("/api/search/batch", {"queries": ["solar", "wind"]})
+            self.assertEqual(status, 503)
+            # Nothing of the rejected batch was submitted
+            self.assertEqual(searcher.pending, searcher.max_pending - 1)
+            self.assertEqual(searcher._in_flight, {})
+        finally:
+            searcher.pending = 0
+
+    def test_batch_that_fits_is_admitted(self):
+        searcher = asgi.searcher
+        searcher.pending = searcher.max_pending - 2
+        try:
+            status, body = post("/api/search/batch", {"queries": ["solar", "wind"]})
+            self.assertEqual(status, 200)
+            self.assertEqual(len(body["results"]), 2)
+        finally:
+            searcher.pending = 0
+
+
+if __name__ == "__main__":
+    unittest.main()